@@ -4,6 +4,7 @@ from tests.fixtures.transactions import minimal
 from tests.fixtures.apm_server import apm_server
 from tests.fixtures.es import es
 from tests.fixtures.kibana import kibana
+from tests.fixtures.load_hooks import load_hooks
 from tests.fixtures.agents import flask
 from tests.fixtures.agents import django
 from tests.fixtures.agents import express
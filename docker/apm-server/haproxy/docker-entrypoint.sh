@@ -3,9 +3,30 @@
 set -e
 
 backends=${APM_SERVER_COUNT:-1}
+balance=${APM_SERVER_BALANCE:-roundrobin}
+stats_port=${APM_SERVER_PROXY_STATS_PORT:-8404}
 
 config=/usr/local/etc/haproxy/haproxy.cfg
 
+# connection handling, haproxy's defaults apply when unset
+options=""
+case "${APM_SERVER_KEEPALIVE}" in
+    keep-alive) options="    option http-keep-alive" ;;
+    # balance every request, not only the first one of a client connection
+    server-close) options="    option http-server-close" ;;
+    close) options="    option httpclose" ;;
+esac
+if [ -n "${APM_SERVER_HTTP_REUSE}" ]; then
+    options="${options}
+    http-reuse ${APM_SERVER_HTTP_REUSE}"
+fi
+
+server_options="check fall 3 rise 2"
+if [ -n "${APM_SERVER_MAXCONN}" ]; then
+    # requests over the limit wait in the backend queue
+    server_options="${server_options} maxconn ${APM_SERVER_MAXCONN}"
+fi
+
 # generate configuration file
 cat > $config <<EOF
 defaults
@@ -17,18 +38,28 @@ frontend http
     bind *:8200
     mode http
     default_backend servers
-    stats enable
 
 backend servers
     mode http
-    balance roundrobin
+    balance ${balance}
+${options}
     option httpchk HEAD /healthcheck HTTP/1.0
 EOF
 
 for ((i=1; i<=$backends; i++)); do
 cat >> $config <<EOF
-    server apm-server-${i} apm-server-${i}:8200 check fall 3 rise 2
+    server apm-server-${i} apm-server-${i}:8200 ${server_options}
 EOF
 done
 
+cat >> $config <<EOF
+
+listen stats
+    bind *:${stats_port}
+    mode http
+    stats enable
+    stats uri /stats
+    stats refresh 10s
+EOF
+
 exec "$@"
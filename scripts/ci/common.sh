@@ -8,6 +8,9 @@ function runTests() {
   if [ -z "${REUSE_CONTAINERS}" ]; then
     trap "stopEnv" EXIT
     targets="destroy-env"
+  else
+    # keep a running stack with the same configuration, only resetting its data
+    export COMPOSE_ARGS="${COMPOSE_ARGS} --reuse"
   fi
   targets="${targets} $@"
   export VENV=${VENV:-${TMPDIR:-/tmp/}venv-$$}
@@ -0,0 +1,27 @@
+# bash completion for compose.py
+#
+#   source scripts/compose-completion.bash
+#
+# options are read from the cache `compose.py list-options` keeps, as long as it is newer than compose.py,
+# so most completions don't start python at all.
+
+_compose_py() {
+    local cur=${COMP_WORDS[COMP_CWORD]} script=${COMP_WORDS[0]} command="" options i
+    local cache=${XDG_CACHE_HOME:-$HOME/.cache}/apm-integration-testing/compose-options
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        if [[ ${COMP_WORDS[i]} != -* ]]; then
+            command=${COMP_WORDS[i]}
+            break
+        fi
+    done
+    [[ -f ${script} ]] || script=$(type -P "${script}")
+    if [[ -n ${script} && ${cache} -nt ${script} ]]; then
+        options=$(sed -n "s/^${command}: //p" "${cache}")
+    else
+        # quoted, an empty command lists only the top level options and subcommands
+        options=$("${COMP_WORDS[0]}" list-options "${command}" 2>/dev/null)
+    fi
+    COMPREPLY=($(compgen -W "${options}" -- "${cur}"))
+}
+
+complete -F _compose_py compose.py ./compose.py scripts/compose.py ./scripts/compose.py
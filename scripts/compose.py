@@ -9,22 +9,27 @@ from abc import abstractmethod
 import argparse
 import collections
 import datetime
+import errno
+import fnmatch
 import functools
 import glob
-import inspect
+import hashlib
 import json
 import logging
-import multiprocessing
 import os
 import re
+import socket
+import struct
 import sys
 import subprocess
+import time
 
+# modules that are slow to import and only needed by some commands are imported where they're used,
+# compose.py runs for every tab completion.
 try:
-    from urllib.request import urlopen, urlretrieve, Request
+    from urllib.parse import urlencode
 except ImportError:
-    from urllib import urlretrieve
-    from urllib2 import urlopen, Request
+    from urllib import urlencode
 
 #
 # package info
@@ -49,13 +54,74 @@ def discover_services(mod=None):
         mod = sys.modules[__name__]
     for obj in dir(mod):
         cls = getattr(mod, obj)
-        if inspect.isclass(cls) and issubclass(cls, Service) \
+        if isinstance(cls, type) and issubclass(cls, Service) \
                 and cls not in (Service, OpbeansService):
             ret.append(cls)
     return ret
 
 
+def options_cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "apm-integration-testing", "compose-options")
+
+
+def options_cache_key():
+    """cached options are valid for this version of this script"""
+    return "{}:{}".format(os.path.getmtime(os.path.realpath(__file__)), __version__)
+
+
+def load_options_cache(path=None):
+    """
+    options per subcommand, as stored by save_options_cache, or None if missing or stale.
+
+    The cache is plain text for the bash completion to read directly: the key on the first line,
+    then a line per subcommand, "<subcommand>: <options>", top level options and subcommands are on the ": " line.
+    """
+    try:
+        with open(path or options_cache_path()) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return None
+    if not lines or lines[0] != options_cache_key():
+        return None
+    options = {}
+    for line in lines[1:]:
+        command, _, opts = line.partition(": ")
+        options[command] = opts.split()
+    return options
+
+
+def select_options(options, command=None):
+    """the options of command, '' for the top level ones and subcommands, every option without a command"""
+    if command is None:
+        return sorted(set(option for opts in options.values() for option in opts))
+    return options.get(command, [])
+
+
+def save_options_cache(options, path=None):
+    path = path or options_cache_path()
+    # completions may run concurrently, never leave a partially written cache behind
+    tmp = "{}.{}".format(path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(tmp, "w") as f:
+            f.write(options_cache_key() + "\n")
+            for command in sorted(options):
+                f.write("{}: {}\n".format(command, " ".join(options[command])))
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        # caching is best effort
+        pass
+
+
 def _load_image(cache_dir, url):
+    try:
+        from urllib.request import urlopen, urlretrieve, Request
+    except ImportError:
+        from urllib import urlretrieve
+        from urllib2 import urlopen, Request
+
     filename = os.path.basename(url)
     filepath = os.path.join(cache_dir, filename)
     etag_cache_file = filepath + '.etag'
@@ -92,6 +158,8 @@ def _load_image(cache_dir, url):
 
 
 def load_images(urls, cache_dir):
+    import multiprocessing
+
     load_image_fn = functools.partial(_load_image, cache_dir)
     pool = multiprocessing.Pool(4)
     # b/c python2
@@ -105,8 +173,18 @@ def load_images(urls, cache_dir):
         sys.exit(1)
 
 
+DEFAULT_COMPOSE_VERSION = "2.1"
+# the first docker-compose to build with BuildKit, through the docker CLI, with COMPOSE_DOCKER_CLI_BUILD=1
+BUILDKIT_COMPOSE_VERSION = "1.25.0"
+
 DEFAULT_HEALTHCHECK_INTERVAL = "5s"
 DEFAULT_HEALTHCHECK_RETRIES = 12
+# docker defaults, for healthchecks that don't set them
+DOCKER_HEALTHCHECK_INTERVAL = "30s"
+DOCKER_HEALTHCHECK_RETRIES = 3
+
+FAST_HEALTHCHECK_INTERVAL = "1s"
+HEALTHCHECK_PROFILES = ("default", "fast")
 
 
 def curl_healthcheck(port, host="localhost", path="/healthcheck",
@@ -120,6 +198,85 @@ def curl_healthcheck(port, host="localhost", path="/healthcheck",
             }
 
 
+def named_volumes(services):
+    """names of the volumes mounted by rendered services, other mounts are host paths"""
+    names = set()
+    for content in services.values():
+        for volume in content.get("volumes") or []:
+            source = volume.split(":", 1)[0]
+            if "/" not in source and not source.startswith("."):
+                names.add(source)
+    return names
+
+
+def duration_seconds(duration):
+    """parse a compose duration like 1m30s, bare numbers are seconds"""
+    if re.match(r"^\d+(\.\d+)?$", str(duration)):
+        return float(duration)
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", duration)
+    if not parts or "".join(n + u for n, u in parts) != duration:
+        raise ValueError("invalid duration: {}".format(duration))
+    return sum(float(n) * units[u] for n, u in parts)
+
+
+def fast_healthcheck(healthcheck, start_period):
+    """
+    Probe every FAST_HEALTHCHECK_INTERVAL so dependents start as soon as a service is ready.
+
+    Failures during start_period don't count against retries, and retries are raised to keep
+    at least the total time the original healthcheck allowed a service to become healthy.
+    """
+    interval = duration_seconds(healthcheck.get("interval", DOCKER_HEALTHCHECK_INTERVAL))
+    retries = healthcheck.get("retries", DOCKER_HEALTHCHECK_RETRIES)
+    fast_interval = duration_seconds(FAST_HEALTHCHECK_INTERVAL)
+    fast = dict(healthcheck)
+    fast.update({
+        "interval": FAST_HEALTHCHECK_INTERVAL,
+        "retries": max(retries, int(-(-interval * retries // fast_interval))),
+        "start_period": start_period,
+    })
+    return fast
+
+
+RESOURCE_KEYS = ("cpus", "cpuset", "mem_limit")
+
+DEFAULT_DATA_TMPFS_SIZE = "2g"
+
+
+def load_resource_profile(path):
+    """
+    argparse type for --resource-profile, a JSON object of service names or patterns to resource limits, eg
+
+        {"elasticsearch": {"cpuset": "0-3", "mem_limit": "8g"}, "apm-server*": {"cpuset": "4-5"}, "*": {"cpus": 1}}
+    """
+    try:
+        with open(path) as f:
+            profile = json.load(f, object_pairs_hook=collections.OrderedDict)
+    except (IOError, OSError, ValueError) as e:
+        raise argparse.ArgumentTypeError("can't read resource profile {}: {}".format(path, e))
+    if not isinstance(profile, dict):
+        raise argparse.ArgumentTypeError("resource profile {} is not a JSON object".format(path))
+    for pattern, limits in profile.items():
+        unknown = set(limits) - set(RESOURCE_KEYS) if isinstance(limits, dict) else None
+        if unknown is None or unknown:
+            raise argparse.ArgumentTypeError("resource profile {}: {} must only set {}".format(
+                path, pattern, ", ".join(RESOURCE_KEYS)))
+    return profile
+
+
+def resource_limits(profile, name):
+    """limits for a service in a resource profile, an exact name wins over the first matching pattern"""
+    if not profile:
+        return {}
+    if name in profile:
+        return dict(profile[name])
+    for pattern, limits in profile.items():
+        if fnmatch.fnmatchcase(name, pattern):
+            return dict(limits)
+    return {}
+
+
 def parse_version(version):
     res = []
     for x in version.split('.'):
@@ -131,6 +288,15 @@ def parse_version(version):
     return res
 
 
+def buildkit_supported():
+    """whether the installed docker-compose builds with BuildKit"""
+    try:
+        version = subprocess.check_output(["docker-compose", "version", "--short"]).decode("utf8").strip()
+        return parse_version(version.lstrip("v")) >= parse_version(BUILDKIT_COMPOSE_VERSION)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return False
+
+
 class Service(object):
     """encapsulate docker-compose service definition"""
 
@@ -138,8 +304,16 @@ class Service(object):
     # start if any opbeans service starts
     opbeans_side_car = False
 
+    # roughly how long the service takes to come up, healthcheck failures
+    # during this period are not counted with the fast healthcheck profile
+    HEALTHCHECK_START_PERIOD = "10s"
+
+    # resource limits used when neither the service's options nor the resource profile set them
+    default_resources = {}
+
     def __init__(self, **options):
         self.options = options
+        self.healthcheck_profile = options.get("healthcheck_profile", "default")
 
         if not hasattr(self, "docker_registry"):
             self.docker_registry = "docker.elastic.co"
@@ -163,6 +337,16 @@ class Service(object):
     def bc(self):
         return self._bc
 
+    def compose_version(self):
+        """minimum docker-compose file format version needed to render this service"""
+        if self.healthcheck_profile == "fast":
+            # healthcheck start_period
+            return "2.3"
+        if "cpus" in self.resources():
+            # cpus is new in 2.2
+            return "2.2"
+        return DEFAULT_COMPOSE_VERSION
+
     def default_container_name(self):
         return "_".join(("localtesting", self.version, self.name()))
 
@@ -233,9 +417,37 @@ class Service(object):
         for prune in "image", "labels", "logging":
             if content[prune] is None:
                 del (content[prune])
+        self.render_healthcheck(content)
+        self.render_resources(content)
 
         return {self.name(): content}
 
+    def render_healthcheck(self, content):
+        """apply the healthcheck profile to rendered service content"""
+        if self.healthcheck_profile == "fast" and "healthcheck" in content:
+            content["healthcheck"] = fast_healthcheck(content["healthcheck"], self.HEALTHCHECK_START_PERIOD)
+
+    def data_mount(self, content, volume, tmpfs_path):
+        """mount the data volume, or with --data-tmpfs an in memory tmpfs at tmpfs_path"""
+        if self.options.get("data_tmpfs"):
+            # tmpfs pages count against the container's memory limit
+            size = self.options.get("data_tmpfs_size") or DEFAULT_DATA_TMPFS_SIZE
+            content.setdefault("tmpfs", []).append("{}:size={},mode=1777".format(tmpfs_path, size))
+        else:
+            content.setdefault("volumes", []).append(volume)
+        return content
+
+    def resources(self, name=None):
+        """resource limits from the resource profile for this service, or the service it renders as name"""
+        return resource_limits(self.options.get("resource_profile"), name or self.name())
+
+    def render_resources(self, content, name=None):
+        """apply resource limits to rendered service content, limits set by the service's own options win"""
+        for key, value in self.resources(name).items():
+            content.setdefault(key, value)
+        for key, value in self.default_resources.items():
+            content.setdefault(key, value)
+
     @property
     def version(self):
         return self._version
@@ -308,6 +520,59 @@ class ApmServer(StackService, Service):
     DEFAULT_MONITOR_PORT = "6060"
     DEFAULT_OUTPUT = "elasticsearch"
     OUTPUTS = {"elasticsearch", "kafka", "logstash"}
+    # name of the load balancer in resource profiles, it is rendered as apm-server in front of the apm-server-N backends
+    PROXY_NAME = "apm-server-load-balancer"
+    PROXY_BALANCE = ["roundrobin", "leastconn", "source"]
+    PROXY_HTTP_REUSE = ["never", "safe", "aggressive", "always"]
+    PROXY_KEEPALIVE = ["keep-alive", "server-close", "close"]
+    PROXY_STATS_PORT = "8404"
+    # throughput tuning options and the settings they override, apm-server defaults apply to unset options
+    TUNING_SETTINGS = [
+        ("apm_server_queue_size", "queue.mem.events"),
+        ("apm_server_flush_interval", "queue.mem.flush.timeout"),
+        ("apm_server_output_workers", "output.{output}.worker"),
+        ("apm_server_bulk_max_size", "output.{output}.bulk_max_size"),
+        ("apm_server_compression_level", "output.{output}.compression_level"),
+    ]
+    # outputs that have the setting of a tuning option, all outputs have the others. kafka has no worker setting.
+    TUNING_OUTPUTS = {
+        "apm_server_output_workers": {"elasticsearch", "logstash"},
+    }
+    # setup.template.settings of each --apm-server-template-preset, to compare their ingest and storage cost
+    DEFAULT_TEMPLATE_PRESET = "default"
+    TEMPLATE_PRESETS = collections.OrderedDict([
+        ("default", [
+            ("index.number_of_replicas", "0"),
+            ("index.number_of_shards", "1"),
+            ("index.refresh_interval", "1ms"),
+        ]),
+        ("best-compression", [
+            ("index.codec", "best_compression"),
+            ("index.number_of_replicas", "0"),
+            ("index.number_of_shards", "1"),
+            ("index.refresh_interval", "1ms"),
+        ]),
+        # elasticsearch's default refresh interval
+        ("refresh-1s", [
+            ("index.number_of_replicas", "0"),
+            ("index.number_of_shards", "1"),
+            ("index.refresh_interval", "1s"),
+        ]),
+        # fsync the translog every 5s instead of on every bulk request
+        ("async-translog", [
+            ("index.number_of_replicas", "0"),
+            ("index.number_of_shards", "1"),
+            ("index.refresh_interval", "1ms"),
+            ("index.translog.durability", "async"),
+        ]),
+        ("bulk-ingest", [
+            ("index.codec", "best_compression"),
+            ("index.number_of_replicas", "0"),
+            ("index.number_of_shards", "1"),
+            ("index.refresh_interval", "30s"),
+            ("index.translog.durability", "async"),
+        ]),
+    ])
 
     def __init__(self, **options):
         super(ApmServer, self).__init__(**options)
@@ -322,14 +587,25 @@ class ApmServer(StackService, Service):
             ("logging.json", "true"),
             ("logging.metrics.enabled", "false"),
             ("setup.kibana.host", "kibana:5601"),
-            ("setup.template.settings.index.number_of_replicas", "0"),
-            ("setup.template.settings.index.number_of_shards", "1"),
-            ("setup.template.settings.index.refresh_interval", "1ms"),
+        ] + [
+            ("setup.template.settings." + setting, value) for setting, value in
+            self.TEMPLATE_PRESETS[options.get("apm_server_template_preset") or self.DEFAULT_TEMPLATE_PRESET]
+        ] + [
             ("xpack.monitoring.elasticsearch", "true"),
             ("xpack.monitoring.enabled", "true")
         ]
+        index_settings = {
+            "setup.template.settings.index.number_of_replicas": options.get("apm_server_index_replicas"),
+            "setup.template.settings.index.number_of_shards": options.get("apm_server_index_shards"),
+        }
+        self.apm_server_command_args = [
+            (param, value if index_settings.get(param) is None else str(index_settings[param]))
+            for param, value in self.apm_server_command_args
+        ]
         self.depends_on = {"elasticsearch": {"condition": "service_healthy"}}
         self.build = self.options.get("apm_server_build")
+        # the cached source build needs BuildKit, start_handler checks for it
+        self.buildkit = self.options.get("apm_server_buildkit", True)
 
         if self.options.get("enable_kibana", True):
             self.depends_on["kibana"] = {"condition": "service_healthy"}
@@ -340,30 +616,49 @@ class ApmServer(StackService, Service):
 
         self.apm_server_monitor_port = options.get("apm_server_monitor_port", self.DEFAULT_MONITOR_PORT)
         self.apm_server_output = options.get("apm_server_output", self.DEFAULT_OUTPUT)
+        es_hosts = ["{}:9200".format(Elasticsearch.node_name(n))
+                    for n in range(1, (options.get("elasticsearch_nodes") or 1) + 1)]
         if self.apm_server_output == "elasticsearch":
             self.apm_server_command_args.extend([
                 ("output.elasticsearch.enabled", "true"),
-                ("output.elasticsearch.hosts", "[elasticsearch:9200]"),
+                ("output.elasticsearch.hosts", "[{}]".format(", ".join(es_hosts))),
             ])
         else:
             self.apm_server_command_args.extend([
                 ("output.elasticsearch.enabled", "false"),
-                ("output.elasticsearch.hosts", "[elasticsearch:9200]"),
-                ("xpack.monitoring.elasticsearch.hosts", "[\"elasticsearch:9200\"]"),
+                ("output.elasticsearch.hosts", "[{}]".format(", ".join(es_hosts))),
+                ("xpack.monitoring.elasticsearch.hosts", "[{}]".format(", ".join('"' + h + '"' for h in es_hosts))),
             ])
             if self.apm_server_output == "kafka":
+                kafka_hosts = Kafka.bootstrap_servers(options.get("kafka_brokers") or 1)
                 self.apm_server_command_args.extend([
                     ("output.kafka.enabled", "true"),
-                    ("output.kafka.hosts", "[\"kafka:9092\"]"),
+                    ("output.kafka.hosts", "[{}]".format(", ".join('"' + h + '"' for h in kafka_hosts))),
                     ("output.kafka.topics", "[{default: 'apm', topic: 'apm-%{[context.service.name]}'}]"),
                 ])
+                for option, setting in (("apm_server_kafka_compression", "output.kafka.compression"),
+                                        ("apm_server_kafka_required_acks", "output.kafka.required_acks")):
+                    if options.get(option) is not None:
+                        self.apm_server_command_args.append((setting, str(options[option])))
             elif self.apm_server_output == "logstash":
                 self.apm_server_command_args.extend([
                     ("output.logstash.enabled", "true"),
                     ("output.logstash.hosts", "[\"logstash:5044\"]"),
                 ])
 
+        for option, setting in self.TUNING_SETTINGS:
+            value = options.get(option)
+            if value is not None and self.apm_server_output in self.TUNING_OUTPUTS.get(option, self.OUTPUTS):
+                self.apm_server_command_args.append((setting.format(output=self.apm_server_output), str(value)))
+
         self.apm_server_count = options.get("apm_server_count", 1)
+        self.proxy_environment = {
+            "APM_SERVER_BALANCE": options.get("apm_server_balance"),
+            "APM_SERVER_HTTP_REUSE": options.get("apm_server_http_reuse"),
+            "APM_SERVER_KEEPALIVE": options.get("apm_server_keepalive"),
+            "APM_SERVER_MAXCONN": options.get("apm_server_maxconn"),
+        }
+        self.proxy_stats_port = options.get("apm_server_proxy_stats_port", self.PROXY_STATS_PORT)
 
     @classmethod
     def add_arguments(cls, parser):
@@ -384,6 +679,89 @@ class ApmServer(StackService, Service):
             default=1,
             help="apm-server count. >1 adds a load balancer service to round robin traffic between servers.",
         )
+        parser.add_argument(
+            "--apm-server-kafka-compression",
+            choices=["none", "gzip", "snappy", "lz4"],
+            help="compression of the kafka output, apm-server's default is gzip",
+        )
+        parser.add_argument(
+            "--apm-server-kafka-required-acks",
+            type=int,
+            choices=[-1, 0, 1],
+            help="acks the kafka output waits for: 0 none, 1 the leader, -1 all replicas",
+        )
+        parser.add_argument(
+            "--apm-server-template-preset",
+            choices=list(cls.TEMPLATE_PRESETS),
+            default=cls.DEFAULT_TEMPLATE_PRESET,
+            help="apm index template settings: codec, refresh interval and translog durability, see "
+                 "ApmServer.TEMPLATE_PRESETS",
+        )
+        parser.add_argument(
+            "--apm-server-index-shards",
+            type=int,
+            help="primary shards of apm indices (setup.template.settings.index.number_of_shards), overrides the "
+                 "template preset's 1",
+        )
+        parser.add_argument(
+            "--apm-server-index-replicas",
+            type=int,
+            help="replicas of apm indices (setup.template.settings.index.number_of_replicas), overrides the "
+                 "template preset's 0",
+        )
+        parser.add_argument(
+            "--apm-server-balance",
+            choices=cls.PROXY_BALANCE,
+            help="how the load balancer picks a server with --apm-server-count > 1, haproxy's default is roundrobin",
+        )
+        parser.add_argument(
+            "--apm-server-http-reuse",
+            choices=cls.PROXY_HTTP_REUSE,
+            help="load balancer sharing of idle server connections between client connections (http-reuse)",
+        )
+        parser.add_argument(
+            "--apm-server-keepalive",
+            choices=cls.PROXY_KEEPALIVE,
+            help="load balancer connection mode, server-close balances every request of a long lived agent "
+                 "connection",
+        )
+        parser.add_argument(
+            "--apm-server-maxconn",
+            type=int,
+            help="concurrent connections the load balancer opens to each server, others wait in its queue",
+        )
+        parser.add_argument(
+            "--apm-server-proxy-stats-port",
+            default=cls.PROXY_STATS_PORT,
+            help="port to publish the load balancer's statistics on, at /stats",
+        )
+        parser.add_argument(
+            "--apm-server-queue-size",
+            type=int,
+            help="events buffered in the apm-server publisher queue (queue.mem.events)",
+        )
+        parser.add_argument(
+            "--apm-server-flush-interval",
+            help="how long the queue waits to fill a batch before publishing, eg 1s (queue.mem.flush.timeout)",
+        )
+        parser.add_argument(
+            "--apm-server-output-workers",
+            type=int,
+            help="concurrent output workers per host of the configured --apm-server-output, elasticsearch and "
+                 "logstash only",
+        )
+        parser.add_argument(
+            "--apm-server-bulk-max-size",
+            type=int,
+            help="maximum events per bulk request of the configured --apm-server-output",
+        )
+        parser.add_argument(
+            "--apm-server-compression-level",
+            type=int,
+            choices=range(10),
+            metavar="{0..9}",
+            help="gzip compression level of the configured --apm-server-output, 0 disables compression",
+        )
         parser.add_argument(
             "--no-apm-server-dashboards",
             action="store_false",
@@ -419,18 +797,39 @@ class ApmServer(StackService, Service):
                     "args": {
                         "apm_server_base_image": self.default_image(),
                         "apm_server_branch": branch,
+                        "apm_server_cache_key": self.build_cache_key(repo, branch),
                         "apm_server_repo": repo,
                     }
                 },
                 "image": None,
             })
+            if not self.buildkit:
+                content["build"]["dockerfile"] = "Dockerfile.classic"
 
         return content
 
+    @classmethod
+    def unsupported_tuning(cls, options):
+        """tuning options given that the configured output doesn't have a setting for"""
+        output = options.get("apm_server_output") or cls.DEFAULT_OUTPUT
+        return [option for option, _ in cls.TUNING_SETTINGS
+                if options.get(option) is not None and output not in cls.TUNING_OUTPUTS.get(option, cls.OUTPUTS)]
+
+    @staticmethod
+    def build_cache_key(repo, branch):
+        """identifies the build cache for a source build, so each repo@branch keeps its own checkout"""
+        return hashlib.sha1("{}@{}".format(repo, branch).encode("utf8")).hexdigest()[:12]
+
     @staticmethod
     def enabled():
         return True
 
+    def compose_version(self):
+        version = super(ApmServer, self).compose_version()
+        if self.apm_server_count > 1 and "cpus" in self.resources(self.PROXY_NAME):
+            return max(version, "2.2", key=parse_version)
+        return version
+
     def render(self):
         """hack up render to support multiple apm servers behind a load balancer"""
         ren = super(ApmServer, self).render()
@@ -452,16 +851,21 @@ class ApmServer(StackService, Service):
 
     def render_proxy(self):
         condition = {"condition": "service_healthy"}
+        environment = {k: v for k, v in self.proxy_environment.items() if v is not None}
+        environment["APM_SERVER_COUNT"] = self.apm_server_count
         content = dict(
             build={"context": "docker/apm-server/haproxy"},
             container_name=self.default_container_name() + "-load-balancer",
             depends_on={"apm-server-{}".format(i): condition for i in range(1, self.apm_server_count + 1)},
-            environment={"APM_SERVER_COUNT": self.apm_server_count},
+            environment=environment,
             healthcheck={"test": ["CMD", "haproxy", "-c", "-f", "/usr/local/etc/haproxy/haproxy.cfg"]},
             ports=[
                 self.publish_port(self.port, self.SERVICE_PORT),
+                self.publish_port(self.proxy_stats_port, self.PROXY_STATS_PORT),
             ],
         )
+        self.render_healthcheck(content)
+        self.render_resources(content, self.PROXY_NAME)
         return {self.name(): content}
 
 
@@ -471,8 +875,11 @@ class Elasticsearch(StackService, Service):
         "-Xms": "1g",
         "-Xmx": "1g",
     }
+    default_heap = "1g"
+    default_resources = {"mem_limit": "5g"}
 
     SERVICE_PORT = 9200
+    HEALTHCHECK_START_PERIOD = "30s"
 
     def __init__(self, **options):
         super(Elasticsearch, self).__init__(**options)
@@ -480,36 +887,133 @@ class Elasticsearch(StackService, Service):
             self.docker_name = self.name() + "-platinum"
 
         # construct elasticsearch environment variables
-        # TODO: add command line option for java options (gr)
         es_java_opts = dict(self.default_es_java_opts)
+        heap = options.get("elasticsearch_heap") or self.default_heap
+        es_java_opts["-Xms"] = es_java_opts["-Xmx"] = heap
         if self.at_least_version("6.4"):
             # per https://github.com/elastic/elasticsearch/pull/32138/files
             es_java_opts["-XX:UseAVX"] = "=2"
 
-        java_opts_env = "ES_JAVA_OPTS=" + " ".join(["{}{}".format(k, v) for k, v in es_java_opts.items()])
-        self.environment = self.default_environment + [
-                java_opts_env, "path.data=/usr/share/elasticsearch/data/" + self.version]
+        java_opts = ["{}{}".format(k, v) for k, v in es_java_opts.items()]
+        # additional options come last, the jvm uses the last of repeated options
+        if options.get("elasticsearch_java_opts"):
+            java_opts.append(options["elasticsearch_java_opts"])
+        java_opts_env = "ES_JAVA_OPTS=" + " ".join(java_opts)
+        self.data_path = "/usr/share/elasticsearch/data/" + self.version
+        self.nodes = options.get("elasticsearch_nodes") or 1
+        self.environment = self.default_environment + [java_opts_env, "path.data=" + self.data_path]
+        if self.nodes > 1:
+            self.environment.remove("discovery.type=single-node")
+            self.environment.extend([
+                "discovery.zen.ping.unicast.hosts=" + ",".join(self.node_name(n) for n in range(1, self.nodes + 1)),
+                "discovery.zen.minimum_master_nodes={}".format(self.nodes // 2 + 1),
+            ])
         if not self.oss:
             self.environment.append("xpack.security.enabled=false")
             self.environment.append("xpack.license.self_generated.type=trial")
             if self.at_least_version("6.3"):
                 self.environment.append("xpack.monitoring.collection.enabled=true")
 
+        self.mem_limit = options.get("elasticsearch_mem_limit")
+        self.cpus = options.get("elasticsearch_cpus")
+        self.cpuset = options.get("elasticsearch_cpuset")
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super(Elasticsearch, cls).add_arguments(parser)
+        parser.add_argument(
+            '--elasticsearch-nodes',
+            type=int,
+            default=1,
+            help='number of nodes in the cluster, each with the same heap and limits. Only the first node publishes '
+                 'its port'
+        )
+        parser.add_argument(
+            '--elasticsearch-heap',
+            default=cls.default_heap,
+            help='min and max jvm heap size, eg 4g'
+        )
+        parser.add_argument(
+            '--elasticsearch-java-opts',
+            help='additional jvm options, eg "-XX:+UseG1GC"'
+        )
+        parser.add_argument(
+            '--elasticsearch-mem-limit',
+            help='container memory limit, should be well above the heap size, default {}'.format(
+                cls.default_resources["mem_limit"])
+        )
+        parser.add_argument(
+            '--elasticsearch-cpus',
+            type=float,
+            help='number of cpus the container may use, eg 2.5'
+        )
+        parser.add_argument(
+            '--elasticsearch-cpuset',
+            help='cpus the container may run on, eg 0-3'
+        )
+
+    def compose_version(self):
+        version = super(Elasticsearch, self).compose_version()
+        if self.cpus:
+            # cpus is new in 2.2
+            return max(version, "2.2", key=parse_version)
+        return version
+
+    @classmethod
+    def node_name(cls, node):
+        """service name of cluster node number node, the first node is the elasticsearch service"""
+        return cls.name() if node == 1 else "{}-{}".format(cls.name(), node)
+
     def _content(self):
-        return dict(
-            environment=self.environment,
+        return self.node_content(1)
+
+    def node_content(self, node):
+        health = "curl -s http://localhost:9200/_cluster/health | grep -vq '\"status\":\"red\"'"
+        if self.nodes > 1:
+            # not ready before every node joined
+            health = ("curl -s 'http://localhost:9200/_cluster/health?wait_for_nodes={}&timeout=1s' | "
+                      "grep -v '\"status\":\"red\"' | grep -q '\"timed_out\":false'").format(self.nodes)
+        environment = list(self.environment)
+        if self.nodes > 1:
+            environment.append("node.name=" + self.node_name(node))
+        content = dict(
+            environment=environment,
             healthcheck={
                 "interval": "20",
                 "retries": 10,
-                "test": ["CMD-SHELL", "curl -s http://localhost:9200/_cluster/health | grep -vq '\"status\":\"red\"'"],
+                "test": ["CMD-SHELL", health],
             },
-            mem_limit="5g",
-            ports=[self.publish_port(self.port, self.SERVICE_PORT)],
             ulimits={
                 "memlock": {"hard": -1, "soft": -1},
             },
-            volumes=["esdata:/usr/share/elasticsearch/data"]
         )
+        if node == 1:
+            content["ports"] = [self.publish_port(self.port, self.SERVICE_PORT)]
+        volume = "esdata" if node == 1 else "esdata-{}".format(node)
+        self.data_mount(content, volume + ":/usr/share/elasticsearch/data", self.data_path)
+        if self.mem_limit:
+            content["mem_limit"] = self.mem_limit
+        if self.cpus:
+            content["cpus"] = self.cpus
+        if self.cpuset:
+            content["cpuset"] = self.cpuset
+        return content
+
+    def render(self):
+        """render the other nodes of a cluster next to the elasticsearch service"""
+        ren = super(Elasticsearch, self).render()
+        for node in range(2, self.nodes + 1):
+            content = self.node_content(node)
+            content.update(
+                container_name="{}-{}".format(self.default_container_name(), node),
+                image=self.default_image(),
+                labels=self.default_labels(),
+                logging=self.default_logging(),
+            )
+            self.render_healthcheck(content)
+            self.render_resources(content, self.node_name(node))
+            ren[self.node_name(node)] = content
+        return ren
 
     @staticmethod
     def enabled():
@@ -553,6 +1057,7 @@ class Kibana(StackService, Service):
     default_environment = {"SERVER_NAME": "kibana.example.org", "ELASTICSEARCH_URL": "http://elasticsearch:9200"}
 
     SERVICE_PORT = 5601
+    HEALTHCHECK_START_PERIOD = "60s"
 
     def __init__(self, **options):
         super(Kibana, self).__init__(**options)
@@ -579,21 +1084,93 @@ class Kibana(StackService, Service):
 
 class Logstash(StackService, Service):
     SERVICE_PORT = 5044
+    HEALTHCHECK_START_PERIOD = "60s"
+
+    def __init__(self, **options):
+        super(Logstash, self).__init__(**options)
+        # read by the kafka input of the pipeline, which defaults to a single broker and consumer thread
+        self.environment = {"ELASTICSEARCH_URL": "http://elasticsearch:9200"}
+        if (options.get("kafka_brokers") or 1) > 1:
+            self.environment["KAFKA_BOOTSTRAP_SERVERS"] = ",".join(Kafka.bootstrap_servers(options["kafka_brokers"]))
+        if options.get("logstash_kafka_consumer_threads"):
+            self.environment["KAFKA_CONSUMER_THREADS"] = options["logstash_kafka_consumer_threads"]
+        # logstash.yml settings, the image sets them from these variables
+        for option, variable in (("logstash_pipeline_workers", "PIPELINE_WORKERS"),
+                                 ("logstash_pipeline_batch_size", "PIPELINE_BATCH_SIZE"),
+                                 ("logstash_pipeline_batch_delay", "PIPELINE_BATCH_DELAY")):
+            if options.get(option) is not None:
+                self.environment[variable] = options[option]
+        self.persistent_queue = options.get("logstash_persistent_queue")
+        if self.persistent_queue:
+            self.environment["QUEUE_TYPE"] = "persisted"
+            if options.get("logstash_queue_max_bytes"):
+                self.environment["QUEUE_MAX_BYTES"] = options["logstash_queue_max_bytes"]
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super(Logstash, cls).add_arguments(parser)
+        parser.add_argument(
+            '--logstash-kafka-consumer-threads',
+            type=int,
+            help='threads consuming from kafka, up to one per partition is useful, default 1'
+        )
+        parser.add_argument(
+            '--logstash-pipeline-workers',
+            type=int,
+            help='threads running filters and outputs (pipeline.workers), default one per cpu'
+        )
+        parser.add_argument(
+            '--logstash-pipeline-batch-size',
+            type=int,
+            help='events each worker takes from the queue at once (pipeline.batch.size), default 125'
+        )
+        parser.add_argument(
+            '--logstash-pipeline-batch-delay',
+            type=int,
+            help='ms a worker waits for a full batch (pipeline.batch.delay), default 50'
+        )
+        parser.add_argument(
+            '--logstash-persistent-queue',
+            action='store_true',
+            help='buffer events on disk instead of in memory (queue.type=persisted)'
+        )
+        parser.add_argument(
+            '--logstash-queue-max-bytes',
+            help='capacity of the persistent queue (queue.max_bytes), eg 4gb, default 1024mb'
+        )
 
     def _content(self):
-        return dict(
+        content = dict(
             depends_on={"elasticsearch": {"condition": "service_healthy"}},
-            environment={"ELASTICSEARCH_URL": "http://elasticsearch:9200"},
+            environment=self.environment,
             healthcheck=curl_healthcheck(9600, "logstash", path="/"),
             ports=[self.publish_port(self.port, self.SERVICE_PORT), "9600"],
             volumes=["./docker/logstash/pipeline/:/usr/share/logstash/pipeline/"]
         )
+        if self.persistent_queue:
+            self.data_mount(content, "lsdata:/usr/share/logstash/data", "/usr/share/logstash/data")
+        return content
 
 
 class Metricbeat(BeatMixin, StackService, Service):
     DEFAULT_COMMAND = "metricbeat -e --strict.perms=false"
     docker_path = "beats"
 
+    def __init__(self, **options):
+        super(Metricbeat, self).__init__(**options)
+        config = "metricbeat.benchmark.yml" if options.get("metricbeat_benchmark") else "metricbeat.yml"
+        self.metricbeat_config_path = os.path.join(".", "docker", "metricbeat", config)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super(Metricbeat, cls).add_arguments(parser)
+        parser.add_argument(
+            '--metricbeat-benchmark',
+            action='store_true',
+            help='collect apm-server and container metrics every second instead of every 10s, other services '
+                 'are not monitored'
+        )
+
     def _content(self):
         return dict(
             command=self.command,
@@ -601,7 +1178,7 @@ class Metricbeat(BeatMixin, StackService, Service):
             labels=None,
             user="root",
             volumes=[
-                "./docker/metricbeat/metricbeat.yml:/usr/share/metricbeat/metricbeat.yml",
+                self.metricbeat_config_path + ":/usr/share/metricbeat/metricbeat.yml",
                 "/var/run/docker.sock:/var/run/docker.sock",
             ]
         )
@@ -613,20 +1190,75 @@ class Metricbeat(BeatMixin, StackService, Service):
 class Kafka(Service):
     SERVICE_PORT = 9092
 
+    def __init__(self, **options):
+        super(Kafka, self).__init__(**options)
+        self.brokers = options.get("kafka_brokers") or 1
+        self.partitions = options.get("kafka_partitions")
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super(Kafka, cls).add_arguments(parser)
+        parser.add_argument(
+            '--kafka-brokers',
+            type=int,
+            default=1,
+            help='number of kafka brokers. Only the first broker publishes its port'
+        )
+        parser.add_argument(
+            '--kafka-partitions',
+            type=int,
+            help='partitions of the automatically created apm topics, default 1'
+        )
+
+    @classmethod
+    def broker_name(cls, broker):
+        """service name of broker number broker, the first broker is the kafka service"""
+        return cls.name() if broker == 1 else "{}-{}".format(cls.name(), broker)
+
+    @classmethod
+    def bootstrap_servers(cls, brokers):
+        return ["{}:{}".format(cls.broker_name(b), cls.SERVICE_PORT) for b in range(1, brokers + 1)]
+
     def _content(self):
-        return dict(
+        return self.broker_content(1)
+
+    def broker_content(self, broker):
+        content = dict(
             depends_on=["zookeeper"],
             environment={
-                "KAFKA_ADVERTISED_LISTENERS": "PLAINTEXT://kafka:9092",
-                "KAFKA_BROKER_ID": 1,
-                "KAFKA_OFFSETS_TOPIC_REPLICATION_FACTOR": 1,
+                "KAFKA_ADVERTISED_LISTENERS": "PLAINTEXT://{}:9092".format(self.broker_name(broker)),
+                "KAFKA_BROKER_ID": broker,
+                # internal topics are replicated where there are brokers to replicate to
+                "KAFKA_OFFSETS_TOPIC_REPLICATION_FACTOR": min(self.brokers, 3),
                 "KAFKA_ZOOKEEPER_CONNECT": "zookeeper:2181",
             },
+            healthcheck={
+                "interval": "10s",
+                "retries": 12,
+                "test": ["CMD", "kafka-broker-api-versions", "--bootstrap-server", "localhost:9092"],
+            },
             image="confluentinc/cp-kafka:4.1.0",
             labels=None,
             logging=None,
-            ports=[self.publish_port(self.port, self.SERVICE_PORT)],
         )
+        if self.partitions:
+            content["environment"]["KAFKA_NUM_PARTITIONS"] = self.partitions
+        if broker == 1:
+            content["ports"] = [self.publish_port(self.port, self.SERVICE_PORT)]
+        return content
+
+    def render(self):
+        """render the other brokers next to the kafka service"""
+        ren = super(Kafka, self).render()
+        for broker in range(2, self.brokers + 1):
+            content = self.broker_content(broker)
+            content["container_name"] = "{}-{}".format(self.default_container_name(), broker)
+            content.pop("labels")
+            content.pop("logging")
+            self.render_healthcheck(content)
+            self.render_resources(content, self.broker_name(broker))
+            ren[self.broker_name(broker)] = content
+        return ren
 
 
 class Postgres(Service):
@@ -634,15 +1266,15 @@ class Postgres(Service):
     opbeans_side_car = True
 
     def _content(self):
-        return dict(
+        content = dict(
             environment=["POSTGRES_DB=opbeans", "POSTGRES_PASSWORD=verysecure"],
             healthcheck={"interval": "10s", "test": ["CMD", "pg_isready", "-h", "postgres", "-U", "postgres"]},
             image="postgres:10",
             labels=None,
             ports=[self.publish_port(self.port, self.SERVICE_PORT, expose=True)],
-            volumes=["./docker/opbeans/sql:/docker-entrypoint-initdb.d", "pgdata:/var/lib/postgresql/data"],
-
+            volumes=["./docker/opbeans/sql:/docker-entrypoint-initdb.d"],
         )
+        return self.data_mount(content, "pgdata:/var/lib/postgresql/data", "/var/lib/postgresql/data")
 
 
 class Redis(Service):
@@ -761,9 +1393,12 @@ class AgentNodejsExpress(Service):
 
     def _content(self):
         return dict(
-            build={"context": "docker/nodejs/express", "dockerfile": "Dockerfile"},
-            command="bash -c \"npm install {} && node app.js\"".format(
-                self.agent_package, self.SERVICE_PORT),
+            build={
+                "context": "docker/nodejs/express",
+                "dockerfile": "Dockerfile",
+                "args": ["NODEJS_AGENT_PACKAGE=" + self.agent_package],
+            },
+            command="node app.js",
             container_name="expressapp",
             healthcheck=curl_healthcheck(self.SERVICE_PORT, "expressapp"),
             image=None,
@@ -799,6 +1434,9 @@ class AgentPython(Service):
         # prevent calling again
         cls._arguments_added = True
 
+    def build_args(self):
+        return ["PYTHON_AGENT_PACKAGE=" + self.agent_package]
+
     def _content(self):
         raise NotImplementedError()
 
@@ -808,9 +1446,8 @@ class AgentPythonDjango(AgentPython):
 
     def _content(self):
         return dict(
-            build={"context": "docker/python/django", "dockerfile": "Dockerfile"},
-            command="bash -c \"pip install -U {} && python testapp/manage.py runserver 0.0.0.0:{}\"".format(
-                self.agent_package, self.SERVICE_PORT),
+            build={"context": "docker/python/django", "dockerfile": "Dockerfile", "args": self.build_args()},
+            command="python testapp/manage.py runserver 0.0.0.0:{}".format(self.SERVICE_PORT),
             container_name="djangoapp",
             environment={
                 "APM_SERVER_URL": "http://apm-server:8200",
@@ -830,8 +1467,8 @@ class AgentPythonFlask(AgentPython):
 
     def _content(self):
         return dict(
-            build={"context": "docker/python/flask", "dockerfile": "Dockerfile"},
-            command="bash -c \"pip install -U {} && gunicorn app:app\"".format(self.agent_package),
+            build={"context": "docker/python/flask", "dockerfile": "Dockerfile", "args": self.build_args()},
+            command="gunicorn app:app",
             container_name="flaskapp",
             image=None,
             labels=None,
@@ -850,6 +1487,7 @@ class AgentRubyRails(Service):
     DEFAULT_AGENT_VERSION = "latest"
     DEFAULT_AGENT_VERSION_STATE = "release"
     SERVICE_PORT = 8020
+    HEALTHCHECK_START_PERIOD = "120s"
 
     @classmethod
     def add_arguments(cls, parser):
@@ -893,6 +1531,7 @@ class AgentRubyRails(Service):
 
 class AgentJavaSpring(Service):
     SERVICE_PORT = 8090
+    HEALTHCHECK_START_PERIOD = "60s"
 
     def _content(self):
         return dict(
@@ -995,6 +1634,7 @@ class OpbeansJava(OpbeansService):
     DEFAULT_AGENT_REPO = "elastic/apm-agent-java"
     DEFAULT_LOCAL_REPO = "."
     DEFAULT_SERVICE_NAME = 'opbeans-java'
+    HEALTHCHECK_START_PERIOD = "60s"
 
     @classmethod
     def add_arguments(cls, parser):
@@ -1060,6 +1700,7 @@ class OpbeansNode(OpbeansService):
     SERVICE_PORT = 3000
     DEFAULT_LOCAL_REPO = "."
     DEFAULT_SERVICE_NAME = "opbeans-node"
+    HEALTHCHECK_START_PERIOD = "60s"
 
     @classmethod
     def add_arguments(cls, parser):
@@ -1126,6 +1767,7 @@ class OpbeansPython(OpbeansService):
     DEFAULT_AGENT_BRANCH = "2.x"
     DEFAULT_LOCAL_REPO = "."
     DEFAULT_SERVICE_NAME = 'opbeans-python'
+    HEALTHCHECK_START_PERIOD = "60s"
 
     @classmethod
     def add_arguments(cls, parser):
@@ -1194,6 +1836,7 @@ class OpbeansRuby(OpbeansService):
     DEFAULT_AGENT_REPO = "elastic/apm-agent-ruby"
     DEFAULT_LOCAL_REPO = "."
     DEFAULT_SERVICE_NAME = "opbeans-ruby"
+    HEALTHCHECK_START_PERIOD = "300s"
 
     @classmethod
     def add_arguments(cls, parser):
@@ -1335,6 +1978,532 @@ class OpbeansLoadGenerator(Service):
         return content
 
 
+#
+# Docker Engine API
+#
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+# all services are attached to this network
+DOCKER_NETWORK = "apm-integration-testing"
+
+
+class DockerError(Exception):
+    def __init__(self, status, message):
+        super(DockerError, self).__init__("{}: {}".format(status, message))
+        self.status = status
+
+
+class DockerHostError(Exception):
+    """DOCKER_HOST points at a daemon DockerClient can't talk to"""
+
+
+def http_client():
+    """http.client, or httplib on python 2"""
+    try:
+        import http.client as client
+    except ImportError:
+        import httplib as client
+    return client
+
+
+# the HTTPConnection class for unix sockets, built on first use so http.client is only imported for docker calls
+_unix_http_connection_class = None
+
+
+def unix_http_connection(socket_path, timeout=None):
+    """HTTPConnection to a unix socket"""
+    global _unix_http_connection_class
+    if _unix_http_connection_class is None:
+        base = http_client().HTTPConnection
+
+        class UnixHTTPConnection(base):
+            def __init__(self, socket_path, timeout=None):
+                # an old style class on python 2
+                base.__init__(self, "localhost", timeout=timeout)
+                self.socket_path = socket_path
+
+            def connect(self):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                try:
+                    sock.connect(self.socket_path)
+                except socket.error:
+                    sock.close()
+                    raise
+                self.sock = sock
+
+        _unix_http_connection_class = UnixHTTPConnection
+    return _unix_http_connection_class(socket_path, timeout)
+
+
+def demux_stream(data):
+    """stdout and stderr of a non-tty attach/exec stream, frames are a 8 byte header and the payload"""
+    out = {1: [], 2: []}
+    while len(data) >= 8:
+        stream, size = struct.unpack(">BxxxL", data[:8])
+        out.setdefault(stream, []).append(data[8:8 + size])
+        data = data[8 + size:]
+    return b"".join(out[1]), b"".join(out[2])
+
+
+class DockerClient(object):
+    """
+    Minimal Docker Engine API client, over the daemon's unix socket.
+
+    Requests share one keep-alive connection, so a client must not be used by several threads at once.
+    Paths are unversioned, the daemon answers with its own API version.
+    """
+
+    def __init__(self, socket_path=None, timeout=60):
+        if socket_path is None:
+            socket_path = self.socket_from_env()
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connection = unix_http_connection(socket_path, timeout=timeout)
+
+    @staticmethod
+    def socket_from_env():
+        """the daemon's socket from DOCKER_HOST, the docker CLI's default when unset"""
+        docker_host = os.environ.get("DOCKER_HOST", "")
+        if not docker_host:
+            return DOCKER_SOCKET
+        if docker_host.startswith("unix://"):
+            return docker_host[len("unix://"):]
+        # talking to the default socket instead would reach another daemon than the docker CLI does
+        raise DockerHostError("DOCKER_HOST={} is not supported, compose.py only talks to docker over a unix "
+                              "socket, eg unix:///var/run/docker.sock".format(docker_host))
+
+    @staticmethod
+    def url(path, params=None):
+        params = {k: json.dumps(v) if isinstance(v, dict) else v for k, v in (params or {}).items() if v is not None}
+        return path + ("?" + urlencode(sorted(params.items())) if params else "")
+
+    def request(self, method, path, params=None, body=None, raw=False):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        url = self.url(path, params)
+        reused = self.connection.sock is not None
+        try:
+            self.connection.request(method, url, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http_client().BadStatusLine, socket.error) as e:
+            self.connection.close()
+            # the daemon closed the kept-alive connection, try once more on a new one. anything else, eg a
+            # timeout, may have reached the daemon, and a POST like stop mustn't be sent twice
+            if not reused or not self.closed_by_daemon(e):
+                raise
+            self.connection.request(method, url, body=body, headers=headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode("utf8"))["message"]
+            except (ValueError, KeyError):
+                message = data.decode("utf8", "replace")
+            raise DockerError(response.status, message)
+        if raw:
+            return data
+        return json.loads(data.decode("utf8")) if data else None
+
+    @staticmethod
+    def closed_by_daemon(error):
+        if isinstance(error, socket.timeout):
+            return False
+        return isinstance(error, http_client().BadStatusLine) or error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+    def close(self):
+        self.connection.close()
+
+    def containers(self, filters=None, all=False):
+        return self.request("GET", "/containers/json", {"filters": filters, "all": "1" if all else None})
+
+    def images(self):
+        return self.request("GET", "/images/json")
+
+    def inspect_container(self, container):
+        return self.request("GET", "/containers/{}/json".format(container))
+
+    def stop(self, container, timeout=10):
+        self.request("POST", "/containers/{}/stop".format(container), {"t": timeout})
+
+    def stats(self, container):
+        """a single resource usage sample, the daemon takes a second or two to collect it"""
+        return self.request("GET", "/containers/{}/stats".format(container), {"stream": "0"})
+
+    def exec_run(self, container, cmd):
+        """run cmd in container, returns its exit code and stdout"""
+        exec_id = self.request("POST", "/containers/{}/exec".format(container), body={
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Cmd": cmd,
+        })["Id"]
+        # the daemon hijacks the connection for the output and closes it when cmd exits
+        data = self.request("POST", "/exec/{}/start".format(exec_id), body={"Detach": False, "Tty": False}, raw=True)
+        self.connection.close()
+        stdout, _ = demux_stream(data)
+        return self.request("GET", "/exec/{}/json".format(exec_id))["ExitCode"], stdout.decode("utf8").strip()
+
+    def events(self, filters=None, since=None, until=None):
+        """yield events as they happen, on a connection of their own"""
+        connection = unix_http_connection(self.socket_path)
+        try:
+            connection.request("GET", self.url("/events", {"filters": filters, "since": since, "until": until}))
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise DockerError(response.status, response.read().decode("utf8", "replace"))
+            for line in iter(response.readline, b""):
+                if line.strip():
+                    yield json.loads(line.decode("utf8"))
+        finally:
+            connection.close()
+
+
+def published_port(container, port):
+    """host:port where the tcp port of a container, as listed by DockerClient.containers, is published"""
+    for p in container.get("Ports") or []:
+        if p["PrivatePort"] == port and p["Type"] == "tcp" and p.get("PublicPort"):
+            return "{}:{}".format("localhost" if p.get("IP", "") in ("", "0.0.0.0", "::") else p["IP"], p["PublicPort"])
+    return None
+
+
+def published_address(client, name, port):
+    """host:port where the first running container matching name publishes port, None if none does"""
+    addresses = [published_port(c, port) for c in client.containers(filters={"name": [name]})]
+    return next((a for a in addresses if a), None)
+
+
+def format_ports(container):
+    """ports of a container as listed by DockerClient.containers, like `docker ps` shows them"""
+    ports = set()
+    for p in container.get("Ports") or []:
+        port = "{}/{}".format(p["PrivatePort"], p["Type"])
+        if p.get("PublicPort"):
+            port = "{}{}->{}".format(p["IP"] + ":" if p.get("IP") else "", p["PublicPort"], port)
+        ports.add(port)
+    return ", ".join(sorted(ports))
+
+
+def stop_container(container_id):
+    # a client per container, containers are stopped concurrently
+    client = DockerClient()
+    try:
+        client.stop(container_id)
+    finally:
+        client.close()
+
+
+#
+# Stack reuse
+#
+
+CONFIG_HASH_LABEL = "co.elatic.apm.config-hash"
+
+
+def label_config_hash(compose):
+    """label every service with a hash of the configuration, returns the hash"""
+    config_hash = hashlib.sha1(json.dumps(compose, sort_keys=True).encode("utf8")).hexdigest()
+    for service in compose["services"].values():
+        service["labels"] = service.get("labels", []) + ["{}={}".format(CONFIG_HASH_LABEL, config_hash)]
+    return config_hash
+
+
+def reusable(client, compose, config_hash):
+    """whether every service is running with this configuration and none is unhealthy"""
+    running = {c["Labels"].get("com.docker.compose.service"): c
+               for c in client.containers(filters={"label": ["{}={}".format(CONFIG_HASH_LABEL, config_hash)]})}
+    return all(name in running and "(unhealthy)" not in running[name]["Status"] for name in compose["services"])
+
+
+def reuse_stack(client, compose, config_hash):
+    """reset a running stack with the same configuration, returns False if there is none"""
+    try:
+        if not reusable(client, compose, config_hash):
+            return False
+    except (DockerError, socket.error):
+        return False
+    print("Reusing running stack services with configuration {}..\n".format(config_hash[:12]))
+    elasticsearch = compose["services"].get("elasticsearch")
+    if elasticsearch:
+        # run data only, index templates and kibana's index with its dashboards are kept
+        exit_code, output = client.exec_run(elasticsearch["container_name"], [
+            "curl", "-s", "-XDELETE", "http://localhost:9200/apm-*?expand_wildcards=all"])
+        if exit_code:
+            print("Deleting apm-* indices failed: {}".format(output))
+            return False
+    return True
+
+
+#
+# Startup timeline
+#
+class StartupTimeline(object):
+    """
+    Collect container lifecycle events for the services of a rendered docker-compose.yml
+    and find the dependency chain that determines when the whole stack is ready.
+    """
+
+    # docker event action -> timeline column
+    STATES = collections.OrderedDict((
+        ("create", "created"),
+        ("start", "started"),
+        ("health_status: healthy", "healthy"),
+    ))
+
+    def __init__(self, services):
+        self.depends_on = {}
+        self.healthchecked = set()
+        self.times = {}
+        for name, service in services.items():
+            # depends_on is either a list of names or a mapping of name -> condition
+            self.depends_on[name] = sorted(service.get("depends_on", []))
+            if "healthcheck" in service:
+                self.healthchecked.add(name)
+            self.times[name] = {}
+        self.origin = None
+
+    @classmethod
+    def from_compose(cls, path):
+        with open(path) as f:
+            # compose.py writes docker-compose.yml as json, a subset of yaml
+            return cls(json.load(f)["services"])
+
+    def feed(self, event):
+        """record one event, as emitted by `docker events --format '{{json .}}'`"""
+        if event.get("Type", "container") != "container":
+            return
+        service = event.get("Actor", {}).get("Attributes", {}).get("com.docker.compose.service")
+        state = self.STATES.get(event.get("Action", event.get("status")))
+        if service not in self.times or state is None:
+            return
+        when = event["timeNano"] / 1e9 if "timeNano" in event else float(event["time"])
+        self.times[service].setdefault(state, when)
+        if self.origin is None or when < self.origin:
+            self.origin = when
+
+    def ready(self, name):
+        """time a service is usable by its dependents: healthy if it has a healthcheck, otherwise started"""
+        return self.times[name].get("healthy" if name in self.healthchecked else "started")
+
+    def complete(self):
+        return all(self.ready(name) is not None for name in self.times)
+
+    def critical_path(self):
+        """services on the longest dependency chain, each the last of its dependencies to become ready"""
+        ready = {name: self.ready(name) for name in self.times if self.ready(name) is not None}
+        if not ready:
+            return []
+        path = [max(ready, key=ready.get)]
+        while True:
+            dependencies = [d for d in self.depends_on[path[-1]] if d in ready]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=ready.get))
+        return list(reversed(path))
+
+    def render(self):
+        def offset(when):
+            return "-" if when is None else "{:.1f}s".format(when - self.origin)
+
+        width = max([len("service")] + [len(name) for name in self.times])
+        row = "{:<" + str(width) + "}  {:>9}  {:>9}  {:>9}"
+        lines = [row.format("service", *self.STATES.values())]
+        # services that never became ready sort last
+        for name in sorted(self.times, key=lambda n: (self.ready(n) is None, self.ready(n), n)):
+            lines.append(row.format(name, *[offset(self.times[name].get(s)) for s in self.STATES.values()]))
+
+        path = self.critical_path()
+        if path:
+            steps, previous = [], self.origin
+            for name in path:
+                steps.append("{} (+{:.1f}s)".format(name, self.ready(name) - previous))
+                previous = self.ready(name)
+            lines.append("")
+            lines.append("critical path: {} = {}".format(" -> ".join(steps), offset(previous)))
+        if not self.complete():
+            lines.append("")
+            lines.append("not ready: " + ", ".join(sorted(n for n in self.times if self.ready(n) is None)))
+        return "\n".join(lines)
+
+
+def record_startup(docker_compose_path, timeout=600, record=None):
+    """(re)create the stack described by docker_compose_path and follow docker events until it is ready"""
+    timeline = StartupTimeline.from_compose(docker_compose_path)
+    since = int(time.time())
+    # until makes the daemon end the event stream on its own if the stack never becomes ready
+    events = DockerClient().events(filters={"type": ["container"]}, since=since, until=since + timeout)
+    up = subprocess.Popen(["docker-compose", "-f", docker_compose_path, "up", "-d", "--force-recreate"])
+    try:
+        for event in events:
+            if record:
+                record.write(json.dumps(event) + "\n")
+            timeline.feed(event)
+            if timeline.complete():
+                break
+    finally:
+        events.close()
+        up.wait()
+    return timeline
+
+
+#
+# Versions
+#
+
+Container = collections.namedtuple('Container', ('service', 'name', 'stack_version', 'created'))
+
+
+def running_containers(client):
+    """localtesting containers with a stack version label, in one call for containers and one for their images"""
+    listed = client.containers(filters={"name": ["localtesting"], "label": ["co.elatic.apm.stack-version"]})
+    if not listed:
+        return []
+    created = {i['Id']: i['Created'] for i in client.images()}
+    containers = []
+    for c in listed:
+        name = c['Names'][0].lstrip('/')
+        containers.append(Container(
+            c['Labels'].get('com.docker.compose.service', name.split('_')[-1]),
+            name,
+            c['Labels']['co.elatic.apm.stack-version'],
+            datetime.datetime.utcfromtimestamp(created[c['ImageID']]),
+        ))
+    return containers
+
+
+def parse_kibana_package(package_json):
+    data = json.loads(package_json)
+    return {
+        'version': data['version'],
+        'branch': data['branch'],
+        'build_sha': data['build']['sha'],
+        'build_number': data['build']['number'],
+    }
+
+
+def parse_ruby_agent(gem_list):
+    match = re.search(r'elastic-apm \((.+)\)', gem_list)
+    return {'version': match.group(1) if match else gem_list}
+
+
+VersionProbe = collections.namedtuple('VersionProbe', ('title', 'command', 'parse', 'labels'))
+
+# commands run inside each service's container, pipes run in the container's shell.
+# labels name the fields printed for multi-field versions, a lone version is printed as is.
+VERSION_PROBES = {
+    'apm-server': VersionProbe(
+        'APM Server', 'apm-server version', lambda out: {'version': out}, ()),
+    'elasticsearch': VersionProbe(
+        'Elasticsearch', './bin/elasticsearch --version', lambda out: {'version': out}, ()),
+    'kibana': VersionProbe(
+        'Kibana', 'cat package.json', parse_kibana_package,
+        (('version', 'Version'), ('branch', 'Branch'), ('build_sha', 'Build SHA'), ('build_number', 'Build number'))),
+    'opbeans-node': VersionProbe(
+        'Agent version (in opbeans-node)', 'npm list | grep elastic-apm-node',
+        lambda out: {'version': out.split('elastic-apm-node@')[-1]}, ()),
+    'opbeans-python': VersionProbe(
+        'Agent version (in opbeans-python)', 'pip freeze | grep elastic-apm',
+        lambda out: {'version': out.replace('elastic-apm==', '')}, ()),
+    'opbeans-ruby': VersionProbe(
+        'Agent version (in opbeans-ruby)', 'gem list | grep elastic-apm', parse_ruby_agent, ()),
+}
+
+
+def probe_version(container, timeout=None):
+    version = {
+        'stack_version': container.stack_version,
+        'image_created': container.created.isoformat(' '),
+    }
+    probe = VERSION_PROBES.get(container.service)
+    if not probe:
+        return version
+    # a client per probe, probes run concurrently
+    client = DockerClient(timeout=timeout)
+    try:
+        exit_code, output = client.exec_run(container.name, ['sh', '-c', probe.command])
+        if exit_code:
+            version['error'] = 'exit status {}'.format(exit_code)
+        else:
+            version.update(probe.parse(output))
+    except socket.timeout:
+        version['error'] = 'no response within {}s'.format(timeout)
+    except (DockerError, socket.error) as e:
+        version['error'] = str(e)
+    except (KeyError, ValueError) as e:
+        version['error'] = 'unexpected output: {}'.format(e)
+    finally:
+        client.close()
+    return version
+
+
+def probe_versions(containers, timeout=None):
+    """run the version probe of every container concurrently, returns {service: version info}"""
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(len(containers))
+    try:
+        versions = pool.map(functools.partial(probe_version, timeout=timeout), containers)
+    finally:
+        pool.close()
+    return {c.service: v for c, v in zip(containers, versions)}
+
+
+#
+# Profiling
+#
+
+# apm-server's pprof endpoints, served on the monitor port enabled by --httpprof, and the extension of each
+# saved profile. goroutine dumps are text with full stacks, the others are read with `go tool pprof`.
+PPROF_PROFILES = collections.OrderedDict([
+    ('heap', ('/debug/pprof/heap', 'pprof')),
+    ('goroutine', ('/debug/pprof/goroutine?debug=2', 'txt')),
+    ('cpu', ('/debug/pprof/profile?seconds={seconds}', 'pprof')),
+])
+
+
+def capture_profiles(url, output_dir, label='', seconds=30, profiles=None, params=None):
+    """
+    save apm-server profiles from the monitor at url as output_dir/<label>-<profile>.<ext>, returns their paths.
+
+    heap and goroutines are snapshots, cpu is sampled for the following seconds.
+    params, eg the load parameters, are saved as output_dir/params.json.
+    """
+    try:
+        from urllib.request import urlopen
+    except ImportError:
+        from urllib2 import urlopen
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    paths = []
+    if params is not None:
+        path = os.path.join(output_dir, 'params.json')
+        with open(path, 'w') as f:
+            json.dump(params, f, indent=2, sort_keys=True)
+        paths.append(path)
+    for name in profiles or PPROF_PROFILES:
+        endpoint, ext = PPROF_PROFILES[name]
+        path = os.path.join(output_dir, '{}.{}'.format('-'.join(p for p in (label, name) if p), ext))
+        response = urlopen(url.rstrip('/') + endpoint.format(seconds=seconds), timeout=seconds + 30)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def parse_param(param):
+    """argparse type for KEY=VALUE"""
+    key, sep, value = param.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError("expected KEY=VALUE, got {}".format(param))
+    return key, value
+
+
 #
 # Service Tests
 #
@@ -1351,11 +2520,9 @@ class LocalSetup(object):
     }
 
     def __init__(self, argv=None, services=None):
-        self.available_options = set()
-
-        if services is None:
-            services = discover_services()
-        self.services = services
+        self.available_options = {}
+        self._services = services
+        command = self.command(sys.argv[1:] if argv is None else argv)
 
         parser = argparse.ArgumentParser(
             description="""
@@ -1386,16 +2553,16 @@ class LocalSetup(object):
             description='Use one of the following commands:'
         )
 
-        self.init_start_parser(
-            subparsers.add_parser(
-                'start',
-                help="Start the stack. See `start --help` for options.",
-                description="Main command for this script, starts the stack. Use the arguments to specify which "
-                            "services to start. "
-            ),
-            services,
-            argv=argv,
-        ).set_defaults(func=self.start_handler)
+        start_parser = subparsers.add_parser(
+            'start',
+            help="Start the stack. See `start --help` for options.",
+            description="Main command for this script, starts the stack. Use the arguments to specify which "
+                        "services to start. "
+        )
+        # service options are many and only needed to start, or to list them for completion
+        if command in ('start', 'list-options'):
+            self.init_start_parser(start_parser, self.services, argv=argv)
+        start_parser.set_defaults(func=self.start_handler)
 
         subparsers.add_parser(
             'status',
@@ -1410,11 +2577,42 @@ class LocalSetup(object):
                         "be running. "
         ).set_defaults(func=self.dashboards_handler)
 
-        subparsers.add_parser(
+        versions_parser = subparsers.add_parser(
             'versions',
             help="Prints all running version numbers.",
             description="Prints version (and build) numbers of each running service."
-        ).set_defaults(func=self.versions_handler)
+        )
+        versions_parser.add_argument(
+            '--json',
+            action='store_true',
+            help='print versions as JSON',
+        )
+        versions_parser.add_argument(
+            '--timeout',
+            type=int,
+            default=30,
+            help='seconds to wait for each service\'s version',
+        )
+        versions_parser.set_defaults(func=self.versions_handler)
+
+        self.init_profile_parser(
+            subparsers.add_parser(
+                'profile',
+                help="Captures apm-server cpu and heap profiles and goroutine dumps.",
+                description="Saves profiles from the pprof endpoints of the running apm-server's monitor port, eg at "
+                            "the start, peak and end of a load run, next to the run's results."
+            )
+        ).set_defaults(func=self.profile_handler)
+
+        self.init_timeline_parser(
+            subparsers.add_parser(
+                'timeline',
+                help="Starts the stack and prints a startup timeline.",
+                description="(Re)creates the services of a rendered docker-compose.yml, follows docker events until "
+                            "every service is ready and prints when each service was created, started and became "
+                            "healthy, along with the dependency chain that determined the total startup time."
+            )
+        ).set_defaults(func=self.timeline_handler)
 
         subparsers.add_parser(
             'stop',
@@ -1422,11 +2620,17 @@ class LocalSetup(object):
             description="Stops all running services and their containers."
         ).set_defaults(func=self.stop_handler)
 
-        subparsers.add_parser(
+        listoptions_parser = subparsers.add_parser(
             'list-options',
             help="Lists all available options.",
             description="Lists all available options (used for bash autocompletion)."
-        ).set_defaults(func=self.listoptions_handler)
+        )
+        listoptions_parser.add_argument(
+            'command',
+            nargs='?',
+            help='list only the options of this subcommand, or the top level options and subcommands for ""',
+        )
+        listoptions_parser.set_defaults(func=self.listoptions_handler)
 
         self.init_sourcemap_parser(
             subparsers.add_parser(
@@ -1443,6 +2647,20 @@ class LocalSetup(object):
         if not hasattr(self.args, "func"):
             parser.error("command required")
 
+    @staticmethod
+    def command(argv):
+        """the subcommand in argv, top level options don't take values"""
+        for arg in argv:
+            if not arg.startswith('-'):
+                return arg
+        return None
+
+    @property
+    def services(self):
+        if self._services is None:
+            self._services = discover_services()
+        return self._services
+
     def set_docker_compose_path(self, dst):
         """override docker-compose-path argument, for tests"""
         self.args.__setattr__("docker_compose_path", dst)
@@ -1552,6 +2770,43 @@ class LocalSetup(object):
             default=False,
         )
 
+        parser.add_argument(
+            '--reuse',
+            action='store_true',
+            help='keep running services started with --reuse and the same configuration, '
+                 'only deleting their apm-* indices, instead of building, pulling and starting them again',
+            default=False,
+        )
+
+        parser.add_argument(
+            '--data-tmpfs',
+            action='store_true',
+            help='keep elasticsearch and postgres data in memory instead of docker volumes, '
+                 'it is lost when the container stops',
+            default=False,
+        )
+
+        parser.add_argument(
+            '--data-tmpfs-size',
+            default=DEFAULT_DATA_TMPFS_SIZE,
+            help='size of each in memory data directory, counts against the container memory limit',
+        )
+
+        parser.add_argument(
+            '--resource-profile',
+            type=load_resource_profile,
+            help='JSON file of service names or patterns to cpuset, cpus and mem_limit, '
+                 'see scripts/resource-profiles/',
+        )
+
+        parser.add_argument(
+            '--healthcheck-profile',
+            choices=HEALTHCHECK_PROFILES,
+            default='default',
+            help='healthcheck timings. fast probes every {} after a per-service start period, '
+                 'so dependent services start sooner'.format(FAST_HEALTHCHECK_INTERVAL),
+        )
+
         parser.add_argument(
             '--all',
             action='store_true',
@@ -1584,8 +2839,6 @@ class LocalSetup(object):
             default='http://apm-server:8200',
         )
 
-        self.store_options(parser)
-
         return parser
 
     @staticmethod
@@ -1640,16 +2893,91 @@ class LocalSetup(object):
 
         return parser
 
+    @staticmethod
+    def init_profile_parser(parser):
+        parser.add_argument(
+            '--url',
+            help='apm-server monitor url. Defaults to the published monitor port of the running apm-server'
+        )
+
+        parser.add_argument(
+            '--output-dir',
+            default='profiles',
+            help='directory to save profiles in, eg the load run\'s results directory'
+        )
+
+        parser.add_argument(
+            '--label',
+            default='',
+            help='prefix for the profile files, eg the point of the load run: start, peak or end'
+        )
+
+        parser.add_argument(
+            '--seconds',
+            type=int,
+            default=30,
+            help='seconds to sample the cpu profile for'
+        )
+
+        parser.add_argument(
+            '--profiles',
+            nargs='+',
+            choices=list(PPROF_PROFILES),
+            default=list(PPROF_PROFILES),
+            help='profiles to capture'
+        )
+
+        parser.add_argument(
+            '--param',
+            action='append',
+            type=parse_param,
+            default=[],
+            metavar='KEY=VALUE',
+            help='load parameter to save in params.json next to the profiles, may be repeated'
+        )
+
+        return parser
+
+    @staticmethod
+    def init_timeline_parser(parser):
+        parser.add_argument(
+            '--docker-compose-path',
+            default=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'docker-compose.yml')),
+            help='path to a docker-compose.yml rendered by the start command'
+        )
+
+        parser.add_argument(
+            '--events-file',
+            help='replay docker events recorded with --record instead of starting the stack'
+        )
+
+        parser.add_argument(
+            '--record',
+            type=argparse.FileType(mode='w'),
+            help='save the docker events seen during startup, for replay with --events-file'
+        )
+
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=600,
+            help='seconds to wait for all services to become ready'
+        )
+
+        return parser
+
     def store_options(self, parser):
         """
         Helper method to extract and store all arguments
         in a list of all possible arguments.
         Used for bash tab completion.
         """
+        # top level options and subcommands are stored under '', subcommand options under the subcommand
+        options = collections.defaultdict(set)
+
         # Run through all parser actions
         for action in parser._actions:
-            for option in action.option_strings:
-                self.available_options.add(option)
+            options[''].update(action.option_strings)
 
         # Get subparsers from parser
         subparsers_actions = [
@@ -1660,28 +2988,28 @@ class LocalSetup(object):
         # Run through all subparser actions
         for subparsers_action in subparsers_actions:
             for choice, subparser in subparsers_action.choices.items():
-                self.available_options.add(choice)
+                options[''].add(choice)
+                for action in subparser._actions:
+                    options[choice].update(action.option_strings)
+
+        self.available_options = {command: sorted(opts) for command, opts in options.items()}
 
     #
     # handlers
     #
     @staticmethod
     def dashboards_handler():
-        cmd = (
-                'docker ps --filter "name=kibana" -q | xargs docker inspect ' +
-                '-f \'{{ index .Config.Labels "co.elatic.apm.stack-version" }}\''
-        )
-
         # Check if Docker is running and get running containers
         try:
-            running_version = subprocess.check_output(cmd, shell=True).decode('utf8').strip()
-        except subprocess.CalledProcessError:
+            running = DockerClient().containers(
+                filters={"name": ["kibana"], "label": ["co.elatic.apm.stack-version"]})
+        except (DockerError, socket.error):
             # If not, exit immediately
             print('Make sure Docker is running before running this script.')
             sys.exit(1)
 
         # Check for empty result
-        if running_version == "":
+        if not running:
             print('No containers are running.')
             print('Make sure the stack is running before importing dashboards.')
             sys.exit(1)
@@ -1695,7 +3023,9 @@ class LocalSetup(object):
         subprocess.call(cmd, shell=True)
 
     def listoptions_handler(self):
-        print("{}".format(" ".join(self.available_options)))
+        # every option was added to get here, keep them for the next completion
+        save_options_cache(self.available_options)
+        print(" ".join(select_options(self.available_options, self.args.command)))
 
     def start_handler(self):
         args = vars(self.args)
@@ -1704,6 +3034,17 @@ class LocalSetup(object):
             # use stack-version directly if not supported, to allow use of specific releases, eg 6.2.3
             args["version"] = self.SUPPORTED_VERSIONS.get(args["stack-version"], args["stack-version"])
 
+        unsupported = ApmServer.unsupported_tuning(args) if args.get("enable_apm_server", True) else []
+        if unsupported:
+            print("--{} not supported by the {} output".format(
+                ", --".join(option.replace("_", "-") for option in unsupported), args.get("apm_server_output")))
+            sys.exit(1)
+
+        if args.get("apm_server_build") and not buildkit_supported():
+            print("docker-compose {} or later is needed to keep the apm-server build cache, "
+                  "building without it\n".format(BUILDKIT_COMPOSE_VERSION))
+            args["apm_server_buildkit"] = False
+
         selections = set()
         all_opbeans = args.get('run_all_opbeans')
         any_opbeans = all_opbeans or any(v and k.startswith('enable_opbeans_') for k, v in args.items())
@@ -1728,16 +3069,21 @@ class LocalSetup(object):
         for service in selections:
             services.update(service.render())
         compose = dict(
-            version="2.1",
+            version=max([DEFAULT_COMPOSE_VERSION] + [s.compose_version() for s in selections], key=parse_version),
             services=services,
             networks=dict(
-                default={"name": "apm-integration-testing"},
+                default={"name": DOCKER_NETWORK},
             ),
             volumes=dict(
                 esdata={"driver": "local"},
                 pgdata={"driver": "local"},
             ),
         )
+        for volume in named_volumes(services):
+            compose["volumes"].setdefault(volume, {"driver": "local"})
+        config_hash = None
+        if args.get("reuse"):
+            config_hash = label_config_hash(compose)
         docker_compose_path = args["docker_compose_path"]
         json.dump(compose, docker_compose_path, indent=2, sort_keys=True)
         docker_compose_path.flush()
@@ -1745,6 +3091,8 @@ class LocalSetup(object):
         # try to figure out if writing to a real file, not amazing
         if hasattr(docker_compose_path, "name") and os.path.isdir(os.path.dirname(docker_compose_path.name)):
             docker_compose_path.close()
+            if config_hash and reuse_stack(DockerClient(), compose, config_hash):
+                return
             print("Starting stack services..\n")
 
             # always build if possible, should be quick for rebuilds
@@ -1755,7 +3103,15 @@ class LocalSetup(object):
                     docker_compose_build.append("--no-cache")
                 if args["build_parallel"]:
                     docker_compose_build.append("--parallel")
-                subprocess.call(docker_compose_build + build_services)
+                # BuildKit, for the build cache mounts used by apm-server source builds
+                build_env = dict(os.environ, DOCKER_BUILDKIT="1", COMPOSE_DOCKER_CLI_BUILD="1")
+                if args.get("apm_server_buildkit") is False:
+                    build_env = None
+                build_start = time.time()
+                if subprocess.call(docker_compose_build + build_services, env=build_env) != 0:
+                    print("Building {} failed".format(", ".join(sorted(build_services))))
+                    sys.exit(1)
+                print("Built {} in {:.1f}s\n".format(", ".join(sorted(build_services)), time.time() - build_start))
 
             # pull any images
             image_services = [name for name, service in compose["services"].items() if
@@ -1768,27 +3124,92 @@ class LocalSetup(object):
 
     @staticmethod
     def status_handler():
+        try:
+            containers = DockerClient().containers(filters={"network": [DOCKER_NETWORK]}, all=True)
+        except (DockerError, socket.error):
+            print('Make sure Docker is running before running this script.')
+            sys.exit(1)
+
         print("Status for all services:\n")
-        subprocess.call(['docker-compose', 'ps'])
+        rows = [("Name", "State", "Ports")]
+        for c in sorted(containers, key=lambda c: c['Names'][0]):
+            rows.append((c['Names'][0].lstrip('/'), c['Status'], format_ports(c)))
+        width = [max(len(row[i]) for row in rows) for i in range(2)]
+        for row in rows:
+            print("{:<{}}   {:<{}}   {}".format(row[0], width[0], row[1], width[1], row[2]).rstrip())
+
+    def profile_handler(self):
+        url = self.args.url
+        if not url:
+            try:
+                address = published_address(DockerClient(), "apm-server", int(ApmServer.DEFAULT_MONITOR_PORT))
+            except (DockerError, socket.error):
+                address = None
+            if not address:
+                print("No running apm-server with a published monitor port found. Start it, or provide a url with "
+                      "--url")
+                sys.exit(1)
+            url = 'http://' + address
+
+        print("Capturing {} from {}".format(", ".join(self.args.profiles), url))
+        try:
+            paths = capture_profiles(url, self.args.output_dir, label=self.args.label, seconds=self.args.seconds,
+                                     profiles=self.args.profiles,
+                                     params=dict(self.args.param) if self.args.param else None)
+        except (IOError, OSError) as e:
+            print("Failed to capture profiles: {}".format(e))
+            sys.exit(1)
+        for path in paths:
+            print("Saved", path)
+
+    def timeline_handler(self):
+        if self.args.events_file:
+            timeline = StartupTimeline.from_compose(self.args.docker_compose_path)
+            with open(self.args.events_file) as f:
+                for line in f:
+                    if line.strip():
+                        timeline.feed(json.loads(line))
+        else:
+            print("Starting stack services and following docker events..\n")
+            timeline = record_startup(self.args.docker_compose_path, timeout=self.args.timeout,
+                                      record=self.args.record)
+        print(timeline.render())
 
     @staticmethod
     def stop_handler():
+        try:
+            containers = DockerClient().containers(filters={"network": [DOCKER_NETWORK]})
+        except (DockerError, socket.error):
+            print('Make sure Docker is running before running this script.')
+            sys.exit(1)
+
         print("Stopping all stack services..\n")
-        subprocess.call(['docker-compose', 'stop'])
+        if not containers:
+            return
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(len(containers))
+        try:
+            pool.map(stop_container, [c['Id'] for c in containers])
+        finally:
+            pool.close()
+        for c in containers:
+            print("Stopped", c['Names'][0].lstrip('/'))
 
     def upload_sourcemaps_handler(self):
         server_url = self.args.server_url
         sourcemap_file = self.args.sourcemap_file
         bundle_path = self.args.bundle_path
         service_version = self.args.service_version
+        client = DockerClient()
         if not server_url:
-            cmd = 'docker ps --filter "name=apm-server" -q | xargs docker port | grep "8200/tcp"'
             try:
-                port_desc = subprocess.check_output(cmd, shell=True).decode('utf8').strip()
-            except subprocess.CalledProcessError:
+                address = published_address(client, "apm-server", 8200)
+            except (DockerError, socket.error):
+                address = None
+            if not address:
                 print("No running apm-server found. Start it, or provide a server url with --server-url")
                 sys.exit(1)
-            server_url = 'http://' + port_desc.split(' -> ')[1]
+            server_url = 'http://' + address
         if sourcemap_file:
             sourcemap_file = os.path.expanduser(sourcemap_file)
             if not os.path.exists(sourcemap_file):
@@ -1806,17 +3227,16 @@ class LocalSetup(object):
         if not bundle_path:
             bundle_path = 'http://opbeans-node:3000/static/js/' + os.path.basename(sourcemap_file)
         if not service_version:
-            cmd = (
-                'docker ps --filter "name=opbeans-node" -q | '
-                'xargs docker inspect -f \'{{range .Config.Env}}{{println .}}{{end}}\' | '
-                'grep ELASTIC_APM_JS_BASE_SERVICE_VERSION'
-            )
             try:
-                build_date = subprocess.check_output(cmd, shell=True).decode('utf8').strip()
-                service_version = build_date.split("=")[1]
-            except subprocess.CalledProcessError:
+                env = [e for c in client.containers(filters={"name": ["opbeans-node"]})
+                       for e in client.inspect_container(c['Id'])['Config']['Env']]
+            except (DockerError, socket.error):
+                env = []
+            build_dates = [e.split("=", 1)[1] for e in env if e.startswith("ELASTIC_APM_JS_BASE_SERVICE_VERSION=")]
+            if not build_dates:
                 print("opbeans-node container not found. Start it or set --service-version")
                 sys.exit(1)
+            service_version = build_dates[0]
         if self.args.secret_token:
             auth_header = '-H "Authorization: Bearer {}" '.format(self.args.secret_token)
         else:
@@ -1840,153 +3260,61 @@ class LocalSetup(object):
         )
         subprocess.check_output(cmd, shell=True).decode('utf8').strip()
 
-    @staticmethod
-    def versions_handler():
-        Container = collections.namedtuple(
-            'Container', ('service', 'stack_version', 'created')
-        )
-        cmd = (
-            'docker ps --filter "name=localtesting" -q | xargs docker inspect '
-            '-f \'{{ index .Config.Labels "co.elatic.apm.stack-version" }}\\t{{ .Image }}\\t{{ .Name }}\''
-        )
-
+    def versions_handler(self):
         # Check if Docker is running and get running containers
         try:
-            labels = subprocess.check_output(cmd, shell=True).decode('utf8').strip()
-            lines = [line.split('\\t') for line in labels.split('\n') if line.split('\\t')[0]]
-            for line in lines:
-                line[1] = subprocess.check_output(
-                    ['docker', 'inspect', '-f', '{{ .Created }}', line[1]]
-                ).decode('utf8').strip()
-            running_versions = {c.service: c for c in (Container(
-                line[2].split('_')[-1],
-                line[0],
-                datetime.datetime.strptime(line[1].split('.')[0], "%Y-%m-%dT%H:%M:%S")
-            ) for line in lines)}
-        except subprocess.CalledProcessError:
+            containers = running_containers(DockerClient())
+        except (DockerError, socket.error):
             # If not, exit immediately
             print('Make sure Docker is running before running this script.')
             sys.exit(1)
 
         # Check for empty result
-        if not running_versions:
+        if not containers:
             print('No containers are running.')
             print('Make sure the stack is running before checking versions.')
             sys.exit(1)
 
-        # Run all version checks
-        print('Getting current version numbers for services...')
-
-        def run_container_command(name, cmd):
-            # Get id from docker-compose
-            container_id = subprocess.check_output('docker-compose ps -q {}'.format(name),
-                                                   shell=True).decode('utf8').strip()
-
-            # Prepare exec command
-            command = 'docker exec -it {0} {1}'.format(container_id, cmd)
-
-            # Run command
-            try:
-                output = subprocess.check_output(
-                    command, stderr=open(os.devnull, 'w'), shell=True).decode('utf8').strip()
-            except subprocess.CalledProcessError:
-                # Handle errors
-                print('\tContainer "{}" is not running or an error occurred'.format(name))
-                return False
-
-            return output
-
-        def print_elasticsearch_version(container):
-            print("\nElasticsearch (image built: %s UTC):" % container.created)
-
-            version = run_container_command(
-                'elasticsearch', './bin/elasticsearch --version'
-            )
-
-            if version:
-                print("\t{0}".format(version))
-
-        def print_apmserver_version(container):
-            print("\nAPM Server (image built: %s UTC):" % container.created)
-
-            version = run_container_command('apm-server', 'apm-server version')
-
-            if version:
-                print("\t{0}".format(version))
-
-        def print_kibana_version(container):
-            print("\nKibana (image built: %s UTC):" % container.created)
-
-            package_json = run_container_command('kibana', 'cat package.json')
-
-            if package_json:
-
-                # Try to parse package.json
-                try:
-                    data = json.loads(package_json)
-                except ValueError as e:
-                    print('ERROR: Could not parse Kibana\'s package.json file.')
-                    return e
-
-                print("\tVersion: {}".format(data['version']))
-                print("\tBranch: {}".format(data['branch']))
-                print("\tBuild SHA: {}".format(data['build']['sha']))
-                print("\tBuild number: {}".format(data['build']['number']))
-
-        def print_opbeansnode_version(_):
-            print("\nAgent version (in opbeans-node):")
-
-            version = run_container_command(
-                'opbeans-node', 'npm list | grep elastic-apm-node'
-            )
-
-            if version:
-                version = version.replace('+-- elastic-apm-node@', '')
-                print("\t{0}".format(version))
-
-        def print_opbeanspython_version(_):
-            print("\nAgent version (in opbeans-python):")
-
-            version = run_container_command(
-                'opbeans-python', 'pip freeze | grep elastic-apm'
-            )
-
-            if version:
-                version = version.replace('elastic-apm==', '')
-                print("\t{0}".format(version))
-
-        def print_opbeansruby_version(_):
-            print("\nAgent version (in opbeans-ruby):")
-
-            version = run_container_command(
-                'opbeans-ruby', 'gem list | grep elastic-apm'
-            )
+        if self.args.json:
+            json.dump(probe_versions(containers, timeout=self.args.timeout), sys.stdout, indent=2, sort_keys=True)
+            print()
+            return
 
-            if version:
-                version = version.replace('elastic-apm (*+)', '\1')
-                print("\t{0}".format(version))
-
-        dispatch = {
-            'apm-server': print_apmserver_version,
-            'elasticsearch': print_elasticsearch_version,
-            'kibana': print_kibana_version,
-            'opbeans-node': print_opbeansnode_version,
-            'opbeans-python': print_opbeanspython_version,
-            'opbeans-ruby': print_opbeansruby_version,
-        }
-        for service_name, container in running_versions.items():
-            print_version = dispatch.get(service_name)
-            if not print_version:
+        print('Getting current version numbers for services...')
+        versions = probe_versions(containers, timeout=self.args.timeout)
+        for service_name in sorted(versions):
+            version = versions[service_name]
+            probe = VERSION_PROBES.get(service_name)
+            if not probe:
                 print("unknown version for", service_name)
                 continue
-            print_version(container)
+            print("\n{} (image built: {} UTC):".format(probe.title, version['image_created']))
+            if 'error' in version:
+                print('\tContainer "{}" is not running or an error occurred: {}'.format(
+                    service_name, version['error']))
+                continue
+            if not probe.labels:
+                print("\t{}".format(version['version']))
+            for key, label in probe.labels:
+                print("\t{}: {}".format(label, version[key]))
 
 
 def main():
+    # list-options runs on every completion, answer it from the cache without building the parsers
+    if sys.argv[1:2] == ['list-options'] and not any(arg.startswith('-') for arg in sys.argv[2:]):
+        options = load_options_cache()
+        if options is not None:
+            print(" ".join(select_options(options, sys.argv[2] if len(sys.argv) > 2 else None)))
+            return
+
     # Enable logging
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
     setup = LocalSetup(sys.argv[1:])
-    setup()
+    try:
+        setup()
+    except DockerHostError as e:
+        print(e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+from __future__ import print_function
+
+import errno
+import os
+import socket
+
+from ..compose import DockerClient, DockerError, DockerHostError, demux_stream, format_ports, published_port
+from .fakes import DockerTestCase, frame, listed_container
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+
+class DockerClientTest(DockerTestCase):
+    def test_connection_reused(self):
+        self.docker.containers = [listed_container("kibana"), listed_container("elasticsearch")]
+        client = self.docker.client()
+        self.assertEqual(2, len(client.containers()))
+        self.assertEqual(1, len(client.containers(filters={"name": ["kibana"]})))
+        self.assertEqual("/localtesting_6.3.3_kibana", client.inspect_container("localtesting_6.3.3_kibana")["Name"])
+        self.assertEqual(1, self.docker.connections)
+
+    def test_connection_class_built_once(self):
+        first, second = self.docker.client(timeout=5), self.docker.client()
+        self.assertIs(type(first.connection), type(second.connection))
+        self.assertEqual((5, 60), (first.connection.timeout, second.connection.timeout))
+        self.assertEqual([], second.containers())
+
+    def failing_response(self, client, error):
+        """client's next response fails with error, counting the requests it sends"""
+        connection = client.connection
+        getresponse = connection.getresponse
+        errors = [error]
+
+        def fail_once():
+            if errors:
+                raise errors.pop()
+            return getresponse()
+
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(connection, "getresponse", side_effect=fail_once).start()
+        return mock.patch.object(connection, "request", wraps=connection.request).start()
+
+    def test_retry_closed_connection(self):
+        self.docker.containers = [listed_container("kibana")]
+        client = self.docker.client()
+        client.containers()
+        request = self.failing_response(client, socket.error(errno.ECONNRESET, "connection reset by peer"))
+        self.assertEqual(1, len(client.containers()))
+        self.assertEqual(2, request.call_count)
+
+    def test_no_retry(self):
+        self.docker.containers = [listed_container("kibana")]
+        # a timeout may have reached the daemon, a slow stop isn't sent again
+        client = self.docker.client()
+        client.containers()
+        request = self.failing_response(client, socket.timeout("timed out"))
+        with self.assertRaises(socket.timeout):
+            client.stop("localtesting_6.3.3_kibana")
+        self.assertEqual(1, request.call_count)
+        # nor is a request that failed on a new connection
+        client = self.docker.client()
+        request = self.failing_response(client, socket.error(errno.ECONNRESET, "connection reset by peer"))
+        with self.assertRaises(socket.error):
+            client.containers()
+        self.assertEqual(1, request.call_count)
+
+    def test_from_docker_host(self):
+        self.assertEqual(self.docker.socket_path, DockerClient().socket_path)
+        with mock.patch.dict(os.environ, {"DOCKER_HOST": ""}):
+            self.assertEqual("/var/run/docker.sock", DockerClient.socket_from_env())
+        # another daemon than the docker CLI's must not be reached through the default socket
+        for docker_host in ("tcp://127.0.0.1:2375", "ssh://user@host"):
+            with mock.patch.dict(os.environ, {"DOCKER_HOST": docker_host}):
+                with self.assertRaises(DockerHostError) as cm:
+                    DockerClient()
+                self.assertIn(docker_host, str(cm.exception))
+
+    def test_error(self):
+        with self.assertRaises(DockerError) as cm:
+            self.docker.client().inspect_container("missing")
+        self.assertEqual(404, cm.exception.status)
+        self.assertIn("No such container: missing", str(cm.exception))
+
+    def test_exec_run(self):
+        self.docker.containers = [listed_container("apm-server")]
+        self.docker.execs["localtesting_6.3.3_apm-server"] = (0, "apm-server version 6.3.3\n", 0)
+        client = self.docker.client()
+        self.assertEqual((0, "apm-server version 6.3.3"), client.exec_run("localtesting_6.3.3_apm-server", ["ls"]))
+        # the exec stream closed the connection, the client reconnects for the next request
+        self.assertEqual((0, "apm-server version 6.3.3"), client.exec_run("localtesting_6.3.3_apm-server", ["ls"]))
+        self.assertEqual(("POST", "/containers/localtesting_6.3.3_apm-server/exec",
+                          {"AttachStdout": True, "AttachStderr": True, "Cmd": ["ls"]}), self.docker.requests[0])
+
+    def test_events(self):
+        self.docker.events = [{"Action": "create", "timeNano": 1}, {"Action": "start", "timeNano": 2}]
+        events = self.docker.client().events(filters={"type": ["container"]}, since=1, until=2)
+        self.assertEqual(["create", "start"], [e["Action"] for e in events])
+        self.assertEqual("/events", self.docker.requests[0][1])
+
+    def test_stats(self):
+        self.docker.containers = [listed_container("kibana")]
+        self.docker.stats["localtesting_6.3.3_kibana"] = {"memory_stats": {"usage": 1024}}
+        self.assertEqual(1024, self.docker.client().stats("localtesting_6.3.3_kibana")["memory_stats"]["usage"])
+        self.assertEqual("/containers/localtesting_6.3.3_kibana/stats", self.docker.requests[0][1])
+
+    def test_demux_stream(self):
+        self.assertEqual((b"out1out2", b"err"), demux_stream(frame(1, b"out1") + frame(2, b"err") + frame(1, b"out2")))
+
+    def test_ports(self):
+        container = listed_container("apm-server", ports=[
+            {"PrivatePort": 8200, "Type": "tcp", "IP": "127.0.0.1", "PublicPort": 8201},
+            {"PrivatePort": 6060, "Type": "tcp"},
+        ])
+        self.assertEqual("127.0.0.1:8201", published_port(container, 8200))
+        self.assertIsNone(published_port(container, 6060))
+        self.assertEqual("127.0.0.1:8201->8200/tcp, 6060/tcp", format_ports(container))
+
+
+class HandlersTest(DockerTestCase):
+    def test_status(self):
+        self.docker.containers = [
+            listed_container("kibana", ports=[
+                {"PrivatePort": 5601, "Type": "tcp", "IP": "127.0.0.1", "PublicPort": 5601},
+            ]),
+            listed_container("elasticsearch", status="Exited (0) 1 minute ago"),
+        ]
+        lines = self.run_command("status").splitlines()
+        self.assertEqual(["Name", "State", "Ports"], lines[2].split())
+        self.assertEqual("localtesting_6.3.3_elasticsearch   Exited (0) 1 minute ago", lines[3])
+        self.assertEqual(["127.0.0.1:5601->5601/tcp"], lines[4].split()[-1:])
+
+    def test_stop(self):
+        self.docker.containers = [listed_container("kibana"), listed_container("elasticsearch")]
+        self.run_command("stop")
+        self.assertEqual({"localtesting_6.3.3_kibana-id", "localtesting_6.3.3_elasticsearch-id"},
+                         set(self.docker.stopped))
+
+    def test_docker_not_running(self):
+        self.docker.close()
+        with self.assertRaises(SystemExit):
+            self.run_command("status")
@@ -0,0 +1,280 @@
+"""
+Fakes shared by the compose.py tests and the benchmark tests: a docker daemon on a unix socket
+and HTTP stubs on a free local port.
+"""
+from __future__ import print_function
+
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from ..compose import DockerClient, LocalSetup
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import parse_qs, urlparse
+
+if sys.version_info[0] == 3:
+    from io import StringIO
+else:
+    from io import BytesIO as StringIO
+
+
+def frame(stream, data):
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+def listed_container(service, image="sha256:" + "0" * 64, ports=None, status="Up 5 minutes", env=None):
+    name = "localtesting_6.3.3_" + service
+    return {
+        "Id": name + "-id",
+        "Names": ["/" + name],
+        "Image": image,
+        "ImageID": image,
+        "Labels": {"co.elatic.apm.stack-version": "6.3.3", "com.docker.compose.service": service},
+        "Status": status,
+        "Ports": ports or [],
+        # not part of the list response, served by inspect and used for filters
+        "Env": env or [],
+        "Networks": ["apm-integration-testing"],
+    }
+
+
+class ThreadingUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    # don't wait for slow exec responses on close
+    block_on_close = False
+
+
+class FakeDocker(object):
+    """a docker daemon serving canned containers, images and exec output on a unix socket"""
+
+    def __init__(self):
+        self.containers = []
+        self.images = []
+        # container name -> (exit code, stdout, delay in seconds)
+        self.execs = {}
+        self.events = []
+        self.requests = []
+        self.stopped = []
+        # container name -> stats response
+        self.stats = {}
+        self.connections = 0
+        self._exec_instances = {}
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, "docker.sock")
+        self.server = ThreadingUnixStreamServer(self.socket_path, self.handler())
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        shutil.rmtree(self.tmpdir)
+
+    def client(self, **kwargs):
+        return DockerClient(self.socket_path, **kwargs)
+
+    def find(self, name_or_id):
+        for c in self.containers:
+            if name_or_id in (c["Id"], c["Names"][0].lstrip("/")):
+                return c
+        return None
+
+    def matches(self, container, filters):
+        for label in filters.get("label", []):
+            key, _, value = label.partition("=")
+            if key not in container["Labels"] or value and container["Labels"][key] != value:
+                return False
+        if any(not any(n in name for name in container["Names"]) for n in filters.get("name", [])):
+            return False
+        return all(n in container["Networks"] for n in filters.get("network", []))
+
+    def route(self, method, path, query, body):
+        if (method, path) == ("GET", "/containers/json"):
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            return 200, [{k: v for k, v in c.items() if k not in ("Env", "Networks")}
+                         for c in self.containers if self.matches(c, filters) and c["Id"] not in self.stopped]
+        if (method, path) == ("GET", "/images/json"):
+            return 200, self.images
+        match = re.match(r"^/containers/([^/]+)/(json|stop|exec|stats)$", path)
+        if match:
+            container = self.find(match.group(1))
+            if container is None:
+                return 404, {"message": "No such container: " + match.group(1)}
+            if match.group(2) == "json":
+                return 200, {"Id": container["Id"], "Name": container["Names"][0], "Config": {"Env": container["Env"]}}
+            if match.group(2) == "stop":
+                self.stopped.append(container["Id"])
+                return 204, None
+            if match.group(2) == "stats":
+                return 200, self.stats[container["Names"][0].lstrip("/")]
+            exec_id = str(len(self._exec_instances))
+            self._exec_instances[exec_id] = self.execs[container["Names"][0].lstrip("/")]
+            return 201, {"Id": exec_id}
+        match = re.match(r"^/exec/([^/]+)/(start|json)$", path)
+        if match:
+            exit_code, stdout, delay = self._exec_instances[match.group(1)]
+            if match.group(2) == "json":
+                return 200, {"ExitCode": exit_code}
+            time.sleep(delay)
+            return 200, frame(1, stdout.encode("utf8")) + frame(2, b"warning\n")
+        return 404, {"message": "page not found"}
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                fake.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def handle_one(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length).decode("utf8")) if length else None
+                fake.requests.append((method, url.path, body))
+                if url.path == "/events":
+                    return self.stream_events()
+                status, response = fake.route(method, url.path, parse_qs(url.query), body)
+                self.send_response(status)
+                if isinstance(response, bytes):
+                    # hijacked exec stream, no length, ends when the connection closes
+                    self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+                    self.end_headers()
+                    self.wfile.write(response)
+                    self.close_connection = True
+                    return
+                data = json.dumps(response).encode("utf8") if response is not None else b""
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def stream_events(self):
+                self.send_response(200)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in fake.events:
+                    line = (json.dumps(event) + "\n").encode("utf8")
+                    self.wfile.write("{:x}\r\n".format(len(line)).encode("ascii") + line + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                self.handle_one("GET")
+
+            def do_POST(self):
+                self.handle_one("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class DockerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.docker = FakeDocker()
+        self.addCleanup(self.docker.close)
+        patcher = mock.patch.dict(os.environ, {"DOCKER_HOST": "unix://" + self.docker.socket_path})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_command(self, *argv):
+        out = StringIO()
+        with mock.patch("sys.stdout", out):
+            LocalSetup(argv=list(argv))()
+        return out.getvalue()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer(object):
+    """an HTTP server on a free local port answering every request with handle(method, path, body)
+
+    handle returns the status and the response, bytes, None for an empty one or anything json serializable.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_one(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else None
+                stub.requests.append(self.path)
+                status, response = stub.handle(method, self.path, body)
+                if response is None:
+                    data = b""
+                elif isinstance(response, bytes):
+                    data = response
+                else:
+                    data = json.dumps(response).encode("utf8")
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_one("GET")
+
+            def do_POST(self):
+                self.handle_one("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def pprof(method, path, body):
+    """a canned profile for each pprof endpoint of an apm-server monitor, the path it was asked for"""
+    if not path.startswith("/debug/pprof/"):
+        return 404, None
+    return 200, path.encode("utf8")
+
+
+class PprofServer(StubServer):
+    def __init__(self):
+        super(PprofServer, self).__init__(pprof)
@@ -2,7 +2,10 @@ from __future__ import print_function
 
 
 import io
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 import collections
 import yaml
@@ -699,6 +702,23 @@ class LocalTest(unittest.TestCase):
         for name, service in got["services"].items():
             self.assertNotIn("apm-server", service.get("depends_on", {}), "{} depends on apm-server".format(name))
 
+    @mock.patch(compose.__name__ + '.load_images')
+    def test_start_healthcheck_profile_fast(self, _ignore_load_images):
+        docker_compose_yml = stringIO()
+        setup = LocalSetup(
+            argv=["start", "master", "--with-opbeans-node", "--healthcheck-profile", "fast",
+                  "--docker-compose-path", "-"])
+        setup.set_docker_compose_path(docker_compose_yml)
+        setup()
+        docker_compose_yml.seek(0)
+        got = yaml.load(docker_compose_yml)
+        # start_period requires 2.3
+        self.assertEqual("2.3", got["version"])
+        for name, service in got["services"].items():
+            if "healthcheck" in service:
+                self.assertEqual("1s", service["healthcheck"]["interval"], name)
+                self.assertIn("start_period", service["healthcheck"], name)
+
     @mock.patch(compose.__name__ + '.load_images')
     def test_start_unsupported_version_pre_6_3(self, _ignore_load_images):
         docker_compose_yml = stringIO()
@@ -807,6 +827,18 @@ class LocalTest(unittest.TestCase):
             got = service.image_download_url()
             self.assertEqual(case.expected, got)
 
+    def test_duration_seconds(self):
+        cases = [
+            ("20", 20),
+            ("5s", 5),
+            ("1m30s", 90),
+            ("500ms", 0.5),
+        ]
+        for duration, want in cases:
+            self.assertEqual(want, compose.duration_seconds(duration))
+        with self.assertRaises(ValueError):
+            compose.duration_seconds("5 minutes")
+
     def test_parse(self):
         cases = [
             ("6.3", [6, 3]),
@@ -818,3 +850,92 @@ class LocalTest(unittest.TestCase):
         for ver, want in cases:
             got = parse_version(ver)
             self.assertEqual(want, got)
+
+
+class ListOptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_home)
+        patcher = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.cache_home})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list_options(self, *argv):
+        out = stringIO()
+        with mock.patch("sys.stdout", out):
+            LocalSetup(argv=["list-options"] + list(argv))()
+        return out.getvalue().split()
+
+    def test_lazy_start_options(self):
+        setup = LocalSetup(argv=["status"])
+        # services are only discovered to start or list options
+        self.assertIsNone(setup._services)
+        self.assertEqual(["--help", "-h"], setup.available_options["start"])
+
+    def test_list_options(self):
+        # every option without a subcommand, as always
+        self.assertIn("start", self.list_options())
+        self.assertIn("--with-opbeans-node", self.list_options())
+        self.assertIn("--json", self.list_options())
+        self.assertIn("start", self.list_options(""))
+        self.assertNotIn("--with-opbeans-node", self.list_options(""))
+        self.assertIn("--with-opbeans-node", self.list_options("start"))
+        self.assertEqual(["--help", "--json", "--timeout", "-h"], self.list_options("versions"))
+
+    def test_cache(self):
+        self.assertIsNone(compose.load_options_cache())
+        options = self.list_options("start")
+        self.assertEqual(options, compose.load_options_cache()["start"])
+        with mock.patch.object(compose, "__version__", "0.0.0"):
+            self.assertIsNone(compose.load_options_cache())
+
+    def test_main_from_cache(self):
+        compose.save_options_cache({"": ["start"], "start": ["--cached"]})
+        out = stringIO()
+        with mock.patch("sys.argv", ["compose.py", "list-options", "start"]), mock.patch("sys.stdout", out), \
+                mock.patch.object(compose, "LocalSetup") as local_setup:
+            compose.main()
+        local_setup.assert_not_called()
+        self.assertEqual("--cached\n", out.getvalue())
+        out = stringIO()
+        with mock.patch("sys.argv", ["compose.py", "list-options"]), mock.patch("sys.stdout", out):
+            compose.main()
+        self.assertEqual("--cached start\n", out.getvalue())
+
+
+class BuildTest(unittest.TestCase):
+    def start(self, compose_version, build_status=0):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        docker_compose_path = os.path.join(tmpdir, "docker-compose.yml")
+        out = stringIO()
+        with mock.patch.object(compose.subprocess, "check_output", return_value=compose_version), \
+                mock.patch.object(compose.subprocess, "call", return_value=build_status) as call, \
+                mock.patch("sys.stdout", out):
+            LocalSetup(argv=["start", "master", "--apm-server-build", "foo.git",
+                             "--docker-compose-path", docker_compose_path])()
+        with open(docker_compose_path) as f:
+            return yaml.load(f)["services"]["apm-server"]["build"], call, out.getvalue()
+
+    def test_buildkit(self):
+        build, call, out = self.start(b"1.25.0\n")
+        self.assertNotIn("dockerfile", build)
+        self.assertEqual("1", call.call_args_list[0][1]["env"]["DOCKER_BUILDKIT"])
+        self.assertIn("Built apm-server in", out)
+
+    def test_no_buildkit(self):
+        build, call, out = self.start(b"1.22.0\n")
+        self.assertEqual("Dockerfile.classic", build["dockerfile"])
+        self.assertIsNone(call.call_args_list[0][1]["env"])
+        self.assertIn("building without it", out)
+
+    def test_build_failed(self):
+        with self.assertRaises(SystemExit):
+            self.start(b"1.25.0\n", build_status=1)
+
+    def test_unsupported_tuning(self):
+        out = stringIO()
+        with self.assertRaises(SystemExit), mock.patch("sys.stdout", out):
+            LocalSetup(argv=["start", "master", "--apm-server-output", "kafka", "--apm-server-output-workers", "4",
+                             "--docker-compose-path", "-"])()
+        self.assertIn("--apm-server-output-workers not supported by the kafka output", out.getvalue())
@@ -0,0 +1,66 @@
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..compose import capture_profiles, parse_param
+from .fakes import DockerTestCase, PprofServer, listed_container
+
+
+class ProfileTest(DockerTestCase):
+    def setUp(self):
+        super(ProfileTest, self).setUp()
+        self.pprof = PprofServer()
+        self.addCleanup(self.pprof.close)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def read(self, name):
+        with open(os.path.join(self.tmpdir, name)) as f:
+            return f.read()
+
+    def test_capture_profiles(self):
+        paths = capture_profiles(self.pprof.url, self.tmpdir, label="peak", seconds=5,
+                                 params={"concurrency": 8})
+        self.assertEqual(["params.json", "peak-heap.pprof", "peak-goroutine.txt", "peak-cpu.pprof"],
+                         [os.path.basename(p) for p in paths])
+        self.assertEqual(["/debug/pprof/heap", "/debug/pprof/goroutine?debug=2", "/debug/pprof/profile?seconds=5"],
+                         self.pprof.requests)
+        self.assertEqual("/debug/pprof/profile?seconds=5", self.read("peak-cpu.pprof"))
+        self.assertEqual({"concurrency": 8}, json.loads(self.read("params.json")))
+
+    def test_capture_unlabeled(self):
+        paths = capture_profiles(self.pprof.url, os.path.join(self.tmpdir, "run"), profiles=["heap"])
+        self.assertEqual([os.path.join(self.tmpdir, "run", "heap.pprof")], paths)
+
+    def test_profile_command(self):
+        port = self.pprof.server.server_address[1]
+        self.docker.containers = [listed_container("apm-server", ports=[
+            {"PrivatePort": 6060, "Type": "tcp", "IP": "127.0.0.1", "PublicPort": port},
+        ])]
+        out = self.run_command("profile", "--output-dir", self.tmpdir, "--label", "start", "--seconds", "1",
+                               "--profiles", "cpu", "--param", "concurrency=8", "--param", "queue_size=4096")
+        self.assertIn("Capturing cpu from http://127.0.0.1:{}".format(port), out)
+        self.assertEqual(["/debug/pprof/profile?seconds=1"], self.pprof.requests)
+        self.assertEqual(["params.json", "start-cpu.pprof"], sorted(os.listdir(self.tmpdir)))
+        self.assertEqual({"concurrency": "8", "queue_size": "4096"}, json.loads(self.read("params.json")))
+
+    def test_profile_not_running(self):
+        with self.assertRaises(SystemExit):
+            self.run_command("profile", "--output-dir", self.tmpdir)
+
+    def test_profile_error(self):
+        with self.assertRaises(SystemExit):
+            self.run_command("profile", "--url", self.pprof.url + "/missing", "--output-dir", self.tmpdir)
+
+
+class ParseParamTest(unittest.TestCase):
+    def test_parse_param(self):
+        self.assertEqual(("flush", "1s=fast"), parse_param("flush=1s=fast"))
+        self.assertEqual(("empty", ""), parse_param("empty="))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_param("flush")
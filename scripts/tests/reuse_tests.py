@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+
+from .. import compose
+from ..compose import CONFIG_HASH_LABEL, DockerClient, label_config_hash, reuse_stack
+from .fakes import DockerTestCase, listed_container, mock
+
+
+def running(compose_config, config_hash, status="Up 5 minutes (healthy)"):
+    containers = []
+    for name, service in compose_config["services"].items():
+        container = listed_container(name, status=status)
+        container["Names"] = ["/" + service["container_name"]]
+        container["Labels"][CONFIG_HASH_LABEL] = config_hash
+        containers.append(container)
+    return containers
+
+
+class ReuseTest(DockerTestCase):
+    def render(self, *args):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        docker_compose_path = os.path.join(tmpdir, "docker-compose.yml")
+        with mock.patch.object(compose.subprocess, "call", return_value=0) as call:
+            self.run_command("start", "master", "--reuse", "--docker-compose-path", docker_compose_path, *args)
+        with open(docker_compose_path) as f:
+            return json.load(f), call
+
+    def test_label(self):
+        config = {"services": {"elasticsearch": {"labels": ["a=b"]}, "kibana": {}}}
+        config_hash = label_config_hash(config)
+        self.assertEqual(["a=b", CONFIG_HASH_LABEL + "=" + config_hash], config["services"]["elasticsearch"]["labels"])
+        self.assertEqual([CONFIG_HASH_LABEL + "=" + config_hash], config["services"]["kibana"]["labels"])
+
+    def test_start_fresh(self):
+        config, call = self.render()
+        hashes = {label for service in config["services"].values() for label in service["labels"]
+                  if label.startswith(CONFIG_HASH_LABEL)}
+        self.assertEqual(1, len(hashes))
+        # nothing running, build, pull and up
+        self.assertTrue(call.called)
+
+    def test_start_reuse(self):
+        config, _ = self.render()
+        config_hash = config["services"]["elasticsearch"]["labels"][-1].split("=")[1]
+        self.docker.containers = running(config, config_hash)
+        self.docker.execs[config["services"]["elasticsearch"]["container_name"]] = (0, '{"acknowledged":true}', 0)
+
+        config, call = self.render()
+        self.assertFalse(call.called)
+        self.assertEqual(["curl", "-s", "-XDELETE", "http://localhost:9200/apm-*?expand_wildcards=all"],
+                         self.docker.requests[-3][2]["Cmd"])
+
+        # other options, other configuration
+        _, call = self.render("--with-opbeans-node")
+        self.assertTrue(call.called)
+
+    def test_not_reusable(self):
+        config = {"services": {"elasticsearch": {"container_name": "localtesting_es"},
+                               "kibana": {"container_name": "localtesting_kibana"}}}
+        config_hash = label_config_hash(config)
+        self.docker.containers = running(config, config_hash, status="Up 1 minute (unhealthy)")
+        self.assertFalse(reuse_stack(DockerClient(), config, config_hash))
+        self.docker.containers = running(config, config_hash)[:1]
+        self.assertFalse(reuse_stack(DockerClient(), config, config_hash))
+        self.docker.close()
+        self.assertFalse(reuse_stack(DockerClient(), config, config_hash))
@@ -1,5 +1,12 @@
 from __future__ import print_function
 
+import argparse
+import collections
+import glob
+import json
+import os
+import shutil
+import tempfile
 import unittest
 import yaml
 
@@ -10,7 +17,9 @@ from ..compose import (AgentGoNetHttp, AgentJavaSpring, AgentNodejsExpress,
 from ..compose import (ApmServer, Kibana, Elasticsearch, Filebeat, Metricbeat,
                        Logstash, Kafka)
 
-from ..compose import Zookeeper
+from ..compose import Postgres, Zookeeper
+
+from ..compose import load_resource_profile, named_volumes, resource_limits
 
 
 class ServiceTest(unittest.TestCase):
@@ -49,8 +58,10 @@ class AgentServiceTest(ServiceTest):
                     build:
                         dockerfile: Dockerfile
                         context: docker/nodejs/express
+                        args:
+                            - NODEJS_AGENT_PACKAGE=elastic-apm-node
                     container_name: expressapp
-                    command: bash -c "npm install elastic-apm-node && node app.js"
+                    command: node app.js
                     environment:
                         APM_SERVER_URL: http://apm-server:8200
                         EXPRESS_SERVICE_NAME: expressapp
@@ -65,8 +76,8 @@ class AgentServiceTest(ServiceTest):
         )
 
         vagent = AgentNodejsExpress(nodejs_agent_package="elastic/apm-agent-nodejs#test").render()
-        self.assertEqual('bash -c "npm install elastic/apm-agent-nodejs#test && node app.js"',
-                         vagent["agent-nodejs-express"]["command"])
+        self.assertEqual(["NODEJS_AGENT_PACKAGE=elastic/apm-agent-nodejs#test"],
+                         vagent["agent-nodejs-express"]["build"]["args"])
 
     def test_agent_python_django(self):
         agent = AgentPythonDjango().render()
@@ -76,7 +87,9 @@ class AgentServiceTest(ServiceTest):
                     build:
                         dockerfile: Dockerfile
                         context: docker/python/django
-                    command: bash -c "pip install -U elastic-apm && python testapp/manage.py runserver 0.0.0.0:8003"
+                        args:
+                            - PYTHON_AGENT_PACKAGE=elastic-apm
+                    command: python testapp/manage.py runserver 0.0.0.0:8003
                     container_name: djangoapp
                     environment:
                         APM_SERVER_URL: http://apm-server:8200
@@ -99,7 +112,9 @@ class AgentServiceTest(ServiceTest):
                     build:
                         dockerfile: Dockerfile
                         context: docker/python/flask
-                    command: bash -c "pip install -U elastic-apm && gunicorn app:app"
+                        args:
+                            - PYTHON_AGENT_PACKAGE=elastic-apm
+                    command: gunicorn app:app
                     container_name: flaskapp
                     environment:
                         APM_SERVER_URL: http://apm-server:8200
@@ -114,6 +129,13 @@ class AgentServiceTest(ServiceTest):
             """)  # noqa: 501
         )
 
+    def test_agent_python_package(self):
+        package = "git+https://github.com/elastic/apm-agent-python.git@newfeature1"
+        for agent_class in AgentPythonDjango, AgentPythonFlask:
+            agent = agent_class(python_agent_package=package).render()[agent_class.name()]
+            self.assertEqual(["PYTHON_AGENT_PACKAGE=" + package], agent["build"]["args"])
+            self.assertNotIn("pip install", agent["command"])
+
     def test_agent_ruby_rails(self):
         agent = AgentRubyRails().render()
         self.assertDictEqual(
@@ -247,12 +269,24 @@ class ApmServerServiceTest(ServiceTest):
         for o in kafka_options:
             self.assertTrue(o in apm_server["command"], "{} not set while output=kafka".format(o))
 
+    def test_kafka_output_settings(self):
+        apm_server = ApmServer(version="6.3.100", apm_server_output="kafka", kafka_brokers=2,
+                               apm_server_kafka_compression="lz4",
+                               apm_server_kafka_required_acks=-1).render()["apm-server"]
+        for o in ['output.kafka.hosts=["kafka:9092", "kafka-2:9092"]', "output.kafka.compression=lz4",
+                  "output.kafka.required_acks=-1"]:
+            self.assertIn(o, apm_server["command"])
+
+        apm_server = ApmServer(version="6.3.100", apm_server_kafka_compression="lz4").render()["apm-server"]
+        self.assertNotIn("output.kafka.compression=lz4", apm_server["command"])
+
     def test_apm_server_build_branch(self):
         apm_server = ApmServer(version="6.3.100", apm_server_build="foo.git@bar", release=True).render()["apm-server"]
         self.assertIsNone(apm_server.get("image"))
         self.assertDictEqual(apm_server["build"], {
             'args': {'apm_server_base_image': 'docker.elastic.co/apm/apm-server:6.3.100',
                      'apm_server_branch': 'bar',
+                     'apm_server_cache_key': 'cc7b6ab42c4b',
                      'apm_server_repo': 'foo.git'},
             'context': 'docker/apm-server'})
 
@@ -262,17 +296,102 @@ class ApmServerServiceTest(ServiceTest):
         self.assertDictEqual(apm_server["build"], {
             'args': {'apm_server_base_image': 'docker.elastic.co/apm/apm-server:6.3.100',
                      'apm_server_branch': 'master',
+                     'apm_server_cache_key': '5ae2dc3162d2',
                      'apm_server_repo': 'foo.git'},
             'context': 'docker/apm-server'})
 
+    def test_apm_server_build_classic(self):
+        apm_server = ApmServer(version="6.3.100", apm_server_build="foo.git", apm_server_buildkit=False).render()
+        self.assertEqual("Dockerfile.classic", apm_server["apm-server"]["build"]["dockerfile"])
+
+    def test_apm_server_build_cache_key(self):
+        def cache_key(build):
+            return ApmServer(version="6.3.100", apm_server_build=build).render()["apm-server"]["build"]["args"][
+                "apm_server_cache_key"]
+        self.assertEqual(cache_key("foo.git@bar"), cache_key("foo.git@bar"))
+        self.assertNotEqual(cache_key("foo.git@bar"), cache_key("foo.git@baz"))
+        self.assertNotEqual(cache_key("foo.git@bar"), cache_key("fork/foo.git@bar"))
+        self.assertEqual(cache_key("foo.git"), cache_key("foo.git@master"))
+
+    def test_tuning(self):
+        apm_server = ApmServer(version="6.3.100").render()["apm-server"]
+        self.assertFalse(any(e.startswith("queue.") or ".bulk_max_size=" in e for e in apm_server["command"]))
+
+        apm_server = ApmServer(version="6.3.100", apm_server_queue_size=8192, apm_server_flush_interval="1s",
+                               apm_server_output_workers=4, apm_server_bulk_max_size=1000,
+                               apm_server_compression_level=0).render()["apm-server"]
+        for o in ["queue.mem.events=8192", "queue.mem.flush.timeout=1s", "output.elasticsearch.worker=4",
+                  "output.elasticsearch.bulk_max_size=1000", "output.elasticsearch.compression_level=0"]:
+            self.assertIn(o, apm_server["command"])
+
+        apm_server = ApmServer(version="6.3.100", apm_server_output="logstash",
+                               apm_server_bulk_max_size=1000).render()["apm-server"]
+        self.assertIn("output.logstash.bulk_max_size=1000", apm_server["command"])
+
+        # the kafka output has no worker setting
+        options = dict(version="6.3.100", apm_server_output="kafka", apm_server_output_workers=4,
+                       apm_server_bulk_max_size=1000)
+        self.assertEqual(["apm_server_output_workers"], ApmServer.unsupported_tuning(options))
+        self.assertFalse(any(".worker=" in e for e in ApmServer(**options).render()["apm-server"]["command"]))
+        self.assertEqual([], ApmServer.unsupported_tuning(dict(options, apm_server_output="logstash")))
+
     def test_apm_server_count(self):
         render = ApmServer(version="6.4.100", apm_server_count=2).render()
         apm_server_lb = render["apm-server"]
         apm_server_2 = render["apm-server-2"]
         self.assertIn("build", apm_server_lb)
-        self.assertListEqual(["127.0.0.1:8200:8200"], apm_server_lb["ports"], apm_server_lb["ports"])
+        self.assertListEqual(["127.0.0.1:8200:8200", "127.0.0.1:8404:8404"], apm_server_lb["ports"],
+                             apm_server_lb["ports"])
         self.assertListEqual(["8200", "6060"], apm_server_2["ports"], apm_server_2["ports"])
 
+    def test_elasticsearch_nodes(self):
+        apm_server = ApmServer(version="6.3.100", elasticsearch_nodes=2).render()["apm-server"]
+        self.assertIn("output.elasticsearch.hosts=[elasticsearch:9200, elasticsearch-2:9200]", apm_server["command"])
+
+        apm_server = ApmServer(version="6.3.100", elasticsearch_nodes=2, apm_server_output="kafka").render()
+        self.assertIn('xpack.monitoring.elasticsearch.hosts=["elasticsearch:9200", "elasticsearch-2:9200"]',
+                      apm_server["apm-server"]["command"])
+
+    def test_index_settings(self):
+        apm_server = ApmServer(version="6.3.100").render()["apm-server"]
+        self.assertIn("setup.template.settings.index.number_of_shards=1", apm_server["command"])
+        self.assertIn("setup.template.settings.index.number_of_replicas=0", apm_server["command"])
+
+        apm_server = ApmServer(version="6.3.100", apm_server_index_shards=3,
+                               apm_server_index_replicas=1).render()["apm-server"]
+        self.assertIn("setup.template.settings.index.number_of_shards=3", apm_server["command"])
+        self.assertIn("setup.template.settings.index.number_of_replicas=1", apm_server["command"])
+        self.assertNotIn("setup.template.settings.index.number_of_shards=1", apm_server["command"])
+
+    def test_template_preset(self):
+        apm_server = ApmServer(version="6.3.100", apm_server_template_preset="bulk-ingest",
+                               apm_server_index_shards=2).render()["apm-server"]
+        template_settings = [arg for arg in apm_server["command"] if arg.startswith("setup.template.settings.")]
+        self.assertEqual([
+            "setup.template.settings.index.codec=best_compression",
+            "setup.template.settings.index.number_of_replicas=0",
+            "setup.template.settings.index.number_of_shards=2",
+            "setup.template.settings.index.refresh_interval=30s",
+            "setup.template.settings.index.translog.durability=async",
+        ], template_settings)
+
+    def test_apm_server_proxy(self):
+        apm_server_lb = ApmServer(version="6.4.100", apm_server_count=2).render()["apm-server"]
+        self.assertEqual({"APM_SERVER_COUNT": 2}, apm_server_lb["environment"])
+        self.assertListEqual(["127.0.0.1:8200:8200", "127.0.0.1:8404:8404"], apm_server_lb["ports"])
+
+        apm_server_lb = ApmServer(version="6.4.100", apm_server_count=2, apm_server_balance="leastconn",
+                                  apm_server_http_reuse="safe", apm_server_keepalive="server-close",
+                                  apm_server_maxconn=64, apm_server_proxy_stats_port="9404").render()["apm-server"]
+        self.assertEqual({
+            "APM_SERVER_BALANCE": "leastconn",
+            "APM_SERVER_COUNT": 2,
+            "APM_SERVER_HTTP_REUSE": "safe",
+            "APM_SERVER_KEEPALIVE": "server-close",
+            "APM_SERVER_MAXCONN": 64,
+        }, apm_server_lb["environment"])
+        self.assertIn("127.0.0.1:9404:8404", apm_server_lb["ports"])
+
     def test_apm_server_custom_port(self):
         custom_port = "8203"
         apm_server = ApmServer(version="6.3.100", apm_server_port=custom_port).render()["apm-server"]
@@ -301,6 +420,31 @@ class ApmServerServiceTest(ServiceTest):
 
 
 class ElasticsearchServiceTest(ServiceTest):
+    def test_nodes(self):
+        render = Elasticsearch(version="6.4.100", elasticsearch_nodes=3, elasticsearch_mem_limit="4g").render()
+        self.assertEqual(["elasticsearch", "elasticsearch-2", "elasticsearch-3"], sorted(render))
+        node1, node3 = render["elasticsearch"], render["elasticsearch-3"]
+        for node, name in ((node1, "elasticsearch"), (node3, "elasticsearch-3")):
+            self.assertNotIn("discovery.type=single-node", node["environment"])
+            self.assertIn("discovery.zen.ping.unicast.hosts=elasticsearch,elasticsearch-2,elasticsearch-3",
+                          node["environment"])
+            self.assertIn("discovery.zen.minimum_master_nodes=2", node["environment"])
+            self.assertIn("node.name=" + name, node["environment"])
+            self.assertIn("wait_for_nodes=3", node["healthcheck"]["test"][1])
+            self.assertEqual("4g", node["mem_limit"])
+        self.assertEqual(["127.0.0.1:9200:9200"], node1["ports"])
+        self.assertNotIn("ports", node3)
+        self.assertEqual("localtesting_6.4.100_elasticsearch-3", node3["container_name"])
+        self.assertEqual(["esdata-3:/usr/share/elasticsearch/data"], node3["volumes"])
+        self.assertEqual(node1["image"], node3["image"])
+        self.assertEqual({"esdata", "esdata-2", "esdata-3"}, named_volumes(render))
+
+    def test_single_node(self):
+        render = Elasticsearch(version="6.4.100").render()
+        self.assertEqual(["elasticsearch"], list(render))
+        self.assertIn("discovery.type=single-node", render["elasticsearch"]["environment"])
+        self.assertFalse(any(e.startswith("node.name=") for e in render["elasticsearch"]["environment"]))
+
     def test_6_2_release(self):
         elasticsearch = Elasticsearch(version="6.2.4", release=True).render()["elasticsearch"]
         self.assertEqual(
@@ -336,6 +480,76 @@ class ElasticsearchServiceTest(ServiceTest):
             "xpack.license.self_generated.type=trial" in elasticsearch["environment"], "xpack.license type"
         )
 
+    def test_resources_default(self):
+        elasticsearch = Elasticsearch(version="6.3.100")
+        self.assertEqual("2.1", elasticsearch.compose_version())
+        elasticsearch = elasticsearch.render()["elasticsearch"]
+        self.assertIn("ES_JAVA_OPTS=-Xms1g -Xmx1g", elasticsearch["environment"])
+        self.assertEqual("5g", elasticsearch["mem_limit"])
+        self.assertNotIn("cpus", elasticsearch)
+        self.assertNotIn("cpuset", elasticsearch)
+
+    def test_resources(self):
+        elasticsearch = Elasticsearch(version="6.4.0", elasticsearch_heap="4g", elasticsearch_java_opts="-XX:+UseG1GC",
+                                      elasticsearch_mem_limit="8g", elasticsearch_cpus=3.5,
+                                      elasticsearch_cpuset="0-3")
+        self.assertEqual("2.2", elasticsearch.compose_version())
+        elasticsearch = elasticsearch.render()["elasticsearch"]
+        self.assertIn("ES_JAVA_OPTS=-Xms4g -Xmx4g -XX:UseAVX=2 -XX:+UseG1GC", elasticsearch["environment"])
+        self.assertEqual(("8g", 3.5, "0-3"),
+                         (elasticsearch["mem_limit"], elasticsearch["cpus"], elasticsearch["cpuset"]))
+
+    def test_resources_fast_healthcheck(self):
+        elasticsearch = Elasticsearch(version="6.3.100", elasticsearch_cpus=2, healthcheck_profile="fast")
+        self.assertEqual("2.3", elasticsearch.compose_version())
+
+
+class DataTmpfsTest(ServiceTest):
+    def test_default_volumes(self):
+        elasticsearch = Elasticsearch(version="6.3.100").render()["elasticsearch"]
+        self.assertEqual(["esdata:/usr/share/elasticsearch/data"], elasticsearch["volumes"])
+        self.assertNotIn("tmpfs", elasticsearch)
+        postgres = Postgres().render()["postgres"]
+        self.assertEqual(["./docker/opbeans/sql:/docker-entrypoint-initdb.d", "pgdata:/var/lib/postgresql/data"],
+                         postgres["volumes"])
+
+    def test_tmpfs(self):
+        elasticsearch = Elasticsearch(version="6.3.100", data_tmpfs=True, data_tmpfs_size="512m").render()
+        elasticsearch = elasticsearch["elasticsearch"]
+        # per version path.data
+        self.assertEqual(["/usr/share/elasticsearch/data/6.3.100:size=512m,mode=1777"], elasticsearch["tmpfs"])
+        self.assertIn("path.data=/usr/share/elasticsearch/data/6.3.100", elasticsearch["environment"])
+        self.assertNotIn("volumes", elasticsearch)
+
+        postgres = Postgres(data_tmpfs=True).render()["postgres"]
+        self.assertEqual(["/var/lib/postgresql/data:size=2g,mode=1777"], postgres["tmpfs"])
+        self.assertEqual(["./docker/opbeans/sql:/docker-entrypoint-initdb.d"], postgres["volumes"])
+
+
+class HealthcheckProfileTest(ServiceTest):
+    def test_default(self):
+        elasticsearch = Elasticsearch(version="6.3.100", healthcheck_profile="default")
+        self.assertEqual("2.1", elasticsearch.compose_version())
+        healthcheck = elasticsearch.render()["elasticsearch"]["healthcheck"]
+        self.assertNotIn("start_period", healthcheck)
+        self.assertEqual("20", healthcheck["interval"])
+
+    def test_fast(self):
+        elasticsearch = Elasticsearch(version="6.3.100", healthcheck_profile="fast")
+        self.assertEqual("2.3", elasticsearch.compose_version())
+        healthcheck = elasticsearch.render()["elasticsearch"]["healthcheck"]
+        # keeps the 20s * 10 retries the default profile allows
+        self.assertEqual(("1s", 200, "30s"), (healthcheck["interval"], healthcheck["retries"], healthcheck["start_period"]))
+
+        healthcheck = Kibana(version="6.3.100", healthcheck_profile="fast").render()["kibana"]["healthcheck"]
+        self.assertEqual(("1s", 100, "60s"), (healthcheck["interval"], healthcheck["retries"], healthcheck["start_period"]))
+
+    def test_fast_docker_defaults(self):
+        # neither interval nor retries set, docker defaults to 30s * 3
+        proxy = ApmServer(version="6.3.100", apm_server_count=2, healthcheck_profile="fast").render()["apm-server"]
+        healthcheck = proxy["healthcheck"]
+        self.assertEqual(("1s", 90, "10s"), (healthcheck["interval"], healthcheck["retries"], healthcheck["start_period"]))
+
 
 class FilebeatServiceTest(ServiceTest):
     def test_filebeat_pre_6_1(self):
@@ -404,12 +618,39 @@ class KafkaServiceTest(ServiceTest):
                         KAFKA_ZOOKEEPER_CONNECT: zookeeper:2181
                         KAFKA_ADVERTISED_LISTENERS: PLAINTEXT://kafka:9092
                         KAFKA_OFFSETS_TOPIC_REPLICATION_FACTOR: 1
+                    healthcheck:
+                        interval: 10s
+                        retries: 12
+                        test: ["CMD", "kafka-broker-api-versions", "--bootstrap-server", "localhost:9092"]
                     ports:
                         - 127.0.0.1:9092:9092
             """)
         )
 
 
+    def test_brokers(self):
+        render = Kafka(version="6.2.4", kafka_brokers=3, kafka_partitions=6).render()
+        self.assertEqual(["kafka", "kafka-2", "kafka-3"], sorted(render))
+        kafka_3 = render["kafka-3"]
+        self.assertEqual({
+            "KAFKA_ADVERTISED_LISTENERS": "PLAINTEXT://kafka-3:9092",
+            "KAFKA_BROKER_ID": 3,
+            "KAFKA_NUM_PARTITIONS": 6,
+            "KAFKA_OFFSETS_TOPIC_REPLICATION_FACTOR": 3,
+            "KAFKA_ZOOKEEPER_CONNECT": "zookeeper:2181",
+        }, kafka_3["environment"])
+        self.assertEqual("localtesting_6.2.4_kafka-3", kafka_3["container_name"])
+        self.assertNotIn("ports", kafka_3)
+        self.assertEqual(6, render["kafka"]["environment"]["KAFKA_NUM_PARTITIONS"])
+        self.assertEqual(["127.0.0.1:9092:9092"], render["kafka"]["ports"])
+        self.assertEqual(render["kafka"]["healthcheck"], kafka_3["healthcheck"])
+
+    def test_brokers_fast_healthcheck(self):
+        render = Kafka(version="6.2.4", kafka_brokers=2, healthcheck_profile="fast").render()
+        self.assertEqual("1s", render["kafka"]["healthcheck"]["interval"])
+        self.assertEqual(render["kafka"]["healthcheck"], render["kafka-2"]["healthcheck"])
+
+
 class KibanaServiceTest(ServiceTest):
     def test_6_2_release(self):
         kibana = Kibana(version="6.2.4", release=True).render()
@@ -505,6 +746,34 @@ class LogstashServiceTest(ServiceTest):
         )
 
 
+    def test_kafka_consumers(self):
+        logstash = Logstash(version="6.3.0", kafka_brokers=2, logstash_kafka_consumer_threads=4).render()["logstash"]
+        self.assertEqual({
+            "ELASTICSEARCH_URL": "http://elasticsearch:9200",
+            "KAFKA_BOOTSTRAP_SERVERS": "kafka:9092,kafka-2:9092",
+            "KAFKA_CONSUMER_THREADS": 4,
+        }, logstash["environment"])
+
+
+    def test_pipeline_settings(self):
+        logstash = Logstash(version="6.3.0", logstash_pipeline_workers=4, logstash_pipeline_batch_size=1000,
+                            logstash_pipeline_batch_delay=5).render()["logstash"]
+        self.assertEqual({
+            "ELASTICSEARCH_URL": "http://elasticsearch:9200",
+            "PIPELINE_BATCH_DELAY": 5,
+            "PIPELINE_BATCH_SIZE": 1000,
+            "PIPELINE_WORKERS": 4,
+        }, logstash["environment"])
+        self.assertEqual(["./docker/logstash/pipeline/:/usr/share/logstash/pipeline/"], logstash["volumes"])
+
+    def test_persistent_queue(self):
+        logstash = Logstash(version="6.3.0", logstash_persistent_queue=True,
+                            logstash_queue_max_bytes="4gb").render()["logstash"]
+        self.assertEqual("persisted", logstash["environment"]["QUEUE_TYPE"])
+        self.assertEqual("4gb", logstash["environment"]["QUEUE_MAX_BYTES"])
+        self.assertIn("lsdata:/usr/share/logstash/data", logstash["volumes"])
+
+
 class MetricbeatServiceTest(ServiceTest):
     def test_metricbeat(self):
         metricbeat = Metricbeat(version="6.2.4", release=True).render()
@@ -530,6 +799,11 @@ class MetricbeatServiceTest(ServiceTest):
                         - /var/run/docker.sock:/var/run/docker.sock""")
         )
 
+    def test_metricbeat_benchmark(self):
+        metricbeat = Metricbeat(version="6.2.4", release=True, metricbeat_benchmark=True).render()["metricbeat"]
+        self.assertIn("./docker/metricbeat/metricbeat.benchmark.yml:/usr/share/metricbeat/metricbeat.yml",
+                      metricbeat["volumes"])
+
 
 class ZookeeperServiceTest(ServiceTest):
     def test_zookeeper(self):
@@ -545,3 +819,73 @@ class ZookeeperServiceTest(ServiceTest):
                     ports:
                         - 127.0.0.1:2181:2181""")
         )
+
+
+class ResourceProfileTest(ServiceTest):
+    profile = collections.OrderedDict([
+        ("elasticsearch", {"cpuset": "0-3", "mem_limit": "8g"}),
+        ("apm-server-load-balancer", {"cpus": 0.5}),
+        ("apm-server*", {"cpuset": "4-5"}),
+        ("*", {"cpuset": "6-7"}),
+    ])
+
+    def test_resource_limits(self):
+        self.assertEqual({"cpuset": "0-3", "mem_limit": "8g"}, resource_limits(self.profile, "elasticsearch"))
+        # exact names win over patterns listed before them
+        self.assertEqual({"cpus": 0.5}, resource_limits(self.profile, "apm-server-load-balancer"))
+        self.assertEqual({"cpuset": "4-5"}, resource_limits(self.profile, "apm-server-2"))
+        self.assertEqual({"cpuset": "6-7"}, resource_limits(self.profile, "agent-python-django"))
+        self.assertEqual({}, resource_limits(None, "kibana"))
+
+    def test_render(self):
+        kibana = Kibana(version="6.3.100", resource_profile=self.profile).render()["kibana"]
+        self.assertEqual("6-7", kibana["cpuset"])
+        self.assertNotIn("mem_limit", kibana)
+
+        agent = AgentPythonDjango(resource_profile=self.profile).render()["agent-python-django"]
+        self.assertEqual("6-7", agent["cpuset"])
+
+    def test_elasticsearch_options_win(self):
+        elasticsearch = Elasticsearch(version="6.3.100", resource_profile=self.profile).render()["elasticsearch"]
+        self.assertEqual(("0-3", "8g"), (elasticsearch["cpuset"], elasticsearch["mem_limit"]))
+
+        elasticsearch = Elasticsearch(version="6.3.100", resource_profile=self.profile, elasticsearch_cpuset="0-1",
+                                      elasticsearch_mem_limit="4g").render()["elasticsearch"]
+        self.assertEqual(("0-1", "4g"), (elasticsearch["cpuset"], elasticsearch["mem_limit"]))
+
+        # default memory limit without profile
+        elasticsearch = Elasticsearch(version="6.3.100", resource_profile={"*": {"cpus": 2}}).render()["elasticsearch"]
+        self.assertEqual((2, "5g"), (elasticsearch["cpus"], elasticsearch["mem_limit"]))
+
+    def test_apm_server_load_balancer(self):
+        apm_server = ApmServer(version="6.3.100", apm_server_count=2, resource_profile=self.profile)
+        # cpus for the load balancer
+        self.assertEqual("2.2", apm_server.compose_version())
+        rendered = apm_server.render()
+        self.assertEqual(0.5, rendered["apm-server"]["cpus"])
+        self.assertNotIn("cpuset", rendered["apm-server"])
+        self.assertEqual("4-5", rendered["apm-server-1"]["cpuset"])
+        self.assertEqual("4-5", rendered["apm-server-2"]["cpuset"])
+        self.assertEqual("2.1", ApmServer(version="6.3.100", resource_profile=self.profile).compose_version())
+
+    def test_load_resource_profile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "profile.json")
+        with open(path, "w") as f:
+            json.dump(self.profile, f)
+        self.assertEqual(list(self.profile.items()), list(load_resource_profile(path).items()))
+
+        with open(path, "w") as f:
+            json.dump({"kibana": {"cpu_shares": 512}}, f)
+        with self.assertRaises(argparse.ArgumentTypeError):
+            load_resource_profile(path)
+
+        with self.assertRaises(argparse.ArgumentTypeError):
+            load_resource_profile(os.path.join(tmpdir, "missing.json"))
+
+    def test_example_profiles(self):
+        profiles = glob.glob(os.path.join(os.path.dirname(__file__), "..", "resource-profiles", "*.json"))
+        self.assertTrue(profiles)
+        for path in profiles:
+            load_resource_profile(path)
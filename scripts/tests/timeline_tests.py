@@ -0,0 +1,117 @@
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from ..compose import LocalSetup, StartupTimeline
+
+if sys.version_info[0] == 3:
+    from io import StringIO
+else:
+    from io import BytesIO as StringIO
+
+
+SERVICES = {
+    "elasticsearch": {"healthcheck": {}},
+    "kibana": {"depends_on": {"elasticsearch": {"condition": "service_healthy"}}, "healthcheck": {}},
+    "apm-server": {
+        "depends_on": {
+            "elasticsearch": {"condition": "service_healthy"},
+            "kibana": {"condition": "service_healthy"},
+        },
+        "healthcheck": {},
+    },
+    "zookeeper": {},
+    "kafka": {"depends_on": ["zookeeper"]},
+}
+
+
+def event(service, action, seconds):
+    return {
+        "Type": "container",
+        "Action": action,
+        "status": action,
+        "Actor": {"Attributes": {"com.docker.compose.service": service, "name": "localtesting_" + service}},
+        "time": int(seconds),
+        "timeNano": int(seconds * 1e9),
+    }
+
+
+# recorded `docker events --format '{{json .}}'` output, trimmed to the interesting actions
+EVENTS = [
+    event("elasticsearch", "create", 1000.0),
+    event("zookeeper", "create", 1000.1),
+    event("elasticsearch", "start", 1000.5),
+    event("zookeeper", "start", 1000.6),
+    event("kafka", "create", 1000.7),
+    event("kafka", "start", 1001.0),
+    event("elasticsearch", "exec_start: curl -s http://localhost:9200/_cluster/health", 1005.0),
+    event("elasticsearch", "health_status: healthy", 1020.0),
+    event("kibana", "create", 1020.1),
+    event("kibana", "start", 1020.5),
+    event("kibana", "health_status: healthy", 1050.0),
+    event("apm-server", "create", 1050.1),
+    event("apm-server", "start", 1050.5),
+    event("apm-server", "health_status: healthy", 1055.0),
+    event("not-in-compose", "start", 990.0),
+]
+
+
+class StartupTimelineTest(unittest.TestCase):
+    maxDiff = None
+
+    def timeline(self, events=EVENTS):
+        timeline = StartupTimeline(SERVICES)
+        for e in events:
+            timeline.feed(e)
+        return timeline
+
+    def test_ready(self):
+        timeline = self.timeline()
+        self.assertTrue(timeline.complete())
+        self.assertEqual(timeline.origin, 1000.0)
+        # services without healthcheck are ready once started
+        self.assertEqual(timeline.ready("kafka"), 1001.0)
+        self.assertEqual(timeline.ready("kibana"), 1050.0)
+
+    def test_critical_path(self):
+        self.assertEqual(["elasticsearch", "kibana", "apm-server"], self.timeline().critical_path())
+
+    def test_incomplete(self):
+        timeline = self.timeline(EVENTS[:9])
+        self.assertFalse(timeline.complete())
+        self.assertEqual(["elasticsearch"], timeline.critical_path())
+        self.assertIn("not ready: apm-server, kibana", timeline.render())
+
+    def test_render(self):
+        rendered = self.timeline().render().splitlines()
+        self.assertEqual(rendered[0].split(), ["service", "created", "started", "healthy"])
+        self.assertEqual(rendered[1].split(), ["zookeeper", "0.1s", "0.6s", "-"])
+        self.assertEqual(rendered[-1],
+                         "critical path: elasticsearch (+20.0s) -> kibana (+30.0s) -> apm-server (+5.0s) = 55.0s")
+
+    def test_replay(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            docker_compose_path = os.path.join(tmpdir, "docker-compose.yml")
+            with open(docker_compose_path, "w") as f:
+                json.dump({"version": "2.1", "services": SERVICES}, f)
+            events_file = os.path.join(tmpdir, "events.json")
+            with open(events_file, "w") as f:
+                for e in EVENTS:
+                    f.write(json.dumps(e) + "\n")
+
+            out = StringIO()
+            stdout, sys.stdout = sys.stdout, out
+            try:
+                LocalSetup(argv=["timeline", "--docker-compose-path", docker_compose_path,
+                                 "--events-file", events_file])()
+            finally:
+                sys.stdout = stdout
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertIn("critical path: elasticsearch (+20.0s)", out.getvalue())
@@ -0,0 +1,65 @@
+from __future__ import print_function
+
+import json
+
+from ..compose import DockerClient, probe_versions, running_containers
+from .fakes import DockerTestCase, listed_container
+
+KIBANA_PACKAGE = json.dumps({"version": "6.3.3", "branch": "6.3", "build": {"sha": "abc123", "number": 17000}})
+
+
+class VersionsTest(DockerTestCase):
+    def setUp(self):
+        super(VersionsTest, self).setUp()
+        self.docker.containers = [
+            listed_container("elasticsearch", image="sha256:es"),
+            listed_container("kibana", image="sha256:kibana"),
+            listed_container("apm-server", image="sha256:apm"),
+            listed_container("opbeans-ruby", image="sha256:ruby"),
+            listed_container("postgres", image="sha256:postgres"),
+        ]
+        self.docker.images = [{"Id": c["ImageID"], "Created": 1534759872} for c in self.docker.containers]
+        self.docker.execs = {
+            "localtesting_6.3.3_elasticsearch": (
+                0, "Version: 6.3.3, Build: default/tar/abc/2018-08-20T10:11:12Z, JVM: 1.8.0_181", 0),
+            "localtesting_6.3.3_kibana": (0, KIBANA_PACKAGE, 0),
+            "localtesting_6.3.3_apm-server": (0, "apm-server version 6.3.3", 1),
+            "localtesting_6.3.3_opbeans-ruby": (0, "elastic-apm (1.0.0)\n", 0),
+        }
+
+    def test_running_containers(self):
+        containers = running_containers(DockerClient())
+        self.assertEqual(
+            ["elasticsearch", "kibana", "apm-server", "opbeans-ruby", "postgres"],
+            [c.service for c in containers])
+        # one call for all containers, one for all images
+        self.assertEqual(2, len(self.docker.requests))
+        self.assertEqual(containers[0].name, "localtesting_6.3.3_elasticsearch")
+        self.assertEqual(containers[0].created.isoformat(), "2018-08-20T10:11:12")
+
+    def test_probe_versions(self):
+        versions = probe_versions(running_containers(DockerClient()), timeout=0.2)
+        self.assertEqual(versions["kibana"]["build_sha"], "abc123")
+        self.assertEqual(versions["kibana"]["build_number"], 17000)
+        self.assertEqual(versions["opbeans-ruby"]["version"], "1.0.0")
+        self.assertEqual(versions["apm-server"]["error"], "no response within 0.2s")
+        self.assertEqual(versions["postgres"], {"stack_version": "6.3.3", "image_created": "2018-08-20 10:11:12"})
+        self.assertIn(("POST", "/containers/localtesting_6.3.3_opbeans-ruby/exec",
+                       {"AttachStdout": True, "AttachStderr": True,
+                        "Cmd": ["sh", "-c", "gem list | grep elastic-apm"]}),
+                      self.docker.requests)
+
+    def test_versions_json(self):
+        self.docker.execs["localtesting_6.3.3_apm-server"] = (0, "apm-server version 6.3.3", 0)
+        versions = json.loads(self.run_command("versions", "--json"))
+        self.assertEqual(versions["elasticsearch"]["version"].split(",")[0], "Version: 6.3.3")
+        self.assertEqual(versions["apm-server"]["version"], "apm-server version 6.3.3")
+        self.assertEqual(set(versions), {"elasticsearch", "kibana", "apm-server", "opbeans-ruby", "postgres"})
+
+    def test_versions_text(self):
+        self.docker.execs["localtesting_6.3.3_apm-server"] = (0, "apm-server version 6.3.3", 0)
+        self.docker.execs["localtesting_6.3.3_opbeans-ruby"] = (1, "", 0)
+        out = self.run_command("versions", "--timeout", "1")
+        self.assertIn("\tBuild SHA: abc123\n", out)
+        self.assertIn("unknown version for postgres\n", out)
+        self.assertIn('"opbeans-ruby" is not running or an error occurred: exit status 1', out)
@@ -7,7 +7,6 @@ from tornado import ioloop, httpclient
 
 import timeout_decorator
 
-
 FOO = "foo"
 BAR = "bar"
 
@@ -24,6 +23,9 @@ def anomaly(x):
 
 
 class Concurrent:
+    # hooks of loads not given any, set for each test by the load_hooks fixture
+    default_hooks = ()
+
     class Endpoint:
         def __init__(self, url, app_name, span_names, transaction_name,
                      events_no=1000):
@@ -53,7 +55,7 @@ class Concurrent:
         def count(self, name):
             return self.no_per_event.get(name, 0) * self.events_no
 
-    def __init__(self, elasticsearch, endpoints, iters=1, index="apm-*"):
+    def __init__(self, elasticsearch, endpoints, iters=1, index="apm-*", hooks=None):
         self.num_reqs = 0
         self.index = index
         # TODO: improve ES handling
@@ -61,6 +63,10 @@ class Concurrent:
         self.es = elasticsearch.es
         self.endpoints = endpoints
         self.iters = iters
+        # called before and after each iteration's load, see tests/benchmarks/hooks.py.
+        # the load's length isn't known ahead, so hooks aren't called at its start, peak and end points
+        self.hooks = Concurrent.default_hooks if hooks is None else hooks
+        self.results = []
         self.set_logger()
 
     def count(self, name):
@@ -260,17 +266,41 @@ class Concurrent:
                         assert all(
                             frame.get(attr) for frame in stacktrace), stacktrace[0].keys()
 
+    def load_iteration(self, it):
+        params = {"iteration": it, "requests": sum(ep.events_no for ep in self.endpoints)}
+        result = {"iteration": it}
+        for hook in self.hooks:
+            hook.before_load(params)
+        start = time.time()
+        try:
+            self.load_test()
+        finally:
+            result["seconds"] = time.time() - start
+            for hook in self.hooks:
+                hook.after_load(params, result)
+        # summaries of the hooks that sampled something during the load
+        for hook in self.hooks:
+            if getattr(hook, "name", None):
+                result[hook.name] = hook.summary()
+        return result
+
     def run(self):
         self.logger.info("Testing started..")
         self.elasticsearch.clean()
 
+        self.results = []
         start_load = datetime.utcnow()
         for it in range(1, self.iters + 1):
             self.logger.info("Sending batch {} / {}".format(it, self.iters))
-            self.load_test()
+            result = self.load_iteration(it)
+            self.results.append(result)
+            if result.get("elasticsearch"):
+                self.logger.info("Elasticsearch: {index_per_second:.0f} docs/s, {write_rejected} rejected, "
+                                 "{merge_ms} ms merging, {refresh_ms} ms refreshing".format(**result["elasticsearch"]))
             self.check_counts(it)
             # wait until counts are solid
             end_load = datetime.utcnow()
             self.check_content(it, start_load, end_load)
             self.logger.info("So far so good...")
         self.logger.info("ALL DONE")
+        return self.results
@@ -0,0 +1,128 @@
+"""
+Sweep apm-server throughput settings under the same direct intake load.
+
+The stack is started once. For every combination of the given settings apm-server is
+recreated with those settings, `apm-*` indices are deleted, intake load is sent for a fixed
+duration, and the events indexed per second until apm-server's queue has drained are
+reported next to Elasticsearch's indexing time. Settings that are not swept keep apm-server's
+defaults, an empty value in a list stands for the default too.
+
+    python -m tests.benchmarks.apm_server_sweep --bulk-max-size 50,1000 --output-workers 1,4 --duration 60
+
+Bulk latency is estimated from apm-server's output metrics, sampled from its monitor port: the
+events its output has in flight over the rate they are acknowledged at. Elasticsearch's own
+average bulk request time is reported next to it where available, only 7.8 and later have it.
+This replaces docker-compose.yml in the repository root.
+"""
+import argparse
+import collections
+import itertools
+import os
+import shlex
+
+import elasticsearch
+
+from tests.benchmarks import intake
+from tests.benchmarks.expvar import ExpvarSampler
+from tests.benchmarks.hooks import ProfileHook
+from tests.benchmarks.indexing import IndexingTotals, measure_indexing
+from tests.benchmarks.report import print_table, write_json
+from tests.benchmarks.stack import start
+from tests.fixtures import default
+
+# sweep argument, compose.py option
+SETTINGS = [
+    ("queue_size", "--apm-server-queue-size"),
+    ("flush_interval", "--apm-server-flush-interval"),
+    ("output_workers", "--apm-server-output-workers"),
+    ("bulk_max_size", "--apm-server-bulk-max-size"),
+    ("compression_level", "--apm-server-compression-level"),
+]
+
+
+def values(arg):
+    return [v or None for v in arg.split(",")]
+
+
+def compose_flags(combination):
+    flags = []
+    for (_, option), value in zip(SETTINGS, combination):
+        if value is not None:
+            flags.extend([option, value])
+    return flags
+
+
+def profile_hooks(args, settings):
+    """profile each combination in its own directory, named after the settings that differ from the defaults"""
+    if not args.profile_dir:
+        return []
+    name = "_".join("{}-{}".format(k, v) for k, v in settings.items() if v is not None) or "defaults"
+    return [ProfileHook(args.monitor_url, os.path.join(args.profile_dir, name), args.profile_seconds)]
+
+
+def measure(es, args, body, settings):
+    totals = IndexingTotals(es)
+    output = ExpvarSampler(args.monitor_url)
+    result = measure_indexing(es, args.apm_server_url, body, args.duration, args.concurrency, args.drain_timeout,
+                              hooks=[totals, output] + profile_hooks(args, settings), params=settings)
+    # once everything accepted is indexed
+    delta = totals.since()
+    result.update({
+        "bulk_ms": output.summary().get("bulk_latency_ms"),
+        "es_bulk_ms": delta["bulk_time"] / delta["bulk_total"] if delta["bulk_total"] else None,
+        "index_ms_per_doc": delta["index_time"] / delta["index_total"] if delta["index_total"] else None,
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="apm-server throughput per output and queue setting")
+    parser.add_argument("--version", default="master", help="stack version")
+    parser.add_argument("--compose-args", default="", help="additional compose.py start arguments")
+    for name, option in SETTINGS:
+        parser.add_argument("--" + name.replace("_", "-"), type=values, default=[None],
+                            help="comma separated values for " + option)
+    parser.add_argument("--duration", type=int, default=30, help="seconds of load per combination")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent intake requests")
+    parser.add_argument("--transactions-per-request", type=int, default=10, help="transactions in each request")
+    parser.add_argument("--drain-timeout", type=int, default=120,
+                        help="seconds to wait for apm-server to index the accepted events")
+    parser.add_argument("--apm-server-url", default=default.from_env("APM_SERVER_URL"))
+    parser.add_argument("--es-url", default=default.from_env("ES_URL"))
+    parser.add_argument("--profile-dir",
+                        help="capture apm-server profiles at the start, peak and end of each load here")
+    parser.add_argument("--profile-seconds", type=int, default=10, help="seconds to sample each cpu profile for")
+    parser.add_argument("--monitor-url", default="http://localhost:6060", help="apm-server monitor url")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    compose_args = shlex.split(args.compose_args)
+    combinations = list(itertools.product(*[getattr(args, name) for name, _ in SETTINGS]))
+    es = elasticsearch.Elasticsearch([args.es_url])
+    body = intake.payload(args.transactions_per_request)
+
+    start(args.version, compose_args + compose_flags(combinations[0]), args.apm_server_url, args.es_url)
+    results = []
+    for combination in combinations:
+        start(args.version, compose_args + compose_flags(combination), args.apm_server_url, args.es_url,
+              up_args=["--no-deps", "--force-recreate", "apm-server"], timeout=300)
+        settings = collections.OrderedDict((name, value) for (name, _), value in zip(SETTINGS, combination))
+        result = measure(es, args, body, settings)
+        result["settings"] = settings
+        results.append(result)
+
+    def ms(value):
+        return "{:.2f}".format(value) if value is not None else None
+
+    print_table(
+        [name for name, _ in SETTINGS] +
+        ["sent/s", "indexed/s", "bulk ms", "es bulk ms (7.8+)", "index ms/doc", "errors"],
+        [[r["settings"][name] for name, _ in SETTINGS] + [
+            "{:.0f}".format(r["load"]["events_per_second"]), "{:.0f}".format(r["indexed_per_second"]),
+            ms(r["bulk_ms"]), ms(r["es_bulk_ms"]), ms(r["index_ms_per_doc"]), r["load"]["errors"]] for r in results])
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
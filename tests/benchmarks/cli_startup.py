@@ -0,0 +1,80 @@
+"""
+Measure compose.py startup for the commands run most often.
+
+Wall clock times are for complete `compose.py` processes, including the interpreter, next to
+`python -c pass`. `list-options` and the bash completion function are timed without and with
+the completion cache, and the argument parser setup alone is timed in process for a command
+that needs the service options (start) and one that doesn't (status).
+
+    python -m tests.benchmarks.cli_startup --runs 20
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from scripts.compose import LocalSetup, options_cache_path
+from tests.benchmarks.report import print_table, write_json
+
+COMPOSE_PY = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "scripts", "compose.py"))
+COMPLETION = os.path.join(os.path.dirname(COMPOSE_PY), "compose-completion.bash")
+# complete `compose.py start 6.3 --with-op`
+COMPLETE = "source {}; COMP_WORDS=({} start 6.3 --with-op); COMP_CWORD=3; _compose_py".format(COMPLETION, COMPOSE_PY)
+
+
+def wall_ms(argv, runs, env, before=None):
+    times = []
+    for _ in range(runs):
+        if before:
+            before()
+        times.append(timeit.timeit(
+            lambda: subprocess.check_call(argv, stdout=subprocess.DEVNULL, env=env), number=1) * 1000)
+    return statistics.median(times)
+
+
+def setup_ms(argv, runs):
+    return statistics.median(timeit.repeat(lambda: LocalSetup(argv=argv), number=1, repeat=runs)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compose.py startup times")
+    parser.add_argument("--runs", type=int, default=10, help="runs per measurement, the median is reported")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    cache_home = tempfile.mkdtemp()
+    env = dict(os.environ, XDG_CACHE_HOME=cache_home)
+
+    def drop_cache():
+        if os.path.exists(cache):
+            os.remove(cache)
+
+    try:
+        os.environ["XDG_CACHE_HOME"] = cache_home
+        cache = options_cache_path()
+        compose = [sys.executable, COMPOSE_PY]
+        results = {
+            "python -c pass": wall_ms([sys.executable, "-c", "pass"], args.runs, env),
+            "--help": wall_ms(compose + ["--help"], args.runs, env),
+            "start --help": wall_ms(compose + ["start", "--help"], args.runs, env),
+            "list-options start (no cache)": wall_ms(compose + ["list-options", "start"], args.runs, env, drop_cache),
+            "list-options start (cached)": wall_ms(compose + ["list-options", "start"], args.runs, env),
+            "bash completion (no cache)": wall_ms(["bash", "-c", COMPLETE], args.runs, env, drop_cache),
+            "bash completion (cached)": wall_ms(["bash", "-c", COMPLETE], args.runs, env),
+            "parser setup: start": setup_ms(["start", "master"], args.runs),
+            "parser setup: status": setup_ms(["status"], args.runs),
+        }
+    finally:
+        shutil.rmtree(cache_home)
+
+    print_table(["measurement", "ms"], [[name, "{:.1f}".format(ms)] for name, ms in results.items()])
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
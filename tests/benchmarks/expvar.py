@@ -0,0 +1,93 @@
+"""
+apm-server's own metrics during a load run, sampled from /debug/vars on its monitor port.
+
+Unlike the metricbeat window this needs nothing but the `--httpprof` monitor compose.py
+starts apm-server with, so it also runs alongside the agent tests' Concurrent load.
+"""
+import requests
+
+from tests.benchmarks.hooks import SamplingHook
+
+VARS_PATH = "/debug/vars"
+# counters and gauges sampled, libbeat publishes its metrics as dotted expvar names
+VARS = {
+    # events apm-server put into its publishing pipeline and those its output got acknowledged
+    "received": "libbeat.pipeline.events.total",
+    "published": "libbeat.output.events.acked",
+    # events waiting in the queue, and those handed to the output but not acknowledged yet
+    "queue": "libbeat.pipeline.events.active",
+    "output_active": "libbeat.output.events.active",
+    "gc_pause_ns": "memstats.PauseTotalNs",
+    "gc_count": "memstats.NumGC",
+    "heap_inuse": "memstats.HeapInuse",
+}
+
+
+def lookup(expvars, name):
+    """a value by its dotted name, published either flat or as nested objects, 0 when missing"""
+    if name in expvars:
+        return expvars[name]
+    value = expvars
+    for key in name.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return 0
+        value = value[key]
+    return value
+
+
+def derived(samples):
+    """rates and levels between consecutive (seconds, vars) samples"""
+    series = []
+    for (start, first), (end, last) in zip(samples, samples[1:]):
+        seconds = end - start
+        if seconds <= 0:
+            continue
+        published_per_second = (last["published"] - first["published"]) / seconds
+        series.append({
+            "seconds": end,
+            "received_per_second": (last["received"] - first["received"]) / seconds,
+            "published_per_second": published_per_second,
+            "queue": last["queue"],
+            # expvar has no request latency, estimate how long the output holds an event by Little's law
+            "bulk_latency_ms": last["output_active"] / published_per_second * 1000 if published_per_second else None,
+            "gc_pause_ms": (last["gc_pause_ns"] - first["gc_pause_ns"]) / 1e6,
+            "heap_inuse_mb": last["heap_inuse"] / 2.0 ** 20,
+        })
+    return series
+
+
+def summarize(samples):
+    if len(samples) < 2:
+        return {}
+    (start, first), (end, last) = samples[0], samples[-1]
+    series = derived(samples)
+    latencies = [s["bulk_latency_ms"] for s in series if s["bulk_latency_ms"] is not None]
+    return {
+        "received_per_second": (last["received"] - first["received"]) / (end - start),
+        "published_per_second": (last["published"] - first["published"]) / (end - start),
+        "queue_max": max(s["queue"] for _, s in samples),
+        "bulk_latency_ms": sum(latencies) / len(latencies) if latencies else None,
+        "bulk_latency_ms_max": max(latencies) if latencies else None,
+        "gc_pause_ms": (last["gc_pause_ns"] - first["gc_pause_ns"]) / 1e6,
+        "gc_count": last["gc_count"] - first["gc_count"],
+        "heap_inuse_max_mb": max(s["heap_inuse"] for _, s in samples) / 2.0 ** 20,
+        "series": series,
+    }
+
+
+class ExpvarSampler(SamplingHook):
+    """sample apm-server's expvar metrics while the load runs"""
+    name = "expvar"
+
+    def __init__(self, monitor_url="http://localhost:6060", interval=1):
+        super(ExpvarSampler, self).__init__(interval)
+        self.url = monitor_url.rstrip("/") + VARS_PATH
+
+    def sample(self):
+        r = requests.get(self.url, timeout=self.interval + 5)
+        r.raise_for_status()
+        expvars = r.json()
+        return {name: lookup(expvars, var) for name, var in VARS.items()}
+
+    def summary(self):
+        return summarize(self.samples)
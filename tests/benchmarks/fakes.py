@@ -0,0 +1,61 @@
+"""
+An elasticsearch-py client for the benchmark tests, answering with the functions it's given.
+"""
+
+
+class FakeIndices(object):
+    def __init__(self, stats=None):
+        self.calls = []
+        self._stats = stats
+
+    def refresh(self, **kwargs):
+        self.calls.append("refresh")
+
+    def forcemerge(self, **kwargs):
+        self.calls.append("forcemerge")
+
+    def delete(self, **kwargs):
+        self.calls.append("delete")
+
+    def stats(self, **kwargs):
+        self.calls.append("stats")
+        return self._stats
+
+
+class FakeNodes(object):
+    def __init__(self, stats=None):
+        self.calls = 0
+        self._stats = stats
+
+    def stats(self, **kwargs):
+        self.calls += 1
+        return self._stats(self.calls)
+
+
+class FakeElasticsearch(object):
+    """searches are answered by search(index, body), counts by count(index, body), nodes stats by
+    nodes_stats(number of the call)
+
+    Every search's arguments are kept in searches.
+    """
+
+    def __init__(self, search=None, nodes_stats=None, indices_stats=None, count=None):
+        self.searches = []
+        self._search = search
+        self._count = count
+        self.indices = FakeIndices(indices_stats)
+        self.nodes = FakeNodes(nodes_stats)
+
+    def search(self, index, body, **kwargs):
+        self.searches.append(dict(kwargs, index=index, body=body))
+        return self._search(index, body)
+
+    def count(self, index, body):
+        return {"count": self._count(index, body)}
+
+
+class FakeEsFixture(object):
+    """the es fixture of tests/fixtures/es.py around a FakeElasticsearch"""
+
+    def __init__(self, client=None):
+        self.es = client or FakeElasticsearch()
@@ -0,0 +1,64 @@
+"""
+Read the statistics of the haproxy load balancer in front of several apm-servers.
+"""
+import collections
+import csv
+
+import requests
+
+# published by compose.py on --apm-server-proxy-stats-port
+STATS_URL = "http://localhost:8404"
+STATS_PATH = "/stats;csv"
+BACKEND = "servers"
+# http responses per status class, counted for every server
+RESPONSE_COLUMNS = ["hrsp_1xx", "hrsp_2xx", "hrsp_3xx", "hrsp_4xx", "hrsp_5xx", "hrsp_other"]
+# per server counters: current and total sessions, current and max queued requests, and the average
+# queue, response and total times in ms over the last 1024 requests
+COUNTERS = collections.OrderedDict([
+    ("sessions", "scur"),
+    ("sessions_total", "stot"),
+    ("queued", "qcur"),
+    ("queued_max", "qmax"),
+    ("queue_ms", "qtime"),
+    ("response_ms", "rtime"),
+    ("total_ms", "ttime"),
+])
+
+
+def parse_stats(text):
+    """rows of haproxy's csv statistics, as dicts keyed by column name"""
+    return list(csv.DictReader(text.lstrip("# ").splitlines()))
+
+
+def servers(rows, backend=BACKEND):
+    """{server name: {"status": .., "requests": .., counter: ..}} for the servers of backend"""
+    result = {}
+    for row in rows:
+        if row["pxname"] != backend or row["svname"] in ("FRONTEND", "BACKEND"):
+            continue
+        server = {
+            "status": row["status"],
+            "requests": sum(int(row[c] or 0) for c in RESPONSE_COLUMNS),
+        }
+        for name, column in COUNTERS.items():
+            server[name] = int(row[column]) if row.get(column) else None
+        result[row["svname"]] = server
+    return result
+
+
+def fetch(url=STATS_URL):
+    """server statistics from the load balancer's stats listener at url"""
+    r = requests.get(url + STATS_PATH, timeout=10)
+    r.raise_for_status()
+    return servers(parse_stats(r.text))
+
+
+def balance(before, after):
+    """
+    requests each server handled between two fetches, and the busiest server's requests over the mean.
+
+    1 is a perfectly even balance, a hot backend shows as a skew well above it.
+    """
+    handled = {name: after[name]["requests"] - before.get(name, {}).get("requests", 0) for name in after}
+    mean = sum(handled.values()) / float(len(handled)) if handled else 0
+    return handled, max(handled.values()) / mean if mean else None
@@ -0,0 +1,136 @@
+"""
+Hooks called by load drivers before, during and after a load run.
+
+During the run each hook is called at the start, peak and end of the load from its own
+thread, so the load keeps running while a hook, eg a profile capture, takes its time.
+"""
+import threading
+import time
+
+from scripts.compose import capture_profiles
+
+# points of a load run hooks are called at, in order
+POINTS = ("start", "peak", "end")
+
+
+class LoadHook(object):
+    """base class for hooks, override the calls of interest"""
+    # seconds a hook takes at each point, the peak and end points are moved earlier so it still falls within the load
+    window = 0
+    # key of the hook's summary() in the results of drivers that collect them, eg the agent tests' Concurrent
+    name = None
+
+    def before_load(self, params):
+        pass
+
+    def at(self, point, params):
+        pass
+
+    def after_load(self, params, result):
+        pass
+
+
+def offsets(duration, window):
+    """seconds into the load each point is reached at, for a hook taking window seconds"""
+    latest = max(0, duration - window)
+    return {"start": 0, "peak": latest / 2.0, "end": latest}
+
+
+def _call_at_points(hook, start, duration, params, failed):
+    points = offsets(duration, hook.window)
+    for point in POINTS:
+        delay = start + points[point] - time.time()
+        # a failed load skips the points still to come
+        if failed.wait(delay) if delay > 0 else failed.is_set():
+            return
+        try:
+            hook.at(point, params)
+        except Exception as e:
+            # a failed hook shouldn't abort the load run
+            print("{} failed at {}: {}".format(type(hook).__name__, point, e))
+
+
+def run_load(load, duration, params, hooks=()):
+    """call load(), which runs for duration seconds, with the hooks around it and at each point of it
+
+    hooks are called after the load even if it raises, with a None result.
+    """
+    for hook in hooks:
+        hook.before_load(params)
+    start = time.time()
+    failed = threading.Event()
+    threads = [threading.Thread(target=_call_at_points, args=(hook, start, duration, params, failed))
+               for hook in hooks]
+    for t in threads:
+        t.start()
+    result = None
+    try:
+        result = load()
+    except BaseException:
+        failed.set()
+        raise
+    finally:
+        for t in threads:
+            t.join()
+        for hook in hooks:
+            hook.after_load(params, result)
+    return result
+
+
+class SamplingHook(LoadHook):
+    """sample() every interval seconds from before to after the load, keeping (seconds into the load, sample)"""
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def sample(self):
+        raise NotImplementedError
+
+    def _sample_once(self):
+        try:
+            self.samples.append((time.time() - self._start, self.sample()))
+        except Exception as e:
+            # keep sampling, a slow service may answer the next time
+            print("{} failed to sample: {}".format(type(self).__name__, e))
+
+    def _run(self):
+        while True:
+            self._sample_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def before_load(self, params):
+        self.samples = []
+        self._stop.clear()
+        self._start = time.time()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def after_load(self, params, result):
+        self._stop.set()
+        self._thread.join()
+        # the state right at the end of the load
+        self._sample_once()
+
+
+class ProfileHook(LoadHook):
+    """capture apm-server profiles at each point, saved with the load parameters
+
+    only drivers with a known duration call the points, ie those using run_load like the intake and sweep
+    benchmarks. The agent tests' Concurrent load runs until its requests are answered, it calls no points.
+    """
+
+    def __init__(self, url, output_dir, seconds=10, profiles=None):
+        self.url = url
+        self.output_dir = output_dir
+        self.window = seconds
+        self.profiles = profiles
+
+    def at(self, point, params):
+        capture_profiles(self.url, self.output_dir, label=point, seconds=self.window, profiles=self.profiles,
+                         params=params)
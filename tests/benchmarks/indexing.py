@@ -0,0 +1,141 @@
+"""
+Elasticsearch side measurements of a load run: indexed events, indexing time, and the merges,
+refreshes and write thread pool rejections that slow indexing down.
+"""
+import time
+
+from tests.benchmarks import intake
+from tests.benchmarks.hooks import LoadHook, SamplingHook
+
+# write thread pools, named bulk before 6.3 and both for a while after
+WRITE_POOLS = ("write", "bulk")
+
+
+def indexing_stats(es):
+    """totals over all nodes: indexed documents and time, bulk requests and time where reported"""
+    totals = dict.fromkeys(["index_total", "index_time", "bulk_total", "bulk_time"], 0)
+    for node in es.nodes.stats(metric="indices")["nodes"].values():
+        indexing = node["indices"]["indexing"]
+        totals["index_total"] += indexing["index_total"]
+        totals["index_time"] += indexing["index_time_in_millis"]
+        bulk = node["indices"].get("bulk", {})
+        totals["bulk_total"] += bulk.get("total_operations", 0)
+        totals["bulk_time"] += bulk.get("total_time_in_millis", 0)
+    return totals
+
+
+def count(es):
+    es.indices.refresh(index="apm-*", ignore_unavailable=True)
+    return es.count(index="apm-*", body={"query": {"term": {"processor.name": "transaction"}}})["count"]
+
+
+def drain(es, expected, timeout):
+    """wait until all accepted events are indexed or the count stops growing, returns (indexed, when)"""
+    indexed, changed = count(es), time.time()
+    deadline = time.time() + timeout
+    while indexed < expected and time.time() < deadline:
+        time.sleep(1)
+        current = count(es)
+        if current != indexed:
+            indexed, changed = current, time.time()
+        elif time.time() - changed > 10:
+            break
+    return indexed, changed
+
+
+def measure_indexing(es, url, body, duration, concurrency, drain_timeout, hooks=(), params=None, rate=None):
+    """
+    delete the apm-* indices, send intake load and wait for the accepted events to be indexed.
+
+    the load's result, the events indexed and the events indexed per second from the start of the load until
+    they were are returned, see intake.run for the other arguments.
+    """
+    es.indices.delete(index="apm-*", ignore=[404])
+    start = time.time()
+    load = intake.run(url, body, duration, concurrency, hooks=hooks, params=params, rate=rate)
+    indexed, drained = drain(es, load["events"], drain_timeout)
+    return {"load": load, "indexed": indexed, "indexed_per_second": indexed / (drained - start)}
+
+
+class IndexingTotals(LoadHook):
+    """indexing_stats when the load starts, to compare with them once the load is indexed"""
+
+    def __init__(self, es):
+        self.es = es
+        self.before = None
+
+    def before_load(self, params):
+        self.before = indexing_stats(self.es)
+
+    def since(self):
+        after = indexing_stats(self.es)
+        return {k: after[k] - self.before[k] for k in after}
+
+
+def nodes_stats(es):
+    """totals over all nodes of the indexing, merge, refresh and write thread pool stats"""
+    totals = dict.fromkeys(["index_total", "index_time", "merges", "merge_time", "refreshes", "refresh_time",
+                            "write_completed", "write_rejected", "write_queue"], 0)
+    stats = es.nodes.stats(metric="indices,thread_pool", index_metric="indexing,merge,refresh")
+    for node in stats["nodes"].values():
+        indices = node["indices"]
+        totals["index_total"] += indices["indexing"]["index_total"]
+        totals["index_time"] += indices["indexing"]["index_time_in_millis"]
+        totals["merges"] += indices["merges"]["total"]
+        totals["merge_time"] += indices["merges"]["total_time_in_millis"]
+        totals["refreshes"] += indices["refresh"]["total"]
+        totals["refresh_time"] += indices["refresh"]["total_time_in_millis"]
+        for pool in WRITE_POOLS:
+            if pool in node["thread_pool"]:
+                totals["write_completed"] += node["thread_pool"][pool]["completed"]
+                totals["write_rejected"] += node["thread_pool"][pool]["rejected"]
+                totals["write_queue"] += node["thread_pool"][pool]["queue"]
+    return totals
+
+
+def stats_window(samples):
+    """indexing rate, rejections and time spent indexing, merging and refreshing between the first and last sample"""
+    if len(samples) < 2:
+        return {}
+    (start, first), (end, last) = samples[0], samples[-1]
+    delta = {name: last[name] - first[name] for name in first if name != "write_queue"}
+    return {
+        "seconds": end - start,
+        "index_per_second": delta["index_total"] / (end - start) if end > start else None,
+        "index_ms": delta["index_time"],
+        "merges": delta["merges"],
+        "merge_ms": delta["merge_time"],
+        "refreshes": delta["refreshes"],
+        "refresh_ms": delta["refresh_time"],
+        "write_rejected": delta["write_rejected"],
+        "write_queue_max": max(s["write_queue"] for _, s in samples),
+    }
+
+
+class IndexingStats(SamplingHook):
+    """snapshot nodes stats before and after the load, and every interval seconds during it if given"""
+    name = "elasticsearch"
+
+    def __init__(self, es, interval=None):
+        super(IndexingStats, self).__init__(interval)
+        self.es = es
+
+    def sample(self):
+        return nodes_stats(self.es)
+
+    def before_load(self, params):
+        if self.interval:
+            super(IndexingStats, self).before_load(params)
+            return
+        self.samples = []
+        self._start = time.time()
+        self._sample_once()
+
+    def after_load(self, params, result):
+        if self.interval:
+            super(IndexingStats, self).after_load(params, result)
+        else:
+            self._sample_once()
+
+    def summary(self):
+        return stats_window(self.samples)
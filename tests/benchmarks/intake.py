@@ -0,0 +1,260 @@
+"""
+Drive apm-server with direct intake load, bypassing agents and test applications.
+
+Requests are modelled on the `minimal` transaction fixture, with spans and several services
+optionally. They are encoded before the load starts, so building payloads doesn't limit the
+load, and each request only patches in fresh transaction ids and the time it's sent: worker
+threads post them to the v1 intake API for a fixed duration, as fast as apm-server answers or
+paced to a target rate of events per second.
+
+    python -m tests.benchmarks.intake --duration 30 --concurrency 8
+    python -m tests.benchmarks.intake --rate 20000 --spans-per-transaction 5 --services 10
+"""
+import argparse
+import collections
+import datetime
+import itertools
+import json
+import math
+import threading
+import time
+import uuid
+
+import elasticsearch
+import requests
+
+from tests.benchmarks.hooks import ProfileHook, run_load
+from tests.benchmarks.kafka import ConsumerLagProbe
+from tests.benchmarks.metricbeat import MetricbeatWindow
+from tests.benchmarks.report import percentiles, print_table, write_json
+from tests.fixtures import default
+
+TRANSACTIONS_PATH = "/v1/transactions"
+SERVICE_NAME = "intake-benchmark"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+# encoded in place of each transaction's id and timestamp, as wide as the values written over them per request
+ID_PLACEHOLDER = str(uuid.UUID(int=0))
+TIMESTAMP_PLACEHOLDER = datetime.datetime(1970, 1, 1).strftime(TIMESTAMP_FORMAT)
+
+
+def payload(transactions, spans=0, service=SERVICE_NAME):
+    """a v1 intake request body with this many transactions, each with this many spans"""
+    timestamp = datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+    body = {
+        "service": {"name": service, "agent": {"name": "python", "version": "1.0"}},
+        "transactions": [{
+            "id": str(uuid.uuid4()),
+            "name": "GET /api/types",
+            "type": "request",
+            "duration": 32.592981,
+            "result": "success",
+            "timestamp": timestamp,
+        } for _ in range(transactions)],
+    }
+    if spans:
+        for transaction in body["transactions"]:
+            transaction["spans"] = [{
+                "id": n,
+                "name": "SELECT FROM product_types",
+                "type": "db.postgresql.query",
+                "start": 2.83092 + n,
+                "duration": 0.5,
+            } for n in range(spans)]
+    return body
+
+
+def event_count(body):
+    """transactions and spans in a request body"""
+    return sum(1 + len(t.get("spans", ())) for t in body["transactions"])
+
+
+def payloads(transactions, spans=0, services=1):
+    """a request body for each service, sent in turn"""
+    names = [SERVICE_NAME] if services == 1 else ["{}-{}".format(SERVICE_NAME, n) for n in range(1, services + 1)]
+    return [payload(transactions, spans, name) for name in names]
+
+
+def offsets(data, placeholder):
+    """where the quoted placeholder's value starts in the encoded data"""
+    quoted = json.dumps(placeholder).encode("utf8")
+    found = []
+    start = data.find(quoted)
+    while start != -1:
+        found.append(start + 1)
+        start = data.find(quoted, start + len(quoted))
+    return found
+
+
+def encode(body):
+    """body encoded with placeholders for its transactions' ids and timestamps, and their offsets"""
+    marked = dict(body, transactions=[dict(t, id=ID_PLACEHOLDER, timestamp=TIMESTAMP_PLACEHOLDER)
+                                      for t in body["transactions"]])
+    data = json.dumps(marked).encode("utf8")
+    return data, offsets(data, ID_PLACEHOLDER), offsets(data, TIMESTAMP_PLACEHOLDER)
+
+
+def stamp(encoded):
+    """a copy of the encoded body with fresh transaction ids, timestamped now"""
+    data, ids, timestamps = encoded
+    stamped = bytearray(data)
+    for offset in ids:
+        stamped[offset:offset + len(ID_PLACEHOLDER)] = str(uuid.uuid4()).encode("ascii")
+    now = datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT).encode("ascii")
+    for offset in timestamps:
+        stamped[offset:offset + len(TIMESTAMP_PLACEHOLDER)] = now
+    return bytes(stamped)
+
+
+def run(url, body, duration, concurrency, hooks=(), params=None, rate=None):
+    """
+    post body, or each of a list of bodies in turn, to the intake API from concurrent workers for duration seconds.
+
+    with rate, workers pace their requests to send about that many events per second in total, and latency
+    is measured from when each request was due, so a slow apm-server isn't hidden by fewer requests.
+    the load still stops at duration then, requests that were due but not sent by then are counted as missed.
+    hooks are called around the load with its parameters, params adds to them.
+    """
+    bodies = body if isinstance(body, list) else [body]
+    encoded = [(encode(b), event_count(b)) for b in bodies]
+    events_per_request = sum(events for _, events in encoded) / float(len(encoded))
+    # seconds between a worker's requests
+    interval = concurrency * events_per_request / rate if rate else 0
+    counts = collections.Counter()
+    statuses = collections.Counter()
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker(n):
+        session = requests.Session()
+        # workers start at different bodies and, when paced, at different points of the interval
+        pool = itertools.islice(itertools.cycle(encoded), n, None)
+        due = time.time() + interval * n / concurrency
+        sent = collections.Counter()
+        status = collections.Counter()
+        took = []
+        while True:
+            if interval:
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                due = time.time()
+            if due >= deadline:
+                break
+            if interval and time.time() >= deadline:
+                # behind schedule, what was still due before the deadline is never sent
+                sent["missed"] += int(math.ceil((deadline - due) / interval))
+                break
+            encoded_body, events = next(pool)
+            data = stamp(encoded_body)
+            try:
+                r = session.post(url + TRANSACTIONS_PATH, data=data, headers={"Content-Type": "application/json"})
+                status[r.status_code] += 1
+                accepted = r.status_code == 202
+            except requests.exceptions.RequestException:
+                status["exception"] += 1
+                accepted = False
+            took.append(time.time() - due)
+            sent["requests"] += 1
+            sent["events" if accepted else "rejected"] += events
+            if not accepted:
+                sent["errors"] += 1
+            due += interval
+        with lock:
+            counts.update(sent)
+            statuses.update(status)
+            latencies.extend(took)
+
+    def load():
+        start = time.time()
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return time.time() - start
+
+    load_params = {"url": url, "duration": duration, "concurrency": concurrency, "rate": rate,
+                   "events_per_request": events_per_request}
+    load_params.update(params or {})
+    seconds = run_load(load, duration, load_params, hooks)
+
+    return {
+        "requests": counts["requests"],
+        "errors": counts["errors"],
+        "events": counts["events"],
+        "rejected": counts["rejected"],
+        "missed": counts["missed"],
+        "seconds": seconds,
+        "events_per_second": counts["events"] / seconds,
+        "rejected_per_second": counts["rejected"] / seconds,
+        "status": {str(code): n for code, n in statuses.items()},
+        "latency_ms": percentiles([t * 1000 for t in latencies]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="direct apm-server intake load")
+    parser.add_argument("--url", default=default.from_env("APM_SERVER_URL"), help="apm-server url")
+    parser.add_argument("--duration", type=int, default=30, help="seconds to send for")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests")
+    parser.add_argument("--transactions-per-request", type=int, default=10, help="transactions in each request")
+    parser.add_argument("--spans-per-transaction", type=int, default=0, help="spans in each transaction")
+    parser.add_argument("--services", type=int, default=1, help="services the requests are sent for, in turn")
+    parser.add_argument("--rate", type=int, help="events per second to send, as fast as possible by default")
+    parser.add_argument("--profile-dir", help="capture apm-server profiles at the start, peak and end of the load here")
+    parser.add_argument("--profile-seconds", type=int, default=10, help="seconds to sample each cpu profile for")
+    parser.add_argument("--monitor-url", default="http://localhost:6060", help="apm-server monitor url")
+    parser.add_argument("--kafka-lag", action="store_true",
+                        help="sample logstash's consumer lag, with apm-server sending to kafka")
+    parser.add_argument("--drain-timeout", type=int, default=120,
+                        help="seconds to wait for logstash to catch up after the load, with --kafka-lag")
+    parser.add_argument("--metricbeat", action="store_true",
+                        help="report queue depth, cpu and memory metricbeat collected during the load")
+    parser.add_argument("--es-url", default=default.from_env("ES_URL"), help="elasticsearch url, with --metricbeat")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    hooks = [ProfileHook(args.monitor_url, args.profile_dir, args.profile_seconds)] if args.profile_dir else []
+    lag = ConsumerLagProbe(drain_timeout=args.drain_timeout) if args.kafka_lag else None
+    if lag:
+        hooks.append(lag)
+    window = MetricbeatWindow(elasticsearch.Elasticsearch([args.es_url])) if args.metricbeat else None
+    if window:
+        hooks.append(window)
+    bodies = payloads(args.transactions_per_request, args.spans_per_transaction, args.services)
+    result = run(args.url, bodies, args.duration, args.concurrency, hooks=hooks, rate=args.rate)
+    if lag:
+        result["kafka_lag"] = lag.summary()
+    if window:
+        result["metricbeat"] = window.summary()
+    latency = result["latency_ms"]
+    print_table(["requests", "errors", "events", "events/s", "rejected/s", "p50 ms", "p90 ms", "p99 ms"], [[
+        result["requests"], result["errors"], result["events"], "{:.0f}".format(result["events_per_second"]),
+        "{:.0f}".format(result["rejected_per_second"])] +
+        ["{:.1f}".format(latency[p]) if latency[p] is not None else None for p in ("p50", "p90", "p99")]])
+    if result["missed"]:
+        print("{} requests due at --rate were never sent, apm-server didn't keep up".format(result["missed"]))
+    if result["errors"]:
+        print("responses: " + ", ".join("{} x{}".format(code, n) for code, n in sorted(result["status"].items())))
+    if lag:
+        print()
+        print_table(["max lag", "lag at end", "drained in"], [[
+            result["kafka_lag"]["max_lag"], result["kafka_lag"]["end_lag"],
+            "{:.0f}s".format(lag.drain_seconds) if lag.drain_seconds is not None else None]])
+    if window and result["metricbeat"]:
+        queue = result["metricbeat"]["queue_depth"]
+        print()
+        print_table(["queue max", "queue avg"], [[queue["max"], queue["avg"]]])
+        print()
+        print_table(["container", "cpu cores avg", "cpu cores max", "memory max MB"], [
+            [name, "{:.2f}".format(c["cpu_cores_avg"] or 0), "{:.2f}".format(c["cpu_cores_max"] or 0),
+             "{:.0f}".format(c["memory_max_mb"])]
+            for name, c in sorted(result["metricbeat"]["containers"].items())])
+    if args.json:
+        write_json(args.json, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Consumer lag of the logstash consumer group while apm-server sends to kafka.
+
+Lag is the number of events written to the apm topics that logstash hasn't consumed yet.
+Lag that stays flat under load means the kafka -> logstash -> elasticsearch path keeps up,
+growing lag means it falls behind by that many events.
+"""
+import time
+
+from scripts.compose import DockerClient
+from tests.benchmarks.hooks import SamplingHook
+
+GROUP = "logstash"
+
+
+def parse_consumer_groups(output):
+    """partitions from `kafka-consumer-groups --describe` as dicts, lag is None while a partition has no offset"""
+    partitions = []
+    header = None
+    for line in output.splitlines():
+        fields = line.split()
+        if fields[:1] == ["TOPIC"]:
+            header = fields
+            continue
+        if header is None or len(fields) < len(header) - 3:
+            continue
+        row = dict(zip(header, fields))
+        partitions.append({
+            "topic": row["TOPIC"],
+            "partition": int(row["PARTITION"]),
+            "lag": int(row["LAG"]) if row["LAG"].isdigit() else None,
+        })
+    return partitions
+
+
+def kafka_container(client):
+    containers = client.containers(filters={"label": ["com.docker.compose.service=kafka"]})
+    if not containers:
+        raise RuntimeError("kafka is not running")
+    return containers[0]["Names"][0].lstrip("/")
+
+
+class ConsumerLagProbe(SamplingHook):
+    """
+    sample the consumer group's total lag over all apm topics while load runs.
+
+    with drain_timeout, sampling continues after the load until logstash has caught up.
+    """
+
+    def __init__(self, group=GROUP, interval=1, drain_timeout=0):
+        super(ConsumerLagProbe, self).__init__(interval)
+        self.group = group
+        self.drain_timeout = drain_timeout
+        self.end_lag = None
+        self.drain_seconds = None
+        self.container = None
+
+    def lag(self):
+        client = DockerClient()
+        try:
+            if self.container is None:
+                self.container = kafka_container(client)
+            exit_code, output = client.exec_run(self.container, [
+                "kafka-consumer-groups", "--bootstrap-server", "localhost:9092", "--describe", "--group", self.group])
+        finally:
+            client.close()
+        if exit_code:
+            raise RuntimeError("kafka-consumer-groups exit status {}: {}".format(exit_code, output))
+        return sum(p["lag"] or 0 for p in parse_consumer_groups(output) if p["topic"].startswith("apm"))
+
+    def sample(self):
+        return self.lag()
+
+    def after_load(self, params, result):
+        super(ConsumerLagProbe, self).after_load(params, result)
+        self.end_lag = self.samples[-1][1] if self.samples else None
+        end = time.time()
+        deadline = end + self.drain_timeout
+        while self.samples and self.samples[-1][1] and time.time() < deadline:
+            time.sleep(self.interval)
+            self._sample_once()
+        if self.samples and not self.samples[-1][1]:
+            self.drain_seconds = time.time() - end
+
+    def summary(self):
+        lags = [lag for _, lag in self.samples]
+        return {
+            "max_lag": max(lags) if lags else None,
+            "end_lag": self.end_lag,
+            "drain_seconds": self.drain_seconds,
+            "samples": self.samples,
+        }
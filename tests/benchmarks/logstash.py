@@ -0,0 +1,148 @@
+"""
+Find the slowest stage of the logstash pipeline under direct intake load.
+
+Run it against a stack where apm-server sends to logstash, directly or through kafka, eg
+
+    ./scripts/compose.py start master --with-logstash --apm-server-output logstash --logstash-pipeline-workers 4
+    python -m tests.benchmarks.logstash --duration 60
+
+Logstash's monitoring API is sampled while the load runs. The events in and out of the pipeline
+show whether logstash keeps up, and for every filter and output plugin the time spent per event
+and its share of the workers' time show which stage is the bottleneck.
+"""
+import argparse
+
+import requests
+
+from scripts.compose import DockerClient, published_address
+from tests.benchmarks import intake
+from tests.benchmarks.hooks import SamplingHook
+from tests.benchmarks.report import print_table, write_json
+from tests.fixtures import default
+
+MONITORING_PORT = 9600
+PIPELINE = "main"
+
+
+def monitoring_url():
+    """the monitoring API of the running logstash, its port is published on a random host port"""
+    client = DockerClient()
+    try:
+        address = published_address(client, "logstash", MONITORING_PORT)
+    finally:
+        client.close()
+    if not address:
+        raise RuntimeError("no running logstash with a published monitoring port")
+    return "http://" + address
+
+
+def pipeline_stats(node_stats, pipeline=PIPELINE):
+    """event counts of a pipeline and its plugins, from _node/stats/pipelines"""
+    stats = node_stats["pipelines"][pipeline]
+    plugins = {}
+    for kind in ("inputs", "filters", "outputs"):
+        for plugin in stats["plugins"].get(kind, []):
+            events = plugin.get("events", {})
+            plugins[plugin["id"]] = {
+                "kind": kind[:-1],
+                "name": plugin.get("name"),
+                "in": events.get("in", 0),
+                "out": events.get("out", 0),
+                "duration_ms": events.get("duration_in_millis", 0),
+            }
+    queue = stats.get("queue") or {}
+    return {
+        "in": stats["events"]["in"],
+        "out": stats["events"]["out"],
+        "duration_ms": stats["events"]["duration_in_millis"],
+        "queued": queue.get("events", 0),
+        "plugins": plugins,
+    }
+
+
+def compare(before, after, seconds):
+    """rates over a load run from the pipeline stats at its start and end"""
+    worker_ms = after["duration_ms"] - before["duration_ms"]
+    plugins = {}
+    for plugin_id, stats in after["plugins"].items():
+        start = before["plugins"].get(plugin_id, {})
+        out = stats["out"] - start.get("out", 0)
+        duration = stats["duration_ms"] - start.get("duration_ms", 0)
+        plugins[plugin_id] = {
+            "kind": stats["kind"],
+            "out_per_second": out / seconds,
+            "ms_per_event": duration / float(out) if out else None,
+            "share": duration / float(worker_ms) if worker_ms and stats["kind"] != "input" else None,
+        }
+    bottleneck = max((p for p in plugins if plugins[p]["share"] is not None),
+                     key=lambda p: plugins[p]["share"], default=None)
+    return {
+        "in_per_second": (after["in"] - before["in"]) / seconds,
+        "out_per_second": (after["out"] - before["out"]) / seconds,
+        "queued": after["queued"],
+        "plugins": plugins,
+        "bottleneck": bottleneck,
+    }
+
+
+class PipelineStatsProbe(SamplingHook):
+    """sample the pipeline's stats from logstash's monitoring API while the load runs"""
+
+    def __init__(self, url, pipeline=PIPELINE, interval=5):
+        super(PipelineStatsProbe, self).__init__(interval)
+        self.url = url
+        self.pipeline = pipeline
+
+    def sample(self):
+        r = requests.get(self.url + "/_node/stats/pipelines", timeout=10)
+        r.raise_for_status()
+        return pipeline_stats(r.json(), self.pipeline)
+
+    def summary(self):
+        """rates between the first and last sample, empty unless logstash answered at least twice"""
+        if len(self.samples) < 2:
+            return {}
+        (start, before), (end, after) = self.samples[0], self.samples[-1]
+        return compare(before, after, end - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="logstash pipeline throughput per plugin")
+    parser.add_argument("--url", default=default.from_env("APM_SERVER_URL"), help="apm-server url")
+    parser.add_argument("--logstash-url", help="logstash monitoring url, defaults to the running logstash")
+    parser.add_argument("--duration", type=int, default=60, help="seconds to send for")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests")
+    parser.add_argument("--transactions-per-request", type=int, default=10, help="transactions in each request")
+    parser.add_argument("--interval", type=int, default=5, help="seconds between monitoring API samples")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    probe = PipelineStatsProbe(args.logstash_url or monitoring_url(), interval=args.interval)
+    load = intake.run(args.url, intake.payload(args.transactions_per_request), args.duration, args.concurrency,
+                      hooks=[probe])
+    summary = probe.summary()
+
+    if not summary:
+        print_table(["apm-server events/s", "errors"], [["{:.0f}".format(load["events_per_second"]), load["errors"]]])
+        print("\nno logstash pipeline stats, is its monitoring API at {} reachable?".format(probe.url))
+        if args.json:
+            write_json(args.json, {"load": load, "logstash": summary})
+        return
+
+    print_table(["apm-server events/s", "logstash in/s", "logstash out/s", "queued"], [[
+        "{:.0f}".format(load["events_per_second"]), "{:.0f}".format(summary["in_per_second"]),
+        "{:.0f}".format(summary["out_per_second"]), summary["queued"]]])
+    print()
+    print_table(["plugin", "kind", "out/s", "ms/event", "share"], [[
+        plugin_id, p["kind"], "{:.0f}".format(p["out_per_second"]),
+        "{:.3f}".format(p["ms_per_event"]) if p["ms_per_event"] is not None else None,
+        "{:.0%}".format(p["share"]) if p["share"] is not None else None,
+    ] for plugin_id, p in sorted(summary["plugins"].items())])
+    if summary["bottleneck"]:
+        print("\nslowest stage: " + summary["bottleneck"])
+    if args.json:
+        write_json(args.json, {"load": load, "logstash": summary})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Metrics metricbeat collected during a load run, queried from its indices after the run.
+
+Start the stack with `--with-metricbeat --metricbeat-benchmark` for a sample every second,
+metricbeat's default config only polls every 10s.
+"""
+import time
+
+from tests.benchmarks.hooks import LoadHook
+
+INDEX = "metricbeat-*"
+# events in apm-server's publishing pipeline, its queue depth, from the expvar namespace in metricbeat's config
+QUEUE_FIELD = "golang.apm-server.libbeat.pipeline.events.active"
+# metricbeat 7 names containers with ECS fields, earlier versions in the docker module's fields
+CONTAINER_FIELDS = ("container.name", "docker.container.name")
+
+
+def window_query(start, end, *filters):
+    """documents collected between start and end, in seconds since the epoch"""
+    time_range = {"range": {"@timestamp": {"gte": int(start * 1000), "lte": int(end * 1000), "format": "epoch_millis"}}}
+    return {"bool": {"filter": [time_range] + list(filters)}}
+
+
+def queue_depth(es, start, end, index=INDEX):
+    """max and average queue depth over the window, and the max of each second as (seconds into the window, depth)"""
+    result = es.search(index=index, body={
+        "size": 0,
+        "query": window_query(start, end, {"exists": {"field": QUEUE_FIELD}}),
+        "aggs": {
+            "max": {"max": {"field": QUEUE_FIELD}},
+            "avg": {"avg": {"field": QUEUE_FIELD}},
+            "series": {
+                "date_histogram": {"field": "@timestamp", "interval": "1s", "min_doc_count": 1},
+                "aggs": {"depth": {"max": {"field": QUEUE_FIELD}}},
+            },
+        },
+    })
+    aggs = result["aggregations"]
+    return {
+        "max": aggs["max"]["value"],
+        "avg": aggs["avg"]["value"],
+        "series": [(bucket["key"] / 1000.0 - start, bucket["depth"]["value"])
+                   for bucket in aggs["series"]["buckets"]],
+    }
+
+
+def container_usage(es, start, end, index=INDEX):
+    """cpu cores and memory of each container over the window"""
+    for field in CONTAINER_FIELDS:
+        result = es.search(index=index, body={
+            "size": 0,
+            "query": window_query(start, end, {"term": {"metricset.module": "docker"}}),
+            "aggs": {"containers": {
+                "terms": {"field": field, "size": 100},
+                "aggs": {
+                    "cpu_avg": {"avg": {"field": "docker.cpu.total.pct"}},
+                    "cpu_max": {"max": {"field": "docker.cpu.total.pct"}},
+                    "memory_max": {"max": {"field": "docker.memory.usage.total"}},
+                },
+            }},
+        })
+        buckets = result["aggregations"]["containers"]["buckets"]
+        if buckets:
+            return {bucket["key"]: {
+                "cpu_cores_avg": bucket["cpu_avg"]["value"],
+                "cpu_cores_max": bucket["cpu_max"]["value"],
+                "memory_max_mb": (bucket["memory_max"]["value"] or 0) / 2.0 ** 20,
+            } for bucket in buckets}
+    return {}
+
+
+class MetricbeatWindow(LoadHook):
+    """remember when the load ran and query metricbeat's documents for that window after it"""
+
+    def __init__(self, es, settle=5, index=INDEX):
+        # seconds for metricbeat to publish its last samples and for them to become searchable
+        self.settle = settle
+        self.es = es
+        self.index = index
+        self.start = None
+        self.end = None
+        self.metrics = None
+
+    def before_load(self, params):
+        self.start = time.time()
+
+    def after_load(self, params, result):
+        self.end = time.time()
+        time.sleep(self.settle)
+        try:
+            self.es.indices.refresh(index=self.index, ignore_unavailable=True)
+            self.metrics = {
+                "queue_depth": queue_depth(self.es, self.start, self.end, self.index),
+                "containers": container_usage(self.es, self.start, self.end, self.index),
+            }
+        except Exception as e:
+            # no metrics shouldn't lose the load's results
+            print("querying metricbeat failed: {}".format(e))
+
+    def summary(self):
+        return self.metrics
@@ -0,0 +1,94 @@
+"""
+Compare apm-server's output paths under the same direct intake load.
+
+For every output the stack is started from scratch (`docker-compose down -v` first), `apm-*`
+indices are deleted and the same load is sent for a fixed duration. Reported per path:
+
+- events sent and indexed per second, until everything accepted is indexed
+- send to searchable lag percentiles, from marker transactions sent once a second and searched for
+- cpu cores and peak memory of all the stack's containers while the load runs
+
+    python -m tests.benchmarks.outputs --outputs elasticsearch,kafka --duration 120
+
+Index templates are only loaded by apm-server's elasticsearch output, the other paths index into
+dynamically mapped indices. This replaces docker-compose.yml in the repository root and removes
+the stack's volumes.
+"""
+import argparse
+import collections
+import shlex
+
+import elasticsearch
+
+from tests.benchmarks import intake, logstash
+from tests.benchmarks.indexing import measure_indexing
+from tests.benchmarks.report import print_table, write_json
+from tests.benchmarks.resources import ContainerStatsProbe
+from tests.benchmarks.searchable import SearchableLagProbe
+from tests.benchmarks.stack import start, wait_ready
+from tests.fixtures import default
+
+# compose.py start arguments for each output path
+OUTPUTS = collections.OrderedDict([
+    ("elasticsearch", []),
+    ("logstash", ["--with-logstash", "--apm-server-output", "logstash"]),
+    ("kafka", ["--with-kafka", "--with-zookeeper", "--with-logstash", "--apm-server-output", "kafka"]),
+])
+
+
+def start_stack(args, output):
+    start(args.version, shlex.split(args.compose_args) + OUTPUTS[output], args.apm_server_url, args.es_url,
+          fresh=True)
+    if output != "elasticsearch":
+        wait_ready(logstash.monitoring_url(), timeout=600)
+
+
+def measure(es, args, output, body):
+    lag = SearchableLagProbe(args.apm_server_url, es, interval=args.marker_interval, drain_timeout=args.drain_timeout)
+    resources = ContainerStatsProbe()
+    result = measure_indexing(es, args.apm_server_url, body, args.duration, args.concurrency, args.drain_timeout,
+                              hooks=[lag, resources], params={"output": output})
+    result.update({"output": output, "searchable": lag.summary(), "resources": resources.summary()})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="throughput, lag and resource use per apm-server output")
+    parser.add_argument("--outputs", default=",".join(OUTPUTS), help="comma separated outputs to compare")
+    parser.add_argument("--version", default="master", help="stack version")
+    parser.add_argument("--compose-args", default="", help="additional compose.py start arguments for every output")
+    parser.add_argument("--duration", type=int, default=60, help="seconds of load per output")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent intake requests")
+    parser.add_argument("--transactions-per-request", type=int, default=10, help="transactions in each request")
+    parser.add_argument("--marker-interval", type=float, default=1, help="seconds between searchable lag markers")
+    parser.add_argument("--drain-timeout", type=int, default=300,
+                        help="seconds to wait for the accepted events to be indexed")
+    parser.add_argument("--apm-server-url", default=default.from_env("APM_SERVER_URL"))
+    parser.add_argument("--es-url", default=default.from_env("ES_URL"))
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    es = elasticsearch.Elasticsearch([args.es_url])
+    body = intake.payload(args.transactions_per_request)
+    results = []
+    for output in args.outputs.split(","):
+        start_stack(args, output)
+        results.append(measure(es, args, output, body))
+
+    rows = []
+    for r in results:
+        lag = r["searchable"]["lag_ms"]
+        rows.append([r["output"], "{:.0f}".format(r["load"]["events_per_second"]),
+                     "{:.0f}".format(r["indexed_per_second"])] +
+                    ["{:.0f}".format(lag[p]) if lag[p] is not None else None for p in ("p50", "p90", "p99")] +
+                    [r["searchable"]["missing"],
+                     "{:.1f}".format(sum(s["cpu_cores"] for s in r["resources"].values())),
+                     "{:.0f}".format(sum(s["memory_max_mb"] for s in r["resources"].values()))])
+    print_table(["output", "sent/s", "indexed/s", "lag p50 ms", "lag p90 ms", "lag p99 ms", "missing",
+                 "cpu cores", "memory MB"], rows)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Shared output helpers for benchmark drivers.
+"""
+import json
+import math
+
+
+def format_table(headers, rows):
+    """render rows as a plain text table, columns sized to their widest cell"""
+    cells = [[str(h) for h in headers]] + [["-" if c is None else str(c) for c in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    lines = []
+    for row in cells:
+        lines.append("  ".join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths))))
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+
+def print_table(headers, rows):
+    print(format_table(headers, rows))
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True, default=str)
+
+
+def percentiles(values, ps=(50, 90, 99)):
+    """nearest rank percentiles, {"p50": value, ...}, None when there are no values"""
+    ordered = sorted(values)
+    result = {}
+    for p in ps:
+        rank = int(math.ceil(p / 100.0 * len(ordered)))
+        result["p{}".format(p)] = ordered[max(rank, 1) - 1] if ordered else None
+    return result
@@ -0,0 +1,61 @@
+"""
+cpu and memory use of the stack's containers during a load run, from the docker daemon.
+"""
+from multiprocessing.pool import ThreadPool
+
+from scripts.compose import DOCKER_NETWORK, DockerClient
+from tests.benchmarks.hooks import SamplingHook
+
+
+def container_stats(container):
+    # a client per container, stats take a while and are collected concurrently
+    client = DockerClient()
+    try:
+        stats = client.stats(container["Id"])
+    finally:
+        client.close()
+    return {
+        "cpu_ns": stats["cpu_stats"]["cpu_usage"]["total_usage"],
+        "memory": stats["memory_stats"].get("usage", 0),
+    }
+
+
+def usage(samples):
+    """average cpu cores and peak memory of each service over (seconds, {service: stats}) samples"""
+    if len(samples) < 2:
+        return {}
+    (start, first), (end, last) = samples[0], samples[-1]
+    result = {}
+    for service in set(first) & set(last):
+        result[service] = {
+            "cpu_cores": (last[service]["cpu_ns"] - first[service]["cpu_ns"]) / 1e9 / (end - start),
+            "memory_max_mb": max(s[service]["memory"] for _, s in samples if service in s) / 2.0 ** 20,
+        }
+    return result
+
+
+class ContainerStatsProbe(SamplingHook):
+    """sample cpu and memory of every container on the stack's network while the load runs"""
+
+    def __init__(self, interval=5, network=DOCKER_NETWORK):
+        super(ContainerStatsProbe, self).__init__(interval)
+        self.network = network
+
+    def sample(self):
+        client = DockerClient()
+        try:
+            containers = client.containers(filters={"network": [self.network]})
+        finally:
+            client.close()
+        if not containers:
+            return {}
+        pool = ThreadPool(len(containers))
+        try:
+            stats = pool.map(container_stats, containers)
+        finally:
+            pool.close()
+        return {c["Labels"].get("com.docker.compose.service", c["Names"][0].lstrip("/")): s
+                for c, s in zip(containers, stats)}
+
+    def summary(self):
+        return usage(self.samples)
@@ -0,0 +1,101 @@
+"""
+Measure how apm-server ingest scales with the number of servers behind the load balancer.
+
+For every server count the stack is started with `--apm-server-count N`, `apm-*` indices are deleted
+and the same direct intake load is sent for a fixed duration. Throughput is the events indexed per
+second until apm-server's queues have drained, and scaling efficiency is throughput over the first
+count's throughput per server, times N.
+
+With more than one server, the statistics published by haproxy show the requests each server handled, a skew above
+--hot-threshold, the busiest server's requests over the mean, flags a hot backend.
+
+    python -m tests.benchmarks.scaling --counts 1,2,4 --duration 60 --concurrency 32
+
+This replaces docker-compose.yml in the repository root.
+"""
+import argparse
+import shlex
+import time
+
+import elasticsearch
+
+from tests.benchmarks import haproxy, intake
+from tests.benchmarks.indexing import measure_indexing
+from tests.benchmarks.report import print_table, write_json
+from tests.benchmarks.stack import start
+from tests.fixtures import default
+
+
+def wait_backends(url, count, timeout):
+    """wait until haproxy, with statistics at url, sees every backend as up"""
+    deadline = time.time() + timeout
+    while True:
+        status = [s["status"] for s in haproxy.fetch(url).values()]
+        if len(status) == count and all(s == "UP" for s in status):
+            return
+        if time.time() > deadline:
+            raise RuntimeError("apm-server backends not up after {}s: {}".format(timeout, status))
+        time.sleep(1)
+
+
+def measure(es, args, body, count):
+    before = haproxy.fetch(args.stats_url) if count > 1 else {}
+    result = measure_indexing(es, args.apm_server_url, body, args.duration, args.concurrency, args.drain_timeout,
+                              params={"apm_server_count": count})
+    result["count"] = count
+    if count > 1:
+        after = haproxy.fetch(args.stats_url)
+        result["backend_requests"], result["skew"] = haproxy.balance(before, after)
+        result["backends"] = after
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="apm-server ingest per number of load balanced servers")
+    parser.add_argument("--version", default="master", help="stack version")
+    parser.add_argument("--compose-args", default="", help="additional compose.py start arguments")
+    parser.add_argument("--counts", default="1,2,3,4", help="comma separated apm-server counts")
+    parser.add_argument("--duration", type=int, default=30, help="seconds of load per count")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent intake requests")
+    parser.add_argument("--transactions-per-request", type=int, default=10, help="transactions in each request")
+    parser.add_argument("--drain-timeout", type=int, default=120,
+                        help="seconds to wait for apm-server to index the accepted events")
+    parser.add_argument("--hot-threshold", type=float, default=1.2,
+                        help="busiest backend's requests over the mean that flag a hot backend")
+    parser.add_argument("--apm-server-url", default=default.from_env("APM_SERVER_URL"))
+    parser.add_argument("--es-url", default=default.from_env("ES_URL"))
+    parser.add_argument("--stats-url", default=haproxy.STATS_URL, help="load balancer statistics url")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    compose_args = shlex.split(args.compose_args)
+    es = elasticsearch.Elasticsearch([args.es_url])
+    body = intake.payload(args.transactions_per_request)
+
+    results = []
+    for count in [int(c) for c in args.counts.split(",")]:
+        # backends of a larger count are left over otherwise
+        start(args.version, compose_args + ["--apm-server-count", str(count)], args.apm_server_url, args.es_url,
+              up_args=["--remove-orphans"], timeout=300)
+        if count > 1:
+            wait_backends(args.stats_url, count, timeout=300)
+        results.append(measure(es, args, body, count))
+
+    per_server = results[0]["indexed_per_second"] / results[0]["count"]
+    rows = []
+    for r in results:
+        r["efficiency"] = r["indexed_per_second"] / (per_server * r["count"]) if per_server else None
+        skew = r.get("skew")
+        rows.append([
+            r["count"], "{:.0f}".format(r["load"]["events_per_second"]), "{:.0f}".format(r["indexed_per_second"]),
+            "{:.0%}".format(r["efficiency"]) if r["efficiency"] is not None else None,
+            "{:.1f}".format(r["load"]["latency_ms"]["p50"]), "{:.1f}".format(r["load"]["latency_ms"]["p99"]),
+            "{:.2f}{}".format(skew, " hot" if skew > args.hot_threshold else "") if skew is not None else None,
+        ])
+    print_table(["servers", "sent/s", "indexed/s", "efficiency", "p50 ms", "p99 ms", "skew"], rows)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Time from sending an event to apm-server until it can be found in Elasticsearch.
+"""
+import json
+import threading
+import time
+
+import requests
+
+from tests.benchmarks import intake
+from tests.benchmarks.hooks import LoadHook
+from tests.benchmarks.report import percentiles
+
+
+class SearchableLagProbe(LoadHook):
+    """
+    send a marker transaction every interval seconds while the load runs and search for it until it's found.
+
+    after the load, searching continues for up to drain_timeout seconds, markers never found are missing.
+    """
+
+    def __init__(self, apm_server_url, es, interval=1, poll_interval=0.2, drain_timeout=120):
+        self.apm_server_url = apm_server_url
+        self.es = es
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout
+        self.lags = []
+        self.sent = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop_sending = threading.Event()
+        self._stop_polling = threading.Event()
+        self._threads = []
+
+    def send(self):
+        body = intake.payload(1)
+        marker = body["transactions"][0]["id"]
+        sent = time.time()
+        r = requests.post(self.apm_server_url + intake.TRANSACTIONS_PATH, data=json.dumps(body),
+                          headers={"Content-Type": "application/json"}, timeout=30)
+        if r.status_code == 202:
+            with self._lock:
+                self._pending[marker] = sent
+                self.sent += 1
+
+    def poll(self):
+        with self._lock:
+            pending = list(self._pending)
+        if not pending:
+            return
+        found = self.es.search(index="apm-*", ignore_unavailable=True, body={
+            "query": {"bool": {"should": [{"match_phrase": {"transaction.id": m}} for m in pending]}},
+            "_source": ["transaction.id"],
+            "size": len(pending),
+        })
+        now = time.time()
+        with self._lock:
+            for hit in found["hits"]["hits"]:
+                sent = self._pending.pop(hit["_source"]["transaction"]["id"], None)
+                if sent is not None:
+                    self.lags.append(now - sent)
+
+    def _loop(self, stop, interval, call):
+        while not stop.wait(interval):
+            try:
+                call()
+            except Exception as e:
+                print("{} failed: {}".format(call.__name__, e))
+
+    def before_load(self, params):
+        self.lags, self.sent, self._pending = [], 0, {}
+        self._stop_sending.clear()
+        self._stop_polling.clear()
+        self._threads = [
+            threading.Thread(target=self._loop, args=(self._stop_sending, self.interval, self.send)),
+            threading.Thread(target=self._loop, args=(self._stop_polling, self.poll_interval, self.poll)),
+        ]
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def after_load(self, params, result):
+        self._stop_sending.set()
+        self._threads[0].join()
+        deadline = time.time() + self.drain_timeout
+        while self._pending and time.time() < deadline:
+            time.sleep(self.poll_interval)
+        self._stop_polling.set()
+        self._threads[1].join()
+
+    def summary(self):
+        return {
+            "markers": self.sent,
+            "missing": len(self._pending),
+            "lag_ms": percentiles([lag * 1000 for lag in self.lags]),
+        }
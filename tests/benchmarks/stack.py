@@ -0,0 +1,54 @@
+"""
+Render and control the benchmark stack through the repository's docker-compose.yml.
+"""
+import io
+import os
+import subprocess
+import time
+
+import requests
+
+from scripts.compose import LocalSetup
+
+DOCKER_COMPOSE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "docker-compose.yml"))
+
+
+def render(version, compose_args):
+    """write the docker-compose.yml `compose.py start` would use, without starting anything"""
+    out = io.StringIO()
+    setup = LocalSetup(argv=["start", version, "--docker-compose-path", "-"] + compose_args)
+    setup.set_docker_compose_path(out)
+    setup()
+    with open(DOCKER_COMPOSE_PATH, "w") as f:
+        f.write(out.getvalue())
+
+
+def docker_compose(*args):
+    subprocess.check_call(["docker-compose", "-f", DOCKER_COMPOSE_PATH] + list(args))
+
+
+def start(version, compose_args, apm_server_url, es_url, up_args=(), fresh=False, timeout=600):
+    """
+    render the stack and bring it up, from scratch without its volumes if fresh, then wait for apm-server
+    and elasticsearch. up_args are added to `docker-compose up -d`, eg to recreate a single service.
+    """
+    render(version, compose_args)
+    if fresh:
+        docker_compose("down", "-v")
+    docker_compose("up", "-d", *up_args)
+    wait_ready(apm_server_url + "/healthcheck", timeout=timeout)
+    wait_ready(es_url + "/_cluster/health?wait_for_status=yellow", timeout=timeout)
+
+
+def wait_ready(url, timeout):
+    """poll url until it responds with a 2xx status"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            if requests.get(url, timeout=5).ok:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        if time.time() > deadline:
+            raise RuntimeError("{} not ready after {}s".format(url, timeout))
+        time.sleep(1)
@@ -0,0 +1,70 @@
+"""
+Measure how long the stack takes to become ready with each healthcheck profile.
+
+For every stack version the rendered docker-compose.yml is started from scratch
+(`docker-compose down -v` first) and timed with the startup timeline until every
+service is ready. Images are pulled and built before timing.
+
+    python -m tests.benchmarks.startup --versions 6.3,master --runs 3
+
+This replaces docker-compose.yml in the repository root and removes the stack's volumes.
+"""
+import argparse
+import shlex
+import statistics
+
+from scripts.compose import HEALTHCHECK_PROFILES, LocalSetup, record_startup
+from tests.benchmarks.report import print_table, write_json
+from tests.benchmarks.stack import DOCKER_COMPOSE_PATH, docker_compose, render
+
+
+def time_to_ready(timeout):
+    docker_compose("down", "-v")
+    try:
+        timeline = record_startup(DOCKER_COMPOSE_PATH, timeout=timeout)
+    finally:
+        docker_compose("down", "-v")
+    if not timeline.complete():
+        print(timeline.render())
+        return None
+    return max(timeline.ready(name) for name in timeline.times) - timeline.origin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stack time-to-ready per healthcheck profile")
+    parser.add_argument("--versions", default=",".join(sorted(LocalSetup.SUPPORTED_VERSIONS)),
+                        help="comma separated stack versions")
+    parser.add_argument("--compose-args", default="", help="additional compose.py start arguments")
+    parser.add_argument("--runs", type=int, default=1, help="startups per version and profile, the median is reported")
+    parser.add_argument("--timeout", type=int, default=600, help="seconds to wait for the stack to become ready")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    compose_args = shlex.split(args.compose_args)
+    results = {}
+    for version in args.versions.split(","):
+        results[version] = {}
+        for profile in HEALTHCHECK_PROFILES:
+            render(version, ["--healthcheck-profile", profile] + compose_args)
+            docker_compose("pull", "--ignore-pull-failures")
+            docker_compose("build")
+            runs = [time_to_ready(args.timeout) for _ in range(args.runs)]
+            ready = [r for r in runs if r is not None]
+            results[version][profile] = {
+                "runs": runs,
+                "median": statistics.median(ready) if ready else None,
+            }
+
+    rows = []
+    for version, profiles in results.items():
+        default, fast = profiles["default"]["median"], profiles["fast"]["median"]
+        saved = "{:.1f}s".format(default - fast) if default and fast else None
+        rows.append([version] + ["{:.1f}s".format(profiles[p]["median"]) if profiles[p]["median"] else None
+                                 for p in HEALTHCHECK_PROFILES] + [saved])
+    print_table(["version"] + list(HEALTHCHECK_PROFILES) + ["saved"], rows)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
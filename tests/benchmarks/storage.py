@@ -0,0 +1,112 @@
+"""
+Bytes on disk per event of each agent service, event type and apm-server version, after a load run.
+
+Elasticsearch only reports store sizes per index, so each index's primary store size is split
+over its documents evenly, by the number of each service's events of each type in it. Force
+merging first makes sizes comparable between runs, fresh segments compress worse.
+
+    make test-agent-python; make bench-storage BENCH_ARGS="--forcemerge"
+"""
+import argparse
+import re
+
+import elasticsearch
+
+from tests.benchmarks.report import print_table, write_json
+from tests.fixtures import default
+
+INDEX = "apm-*"
+# agents' service name before and after ECS
+SERVICE_FIELDS = ("context.service.name", "service.name")
+VERSION_RE = re.compile(r"^apm-(\d+\.\d+\.\d+(?:-(?:alpha|beta|rc)\d+)?(?:-SNAPSHOT)?)-")
+
+
+def index_version(index):
+    match = VERSION_RE.match(index)
+    return match.group(1) if match else None
+
+
+def index_sizes(es, index=INDEX):
+    """primary store bytes and document count of each index"""
+    stats = es.indices.stats(index=index, metric="store,docs")
+    return {name: {"bytes": s["primaries"]["store"]["size_in_bytes"], "docs": s["primaries"]["docs"]["count"]}
+            for name, s in stats["indices"].items()}
+
+
+def index_events(es, index=INDEX):
+    """documents in each index by event type and service, {index: {(event, service): docs}}"""
+    for field in SERVICE_FIELDS:
+        result = es.search(index=index, body={
+            "size": 0,
+            "aggs": {"indices": {
+                "terms": {"field": "_index", "size": 1000},
+                "aggs": {"events": {
+                    "terms": {"field": "processor.event", "size": 20},
+                    "aggs": {"services": {"terms": {"field": field, "size": 1000, "missing": "-"}}},
+                }},
+            }},
+        })
+        buckets = result["aggregations"]["indices"]["buckets"]
+        events = {b["key"]: {(e["key"], s["key"]): s["doc_count"]
+                             for e in b["events"]["buckets"] for s in e["services"]["buckets"]} for b in buckets}
+        # the older field is missing everywhere on newer versions
+        if any(service != "-" for counts in events.values() for _, service in counts):
+            return events
+    return events
+
+
+def storage(sizes, events):
+    """bytes and events by (service, event, version), each index's size apportioned by document count"""
+    report = {}
+    for index, counts in events.items():
+        size = sizes.get(index)
+        if not size or not size["docs"]:
+            continue
+        bytes_per_doc = size["bytes"] / float(size["docs"])
+        for (event, service), docs in counts.items():
+            key = (service, event, index_version(index))
+            entry = report.setdefault(key, {"events": 0, "bytes": 0})
+            entry["events"] += docs
+            entry["bytes"] += docs * bytes_per_doc
+    for entry in report.values():
+        entry["bytes_per_event"] = entry["bytes"] / entry["events"] if entry["events"] else None
+    return report
+
+
+def collect(es, index=INDEX, forcemerge=False):
+    es.indices.refresh(index=index)
+    if forcemerge:
+        es.indices.forcemerge(index=index, max_num_segments=1, request_timeout=600)
+    return storage(index_sizes(es, index), index_events(es, index))
+
+
+def as_rows(report):
+    # versions are None for indices named otherwise
+    ordered = sorted(report.items(), key=lambda item: [str(k) for k in item[0]])
+    return [{"service": service, "event": event, "version": version, "events": r["events"], "bytes": r["bytes"],
+             "bytes_per_event": r["bytes_per_event"]} for (service, event, version), r in ordered]
+
+
+def print_storage(rows):
+    print_table(["service", "event", "version", "events", "MB", "bytes/event"], [
+        [r["service"], r["event"], r["version"], r["events"], "{:.1f}".format(r["bytes"] / 2.0 ** 20),
+         "{:.0f}".format(r["bytes_per_event"])] for r in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bytes on disk per event of each agent service")
+    parser.add_argument("--es-url", default=default.from_env("ES_URL"))
+    parser.add_argument("--index", default=INDEX)
+    parser.add_argument("--forcemerge", action="store_true", help="merge each index to one segment first")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    es = elasticsearch.Elasticsearch(args.es_url.split(","))
+    rows = as_rows(collect(es, args.index, args.forcemerge))
+    print_storage(rows)
+    if args.json:
+        write_json(args.json, rows)
+
+
+if __name__ == "__main__":
+    main()
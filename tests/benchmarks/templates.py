@@ -0,0 +1,121 @@
+"""
+Compare apm index template presets under the same direct intake load.
+
+For every `--apm-server-template-preset` the stack is started from scratch, so apm-server loads
+the preset's template, and the same load is sent for a fixed duration. Reported per preset:
+
+- events sent and indexed per second, until everything accepted is indexed
+- the median time Elasticsearch takes for queries like the APM UI's, over the indexed events
+- bytes on disk per event, optionally after force merging
+
+    python -m tests.benchmarks.templates --presets default,best-compression --duration 120
+
+This replaces docker-compose.yml in the repository root and removes the stack's volumes.
+"""
+import argparse
+import collections
+import shlex
+import statistics
+
+import elasticsearch
+
+from scripts.compose import ApmServer
+from tests.benchmarks import intake, storage
+from tests.benchmarks.indexing import measure_indexing
+from tests.benchmarks.report import print_table, write_json
+from tests.benchmarks.stack import start
+from tests.fixtures import default
+
+# queries timed against the indexed transactions, modelled on the APM UI's service overview
+QUERIES = collections.OrderedDict([
+    ("transaction groups", {
+        "size": 0,
+        "query": {"term": {"processor.event": "transaction"}},
+        "aggs": {"transactions": {
+            "terms": {"field": "transaction.name", "size": 100},
+            "aggs": {
+                "avg": {"avg": {"field": "transaction.duration.us"}},
+                "p95": {"percentiles": {"field": "transaction.duration.us", "percents": [95]}},
+            },
+        }},
+    }),
+    ("duration histogram", {
+        "size": 0,
+        "query": {"term": {"processor.event": "transaction"}},
+        "aggs": {"timeline": {
+            "date_histogram": {"field": "@timestamp", "interval": "1s", "min_doc_count": 0},
+            "aggs": {"avg": {"avg": {"field": "transaction.duration.us"}}},
+        }},
+    }),
+    ("latest transactions", {
+        "size": 10,
+        "query": {"term": {"processor.event": "transaction"}},
+        "sort": [{"@timestamp": "desc"}],
+    }),
+])
+
+
+def start_stack(args, preset):
+    start(args.version, shlex.split(args.compose_args) + ["--apm-server-template-preset", preset],
+          args.apm_server_url, args.es_url, fresh=True)
+
+
+def query_ms(es, runs, index="apm-*"):
+    """median server side time of each query, with the request cache off"""
+    return {name: statistics.median(
+        es.search(index=index, body=query, request_cache=False)["took"] for _ in range(runs))
+        for name, query in QUERIES.items()}
+
+
+def measure(es, args, preset, body):
+    result = measure_indexing(es, args.apm_server_url, body, args.duration, args.concurrency, args.drain_timeout,
+                              params={"preset": preset})
+    # before merging for the sizes changes the segments queried
+    queries = query_ms(es, args.query_runs)
+    stored = storage.collect(es, forcemerge=args.forcemerge)
+    events = sum(r["events"] for r in stored.values())
+    result.update({
+        "preset": preset,
+        "query_ms": queries,
+        "bytes_per_event": sum(r["bytes"] for r in stored.values()) / events if events else None,
+        "storage": storage.as_rows(stored),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="throughput, query time and storage per apm index template preset")
+    parser.add_argument("--presets", default=",".join(ApmServer.TEMPLATE_PRESETS),
+                        help="comma separated presets to compare")
+    parser.add_argument("--version", default="master", help="stack version")
+    parser.add_argument("--compose-args", default="", help="additional compose.py start arguments for every preset")
+    parser.add_argument("--duration", type=int, default=60, help="seconds of load per preset")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent intake requests")
+    parser.add_argument("--transactions-per-request", type=int, default=10, help="transactions in each request")
+    parser.add_argument("--drain-timeout", type=int, default=300,
+                        help="seconds to wait for the accepted events to be indexed")
+    parser.add_argument("--query-runs", type=int, default=10, help="runs of each query, the median is reported")
+    parser.add_argument("--forcemerge", action="store_true", help="merge the indices to one segment before sizing")
+    parser.add_argument("--apm-server-url", default=default.from_env("APM_SERVER_URL"))
+    parser.add_argument("--es-url", default=default.from_env("ES_URL"))
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    es = elasticsearch.Elasticsearch([args.es_url])
+    body = intake.payload(args.transactions_per_request)
+    results = []
+    for preset in args.presets.split(","):
+        start_stack(args, preset)
+        results.append(measure(es, args, preset, body))
+
+    print_table(["preset", "sent/s", "indexed/s"] + ["{} ms".format(q) for q in QUERIES] + ["bytes/event"], [
+        [r["preset"], "{:.0f}".format(r["load"]["events_per_second"]), "{:.0f}".format(r["indexed_per_second"])] +
+        [r["query_ms"][q] for q in QUERIES] +
+        ["{:.0f}".format(r["bytes_per_event"]) if r["bytes_per_event"] else None]
+        for r in results])
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import time
+import unittest
+
+from scripts.tests.fakes import StubServer
+from tests.agent.concurrent_requests import Concurrent
+from tests.benchmarks.expvar import ExpvarSampler, derived, lookup, summarize
+from tests.benchmarks.fakes import FakeEsFixture
+from tests.benchmarks.hooks import run_load
+
+
+def expvars(n):
+    """canned /debug/vars after n seconds of load: 1000 events/s in, 900/s published"""
+    return {
+        "cmdline": ["apm-server", "-e", "--httpprof", ":6060"],
+        "libbeat.pipeline.events.total": 1000 * n,
+        "libbeat.output.events.acked": 900 * n,
+        "libbeat.pipeline.events.active": 100 * n,
+        "libbeat.output.events.active": 90,
+        "memstats": {"PauseTotalNs": 2000000 * n, "NumGC": 3 * n, "HeapInuse": 2 ** 20 * (n + 1)},
+    }
+
+
+def expvar_server():
+    """serves the canned vars, one second of load further along on every request"""
+    def debug_vars(method, path, body):
+        if path != "/debug/vars":
+            return 404, None
+        return 200, expvars(server.requests.count(path) - 1)
+
+    server = StubServer(debug_vars)
+    return server
+
+
+class ExpvarTest(unittest.TestCase):
+    def setUp(self):
+        self.server = expvar_server()
+        self.addCleanup(self.server.close)
+
+    def test_lookup(self):
+        self.assertEqual(3, lookup({"a.b": 3}, "a.b"))
+        self.assertEqual(3, lookup({"a": {"b": 3}}, "a.b"))
+        self.assertEqual(0, lookup({"a": 1}, "a.b"))
+
+    def test_derived(self):
+        sampler = ExpvarSampler(self.server.url)
+        samples = [(n, sampler.sample()) for n in range(3)]
+        series = derived(samples)
+        self.assertEqual([1, 2], [s["seconds"] for s in series])
+        self.assertEqual(1000, series[0]["received_per_second"])
+        self.assertEqual(900, series[0]["published_per_second"])
+        self.assertEqual(200, series[1]["queue"])
+        self.assertEqual(100, series[0]["bulk_latency_ms"])
+        self.assertEqual(2, series[0]["gc_pause_ms"])
+        self.assertEqual(3, series[1]["heap_inuse_mb"])
+
+        summary = summarize(samples)
+        self.assertEqual(1000, summary["received_per_second"])
+        self.assertEqual(200, summary["queue_max"])
+        self.assertEqual(100, summary["bulk_latency_ms"])
+        self.assertEqual((4, 6, 3), (summary["gc_pause_ms"], summary["gc_count"], summary["heap_inuse_max_mb"]))
+        self.assertEqual({}, summarize(samples[:1]))
+
+    def test_concurrent(self):
+        sampler = ExpvarSampler(self.server.url, interval=0.05)
+        concurrent = Concurrent(FakeEsFixture(), [], hooks=[sampler])
+        concurrent.load_test = lambda: time.sleep(0.2)
+        result = concurrent.load_iteration(1)
+        self.assertEqual(1, result["iteration"])
+        self.assertGreaterEqual(result["seconds"], 0.2)
+        # sampled at the start, while the load ran and at the end
+        self.assertGreater(len(sampler.samples), 3)
+        self.assertGreater(result["expvar"]["received_per_second"], 0)
+        self.assertEqual(len(sampler.samples) - 1, len(result["expvar"]["series"]))
+
+    def test_intake(self):
+        # drivers whose load result isn't a dict read the summary from the sampler
+        sampler = ExpvarSampler(self.server.url, interval=0.05)
+        run_load(lambda: time.sleep(0.2) or 0.2, 0.2, {}, [sampler])
+        self.assertGreater(sampler.summary()["received_per_second"], 0)
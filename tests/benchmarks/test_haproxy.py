@@ -0,0 +1,38 @@
+import unittest
+
+from tests.benchmarks.haproxy import balance, parse_stats, servers
+from tests.benchmarks.report import percentiles
+
+STATS = """# pxname,svname,qcur,qmax,scur,stot,status,\
+hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,qtime,rtime,ttime,
+http,FRONTEND,,,3,310,OPEN,0,300,0,10,0,0,,,,
+servers,apm-server-1,4,9,1,200,UP,0,195,0,5,0,0,2,11,13,
+servers,apm-server-2,0,0,2,110,DOWN,0,105,0,5,0,0,0,5,,
+servers,BACKEND,4,9,3,310,UP,0,300,0,10,0,0,1,8,9,
+stats,FRONTEND,,,1,1,OPEN,0,1,0,0,0,0,,,,
+"""
+
+
+class HaproxyTest(unittest.TestCase):
+    def test_servers(self):
+        self.assertEqual({
+            "apm-server-1": {"status": "UP", "requests": 200, "sessions": 1, "sessions_total": 200, "queued": 4,
+                             "queued_max": 9, "queue_ms": 2, "response_ms": 11, "total_ms": 13},
+            "apm-server-2": {"status": "DOWN", "requests": 110, "sessions": 2, "sessions_total": 110, "queued": 0,
+                             "queued_max": 0, "queue_ms": 0, "response_ms": 5, "total_ms": None},
+        }, servers(parse_stats(STATS)))
+
+    def test_balance(self):
+        before = {"apm-server-1": {"requests": 100}, "apm-server-2": {"requests": 100}}
+        after = {"apm-server-1": {"requests": 400}, "apm-server-2": {"requests": 200}}
+        handled, skew = balance(before, after)
+        self.assertEqual({"apm-server-1": 300, "apm-server-2": 100}, handled)
+        self.assertEqual(1.5, skew)
+        self.assertEqual(({"apm-server-1": 0}, None), balance(after, {"apm-server-1": {"requests": 400}}))
+
+
+class PercentilesTest(unittest.TestCase):
+    def test_percentiles(self):
+        self.assertEqual({"p50": 50, "p90": 90, "p99": 99}, percentiles(range(100, 0, -1)))
+        self.assertEqual({"p50": 7}, percentiles([7], ps=(50,)))
+        self.assertEqual({"p50": None}, percentiles([], ps=(50,)))
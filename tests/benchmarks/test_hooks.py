@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+import time
+import unittest
+
+from scripts.tests.fakes import PprofServer
+from tests.benchmarks.hooks import LoadHook, ProfileHook, offsets, run_load
+
+
+class RecordingHook(LoadHook):
+    def __init__(self, window=0):
+        self.window = window
+        self.calls = []
+
+    def before_load(self, params):
+        self.calls.append(("before", None))
+
+    def at(self, point, params):
+        self.calls.append((point, time.time()))
+
+    def after_load(self, params, result):
+        self.calls.append(("after", result))
+
+
+class HooksTest(unittest.TestCase):
+    def test_offsets(self):
+        self.assertEqual({"start": 0, "peak": 25, "end": 50}, offsets(60, 10))
+        # longer than the load, everything at the start
+        self.assertEqual({"start": 0, "peak": 0, "end": 0}, offsets(5, 10))
+
+    def test_run_load(self):
+        hook = RecordingHook(window=0.1)
+        start = time.time()
+        result = run_load(lambda: time.sleep(0.3) or "done", 0.3, {}, [hook])
+        self.assertEqual(["before", "start", "peak", "end", "after"], [c[0] for c in hook.calls])
+        self.assertEqual("done", result)
+        self.assertEqual("done", hook.calls[-1][1])
+        self.assertAlmostEqual(0.2, hook.calls[3][1] - start, delta=0.05)
+
+    def test_failing_load(self):
+        def load():
+            time.sleep(0.05)
+            raise IOError("apm-server unreachable")
+
+        hook = RecordingHook()
+        start = time.time()
+        with self.assertRaises(IOError):
+            run_load(load, 10, {}, [hook])
+        # the peak and end points are skipped, the hook still hears the load is over
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(["before", "start", "after"], [c[0] for c in hook.calls])
+        self.assertIsNone(hook.calls[-1][1])
+
+    def test_failing_hook(self):
+        class Failing(LoadHook):
+            def at(self, point, params):
+                raise IOError("monitor unreachable")
+
+        self.assertEqual("done", run_load(lambda: "done", 0, {}, [Failing()]))
+
+    def test_profile_hook(self):
+        pprof = PprofServer()
+        self.addCleanup(pprof.close)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        run_load(lambda: None, 0, {"concurrency": 1}, [ProfileHook(pprof.url, tmpdir, seconds=0, profiles=["heap"])])
+        self.assertEqual(["/debug/pprof/heap"] * 3, pprof.requests)
@@ -0,0 +1,71 @@
+import time
+import unittest
+
+from scripts.tests.fakes import StubServer
+from tests.benchmarks import intake
+from tests.benchmarks.fakes import FakeElasticsearch
+from tests.benchmarks.indexing import IndexingStats, IndexingTotals, measure_indexing, nodes_stats, stats_window
+
+
+def node(n, pools=("write",)):
+    return {
+        "indices": {
+            "indexing": {"index_total": 1000 * n, "index_time_in_millis": 100 * n},
+            "merges": {"total": n, "total_time_in_millis": 50 * n},
+            "refresh": {"total": 2 * n, "total_time_in_millis": 20 * n},
+        },
+        "thread_pool": dict((pool, {"completed": 10 * n, "rejected": n, "queue": 5}) for pool in pools),
+    }
+
+
+def cluster(n):
+    # a 6.x cluster with a node still reporting the bulk pool
+    return {"nodes": {"a": node(n), "b": node(n, pools=("write", "bulk"))}}
+
+
+class IndexingStatsTest(unittest.TestCase):
+    def test_nodes_stats(self):
+        self.assertEqual({
+            "index_total": 2000, "index_time": 200, "merges": 2, "merge_time": 100, "refreshes": 4,
+            "refresh_time": 40, "write_completed": 30, "write_rejected": 3, "write_queue": 15,
+        }, nodes_stats(FakeElasticsearch(nodes_stats=cluster)))
+
+    def test_window(self):
+        es = FakeElasticsearch(nodes_stats=cluster)
+        samples = [(0, nodes_stats(es)), (5, dict(nodes_stats(es), write_queue=40)), (10, nodes_stats(es))]
+        window = stats_window(samples)
+        self.assertEqual(400, window["index_per_second"])
+        self.assertEqual((6, 200, 80), (window["write_rejected"], window["merge_ms"], window["refresh_ms"]))
+        self.assertEqual(40, window["write_queue_max"])
+        self.assertEqual({}, stats_window(samples[:1]))
+
+    def test_hook(self):
+        es = FakeElasticsearch(nodes_stats=cluster)
+        hook = IndexingStats(es)
+        hook.before_load({})
+        hook.after_load({}, None)
+        # only before and after the load
+        self.assertEqual(2, es.nodes.calls)
+        self.assertEqual(2, hook.summary()["merges"])
+
+        es = FakeElasticsearch(nodes_stats=cluster)
+        hook = IndexingStats(es, interval=0.02)
+        hook.before_load({})
+        time.sleep(0.1)
+        hook.after_load({}, None)
+        self.assertGreater(es.nodes.calls, 3)
+
+    def test_measure_indexing(self):
+        server = StubServer(lambda method, path, body: (202, None))
+        self.addCleanup(server.close)
+        # everything accepted is indexed right away, 10 events a request
+        es = FakeElasticsearch(count=lambda index, body: 10 * len(server.requests), nodes_stats=cluster)
+        totals = IndexingTotals(es)
+        result = measure_indexing(es, server.url, intake.payload(10), duration=0.2, concurrency=2, drain_timeout=5,
+                                  hooks=[totals])
+        self.assertEqual(["delete", "refresh"], es.indices.calls[:2])
+        self.assertGreater(result["load"]["events"], 0)
+        self.assertEqual(result["load"]["events"], result["indexed"])
+        self.assertGreater(result["indexed_per_second"], 0)
+        # from when the load started, a call later on both nodes
+        self.assertEqual(2000, totals.since()["index_total"])
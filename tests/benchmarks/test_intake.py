@@ -0,0 +1,88 @@
+import datetime
+import json
+import time
+import unittest
+
+from scripts.tests.fakes import StubServer
+from tests.benchmarks import intake
+
+
+def intake_server(reject=()):
+    """accepts v1 transactions, rejects the requests of services listed in reject with a full queue
+
+    The decoded request bodies are kept in the server's bodies.
+    """
+    def accept(method, path, body):
+        body = json.loads(body.decode("utf8"))
+        server.bodies.append(body)
+        return 503 if body["service"]["name"] in reject else 202, None
+
+    server = StubServer(accept)
+    server.bodies = []
+    return server
+
+
+class IntakeTest(unittest.TestCase):
+    def test_payload(self):
+        body = intake.payload(3, spans=2)
+        self.assertEqual(9, intake.event_count(body))
+        self.assertEqual(["id", "name", "type", "start", "duration"], list(body["transactions"][0]["spans"][0]))
+        self.assertEqual(3, intake.event_count(intake.payload(3)))
+        self.assertNotIn("spans", intake.payload(1)["transactions"][0])
+
+    def test_payloads(self):
+        self.assertEqual(["intake-benchmark-1", "intake-benchmark-2", "intake-benchmark-3"],
+                         [b["service"]["name"] for b in intake.payloads(2, services=3)])
+        self.assertEqual(["intake-benchmark"], [b["service"]["name"] for b in intake.payloads(1)])
+
+    def test_stamp(self):
+        body = intake.payload(3, spans=2)
+        encoded = intake.encode(body)
+        first, second = [json.loads(intake.stamp(encoded).decode("utf8")) for _ in range(2)]
+        ids = [t["id"] for t in first["transactions"] + second["transactions"]]
+        self.assertEqual(6, len(set(ids)))
+        self.assertNotIn(intake.ID_PLACEHOLDER, ids)
+        timestamp = datetime.datetime.strptime(first["transactions"][0]["timestamp"], intake.TIMESTAMP_FORMAT)
+        self.assertLess(abs(datetime.datetime.utcnow() - timestamp), datetime.timedelta(seconds=5))
+        # everything else as encoded
+        for t in first["transactions"]:
+            del t["id"], t["timestamp"]
+        for t in body["transactions"]:
+            del t["id"], t["timestamp"]
+        self.assertEqual(body, first)
+
+    def test_run(self):
+        server = intake_server(reject={"intake-benchmark-2"})
+        self.addCleanup(server.close)
+        result = intake.run(server.url, intake.payloads(2, spans=1, services=2), duration=0.3, concurrency=2)
+        self.assertGreater(result["requests"], 0)
+        self.assertEqual(result["requests"], sum(result["status"].values()))
+        self.assertEqual(result["errors"], result["status"]["503"])
+        # every request has 2 transactions with a span each
+        self.assertEqual(4 * result["status"]["202"], result["events"])
+        self.assertEqual(4 * result["status"]["503"], result["rejected"])
+        self.assertIsNotNone(result["latency_ms"]["p99"])
+        # transaction ids are fresh in every request
+        ids = [t["id"] for b in server.bodies for t in b["transactions"]]
+        self.assertEqual(len(ids), len(set(ids)))
+        # both services were sent
+        self.assertEqual({"intake-benchmark-1", "intake-benchmark-2"}, {b["service"]["name"] for b in server.bodies})
+
+    def test_rate(self):
+        server = intake_server()
+        self.addCleanup(server.close)
+        # 10 events a request, 200 events/s is 20 requests a second
+        result = intake.run(server.url, intake.payload(10), duration=1, concurrency=4, rate=200)
+        self.assertTrue(18 <= result["requests"] <= 22, result["requests"])
+        self.assertEqual(0, result["errors"])
+        self.assertEqual(10 * result["requests"], result["events"])
+        self.assertEqual(0, result["missed"])
+
+    def test_rate_not_kept_up(self):
+        server = StubServer(lambda method, path, body: time.sleep(0.4) or (202, None))
+        self.addCleanup(server.close)
+        # a request due every 0.1s, each taking 0.4s
+        result = intake.run(server.url, intake.payload(10), duration=1, concurrency=1, rate=100)
+        self.assertLess(result["seconds"], 1.6)
+        self.assertAlmostEqual(10, result["requests"] + result["missed"], delta=1)
+        self.assertGreater(result["missed"], 0)
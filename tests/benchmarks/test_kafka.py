@@ -0,0 +1,53 @@
+import threading
+import unittest
+
+from scripts.tests.fakes import DockerTestCase, listed_container
+from tests.benchmarks.kafka import ConsumerLagProbe, parse_consumer_groups
+
+DESCRIBE = """
+Consumer group 'logstash' has no active members.
+
+TOPIC                      PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG        CONSUMER-ID  HOST  CLIENT-ID
+apm-intake-benchmark       0          1500            1700            200        -            -     -
+apm-intake-benchmark       1          1600            1650            50         -            -     -
+apm                        0          -               3               -          -            -     -
+"""
+
+
+class ParseTest(unittest.TestCase):
+    def test_parse_consumer_groups(self):
+        self.assertEqual([
+            {"topic": "apm-intake-benchmark", "partition": 0, "lag": 200},
+            {"topic": "apm-intake-benchmark", "partition": 1, "lag": 50},
+            {"topic": "apm", "partition": 0, "lag": None},
+        ], parse_consumer_groups(DESCRIBE))
+        self.assertEqual([], parse_consumer_groups("Error: Consumer group 'logstash' does not exist."))
+
+
+class ConsumerLagProbeTest(DockerTestCase):
+    def test_lag(self):
+        self.docker.containers = [listed_container("kafka")]
+        self.docker.execs["localtesting_6.3.3_kafka"] = (0, DESCRIBE, 0)
+        probe = ConsumerLagProbe(interval=0.05)
+        probe.before_load({})
+        probe.after_load({}, None)
+        self.assertEqual(250, probe.summary()["max_lag"])
+        self.assertEqual(250, probe.summary()["end_lag"])
+        # never drained without a drain timeout
+        self.assertIsNone(probe.summary()["drain_seconds"])
+        self.assertEqual(["kafka-consumer-groups", "--bootstrap-server", "localhost:9092", "--describe", "--group",
+                          "logstash"], self.docker.requests[-3][2]["Cmd"])
+
+    def test_drain(self):
+        self.docker.containers = [listed_container("kafka")]
+        self.docker.execs["localtesting_6.3.3_kafka"] = (0, DESCRIBE, 0)
+        drained = DESCRIBE.replace(" 200 ", " 0   ").replace(" 50 ", " 0  ")
+        # logstash catches up shortly after the load
+        threading.Timer(0.2, self.docker.execs.__setitem__, ["localtesting_6.3.3_kafka", (0, drained, 0)]).start()
+        probe = ConsumerLagProbe(interval=0.05, drain_timeout=5)
+        probe.before_load({})
+        probe.after_load({}, None)
+        summary = probe.summary()
+        self.assertEqual(250, summary["end_lag"])
+        self.assertEqual(0, summary["samples"][-1][1])
+        self.assertGreater(summary["drain_seconds"], 0)
@@ -0,0 +1,48 @@
+import unittest
+
+from tests.benchmarks.logstash import PipelineStatsProbe, compare, pipeline_stats
+
+
+def node_stats(events_in, events_out, filter_ms, output_ms):
+    return {"pipelines": {"main": {
+        "events": {"in": events_in, "out": events_out, "filtered": events_out,
+                   "duration_in_millis": filter_ms + output_ms},
+        "plugins": {
+            "inputs": [{"id": "apm-server", "name": "beats", "events": {"out": events_in}}],
+            "filters": [{"id": "index-suffix-event", "name": "mutate",
+                         "events": {"in": events_out, "out": events_out, "duration_in_millis": filter_ms}}],
+            "outputs": [{"id": "apm-elasticsearch", "name": "elasticsearch",
+                         "events": {"in": events_out, "out": events_out, "duration_in_millis": output_ms}}],
+        },
+        "queue": {"type": "persisted", "events": events_in - events_out},
+    }}}
+
+
+class LogstashTest(unittest.TestCase):
+    def test_pipeline_stats(self):
+        stats = pipeline_stats(node_stats(100, 90, 10, 40))
+        self.assertEqual((100, 90, 50, 10), (stats["in"], stats["out"], stats["duration_ms"], stats["queued"]))
+        self.assertEqual({"kind": "output", "name": "elasticsearch", "in": 90, "out": 90, "duration_ms": 40},
+                         stats["plugins"]["apm-elasticsearch"])
+        self.assertEqual("input", stats["plugins"]["apm-server"]["kind"])
+
+    def test_compare(self):
+        before = pipeline_stats(node_stats(100, 100, 10, 40))
+        after = pipeline_stats(node_stats(1100, 900, 90, 760))
+        result = compare(before, after, 10)
+        self.assertEqual(100, result["in_per_second"])
+        self.assertEqual(80, result["out_per_second"])
+        self.assertEqual(200, result["queued"])
+        self.assertEqual("apm-elasticsearch", result["bottleneck"])
+        output = result["plugins"]["apm-elasticsearch"]
+        self.assertEqual(0.9, output["ms_per_event"])
+        self.assertEqual(0.9, output["share"])
+        self.assertIsNone(result["plugins"]["apm-server"]["share"])
+
+    def test_summary_needs_two_samples(self):
+        probe = PipelineStatsProbe("http://localhost:9600")
+        self.assertEqual({}, probe.summary())
+        probe.samples.append((0, pipeline_stats(node_stats(100, 100, 10, 40))))
+        self.assertEqual({}, probe.summary())
+        probe.samples.append((10, pipeline_stats(node_stats(1100, 900, 90, 760))))
+        self.assertEqual(100, probe.summary()["in_per_second"])
@@ -0,0 +1,64 @@
+import unittest
+
+from tests.benchmarks.fakes import FakeElasticsearch
+from tests.benchmarks.metricbeat import MetricbeatWindow, container_usage, queue_depth
+
+
+def responses(by_key):
+    """answer searches with the aggregations of the first response whose key is in the query"""
+    def search(index, body):
+        aggs = body["aggs"]
+        if "containers" in aggs:
+            field = aggs["containers"]["terms"]["field"]
+            return {"aggregations": {"containers": {"buckets": by_key.get(field, [])}}}
+        return {"aggregations": by_key["queue"]}
+    return search
+
+
+def container(name, cpu_avg, cpu_max, memory):
+    return {"key": name, "cpu_avg": {"value": cpu_avg}, "cpu_max": {"value": cpu_max},
+            "memory_max": {"value": memory}}
+
+
+QUEUE = {
+    "max": {"value": 4096},
+    "avg": {"value": 1024},
+    "series": {"buckets": [
+        {"key": 100000, "depth": {"value": 0}},
+        {"key": 101000, "depth": {"value": 4096}},
+    ]},
+}
+
+
+class MetricbeatTest(unittest.TestCase):
+    def test_queue_depth(self):
+        es = FakeElasticsearch(responses({"queue": QUEUE}))
+        depth = queue_depth(es, 100, 102)
+        self.assertEqual({"max": 4096, "avg": 1024, "series": [(0, 0), (1, 4096)]}, depth)
+        time_range = es.searches[0]["body"]["query"]["bool"]["filter"][0]["range"]["@timestamp"]
+        self.assertEqual((100000, 102000), (time_range["gte"], time_range["lte"]))
+
+    def test_container_usage(self):
+        # 6.x metricbeat only has the docker module's container name
+        apm_server = container("localtesting_apm-server", 0.5, 1.5, 2 ** 21)
+        es = FakeElasticsearch(responses({"docker.container.name": [apm_server]}))
+        self.assertEqual({"localtesting_apm-server": {"cpu_cores_avg": 0.5, "cpu_cores_max": 1.5, "memory_max_mb": 2}},
+                         container_usage(es, 100, 102))
+        self.assertEqual(["container.name", "docker.container.name"],
+                         [s["body"]["aggs"]["containers"]["terms"]["field"] for s in es.searches])
+        self.assertEqual({}, container_usage(FakeElasticsearch(responses({})), 100, 102))
+
+    def test_window(self):
+        es = FakeElasticsearch(responses({"queue": QUEUE, "container.name": [container("apm-server", 0.1, 0.2, 0)]}))
+        window = MetricbeatWindow(es, settle=0)
+        window.before_load({})
+        window.after_load({}, None)
+        self.assertLessEqual(window.start, window.end)
+        self.assertEqual(4096, window.summary()["queue_depth"]["max"])
+        self.assertEqual(["apm-server"], list(window.summary()["containers"]))
+
+        # a failed query leaves the load's results alone
+        window = MetricbeatWindow(FakeElasticsearch(responses({})), settle=0)
+        window.before_load({})
+        window.after_load({}, None)
+        self.assertIsNone(window.summary())
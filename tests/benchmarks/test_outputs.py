@@ -0,0 +1,55 @@
+import threading
+import unittest
+
+from scripts.tests.fakes import DockerTestCase, StubServer, listed_container
+from tests.benchmarks.fakes import FakeElasticsearch
+from tests.benchmarks.resources import ContainerStatsProbe, usage
+from tests.benchmarks.searchable import SearchableLagProbe
+
+
+def stats(cpu_ns, memory):
+    return {"cpu_stats": {"cpu_usage": {"total_usage": cpu_ns}}, "memory_stats": {"usage": memory}}
+
+
+class ResourcesTest(DockerTestCase):
+    def test_usage(self):
+        samples = [
+            (0, {"apm-server": {"cpu_ns": 0, "memory": 2 ** 20}, "kafka": {"cpu_ns": 0, "memory": 0}}),
+            (5, {"apm-server": {"cpu_ns": 5e9, "memory": 3 * 2 ** 20}}),
+            (10, {"apm-server": {"cpu_ns": 15e9, "memory": 2 ** 20}}),
+        ]
+        self.assertEqual({"apm-server": {"cpu_cores": 1.5, "memory_max_mb": 3}}, usage(samples))
+        self.assertEqual({}, usage(samples[:1]))
+
+    def test_probe(self):
+        self.docker.containers = [listed_container("apm-server"), listed_container("elasticsearch")]
+        self.docker.stats = {
+            "localtesting_6.3.3_apm-server": stats(10, 100),
+            "localtesting_6.3.3_elasticsearch": stats(20, 200),
+        }
+        probe = ContainerStatsProbe(interval=10)
+        self.assertEqual({"apm-server": {"cpu_ns": 10, "memory": 100},
+                          "elasticsearch": {"cpu_ns": 20, "memory": 200}}, probe.sample())
+
+
+def find_markers(index, body):
+    """finds every marker searched for"""
+    ids = [q["match_phrase"]["transaction.id"] for q in body["query"]["bool"]["should"]]
+    return {"hits": {"hits": [{"_source": {"transaction": {"id": i}}} for i in ids]}}
+
+
+class SearchableLagProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(lambda method, path, body: (202, None))
+        self.addCleanup(self.server.close)
+
+    def test_lag(self):
+        es = FakeElasticsearch(find_markers)
+        probe = SearchableLagProbe(self.server.url, es, interval=0.05, poll_interval=0.02, drain_timeout=1)
+        probe.before_load({})
+        threading.Event().wait(0.3)
+        probe.after_load({}, None)
+        summary = probe.summary()
+        self.assertGreater(summary["markers"], 2)
+        self.assertEqual(0, summary["missing"])
+        self.assertLess(summary["lag_ms"]["p99"], 1000)
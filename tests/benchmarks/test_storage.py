@@ -0,0 +1,50 @@
+import unittest
+
+from tests.benchmarks.fakes import FakeElasticsearch
+from tests.benchmarks.storage import as_rows, collect, index_version
+
+
+def index_bucket(index, events):
+    return {"key": index, "events": {"buckets": [
+        {"key": event, "services": {"buckets": [{"key": s, "doc_count": n} for s, n in services.items()]}}
+        for event, services in events.items()]}}
+
+
+INDICES_STATS = {"indices": {
+    "apm-6.4.0-transaction-2018.08.20": {"primaries": {"store": {"size_in_bytes": 40000}, "docs": {"count": 100}}},
+    "apm-6.4.0-span-2018.08.20": {"primaries": {"store": {"size_in_bytes": 30000}, "docs": {"count": 300}}},
+}}
+
+
+def services(ecs):
+    """documents of each service, under service.name with ecs and context.service.name otherwise"""
+    def search(index, body):
+        field = body["aggs"]["indices"]["aggs"]["events"]["aggs"]["services"]["terms"]["field"]
+        if ecs != (field == "service.name"):
+            buckets = [index_bucket("apm-6.4.0-transaction-2018.08.20", {"transaction": {"-": 100}})]
+        else:
+            buckets = [
+                index_bucket("apm-6.4.0-transaction-2018.08.20", {"transaction": {"flaskapp": 60, "railsapp": 40}}),
+                index_bucket("apm-6.4.0-span-2018.08.20", {"span": {"flaskapp": 200, "railsapp": 100}}),
+            ]
+        return {"aggregations": {"indices": {"buckets": buckets}}}
+    return search
+
+
+class StorageTest(unittest.TestCase):
+    def test_index_version(self):
+        self.assertEqual("6.4.0", index_version("apm-6.4.0-transaction-2018.08.20"))
+        self.assertEqual("7.0.0-alpha1", index_version("apm-7.0.0-alpha1-span"))
+        self.assertIsNone(index_version("apm"))
+
+    def test_collect(self):
+        for ecs in (False, True):
+            es = FakeElasticsearch(services(ecs), indices_stats=INDICES_STATS)
+            rows = as_rows(collect(es, forcemerge=True))
+            self.assertEqual(["refresh", "forcemerge", "stats"], es.indices.calls)
+            self.assertEqual([
+                ("flaskapp", "span", "6.4.0", 200, 100),
+                ("flaskapp", "transaction", "6.4.0", 60, 400),
+                ("railsapp", "span", "6.4.0", 100, 100),
+                ("railsapp", "transaction", "6.4.0", 40, 400),
+            ], [(r["service"], r["event"], r["version"], r["events"], r["bytes_per_event"]) for r in rows])
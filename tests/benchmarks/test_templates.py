@@ -0,0 +1,17 @@
+import unittest
+
+from tests.benchmarks.fakes import FakeElasticsearch
+from tests.benchmarks.templates import QUERIES, query_ms
+
+
+class TemplatesTest(unittest.TestCase):
+    def test_query_ms(self):
+        # each search takes as many ms as searches ran so far
+        es = FakeElasticsearch(lambda index, body: {"took": len(es.searches)})
+        took = query_ms(es, runs=3)
+        self.assertEqual(list(QUERIES), list(took))
+        # median of each query's three runs
+        self.assertEqual([2, 5, 8], list(took.values()))
+        self.assertFalse(any(s["request_cache"] for s in es.searches))
+        # transaction.name is a keyword in the apm template, its multi-field is .text
+        self.assertEqual("transaction.name", QUERIES["transaction groups"]["aggs"]["transactions"]["terms"]["field"])
@@ -24,6 +24,13 @@ JAVA_SPRING_URL = "http://localhost:8090"
 RUM_SERVICE_NAME = "rumapp"
 RUM_URL = "http://localhost:8000"
 
+# set when the stack is kept between sessions
+REUSE_CONTAINERS = ""
+# apm-server's monitor, eg http://localhost:6060, to sample its expvar metrics during load tests
+APM_SERVER_MONITOR_URL = ""
+# seconds between elasticsearch nodes stats samples during load tests, 0 for only before and after each load
+ES_STATS_INTERVAL = ""
+
 
 def from_env(var):
     return os.getenv(var, getattr(sys.modules[__name__], var))
@@ -11,13 +11,20 @@ from tests.fixtures import default
 def es():
     class Elasticsearch(object):
         def __init__(self, url):
-            self.es = elasticsearch.Elasticsearch([url])
+            # comma separated for several nodes
+            self.es = elasticsearch.Elasticsearch(url.split(","))
             self.index = "apm-*"
 
         def clean(self):
             self.es.indices.delete(self.index)
             self.es.indices.refresh()
 
+        def reset(self):
+            """drop data left by earlier sessions on a reused stack, templates and dashboards are kept"""
+            self.es.cluster.health(wait_for_status="yellow", request_timeout=60)
+            self.es.indices.delete(self.index, ignore=[404])
+            self.es.indices.refresh()
+
         def term_q(self, terms):
             t = []
             for idx in range(len(terms)):
@@ -35,4 +42,8 @@ def es():
                 ct = s['hits']['total']
             return s
 
-    return Elasticsearch(default.from_env("ES_URL"))
+    es = Elasticsearch(default.from_env("ES_URL"))
+    # a warm stack started with compose.py start --reuse
+    if default.from_env("REUSE_CONTAINERS"):
+        es.reset()
+    return es
@@ -0,0 +1,25 @@
+import pytest
+
+from tests.fixtures import default
+
+
+@pytest.fixture(autouse=True)
+def load_hooks(request):
+    """
+    hooks every Concurrent load of a test is run with, each enabled by its variable in tests/fixtures/default.py.
+
+    The benchmark modules and the es fixture are only used when one is.
+    """
+    from tests.agent.concurrent_requests import Concurrent
+    hooks = []
+    interval = default.from_env("ES_STATS_INTERVAL")
+    if interval:
+        from tests.benchmarks.indexing import IndexingStats
+        hooks.append(IndexingStats(request.getfixturevalue("es").es, float(interval) or None))
+    monitor_url = default.from_env("APM_SERVER_MONITOR_URL")
+    if monitor_url:
+        from tests.benchmarks.expvar import ExpvarSampler
+        hooks.append(ExpvarSampler(monitor_url))
+    Concurrent.default_hooks = hooks
+    yield hooks
+    Concurrent.default_hooks = ()